@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# admission.py - スコアリングの同時実行制御（アドミッション制御）
+
+"""
+スコアリング（Rscript / cat_engine）の同時実行数を上限で抑え、
+上限に達している間は短い待ち行列で待たせる。待ち行列が満杯、または
+期限内に順番が回ってこなかったリクエストは Overloaded を送出し、
+呼び出し側は 503 + Retry-After を返す。
+
+スロットは解放時に待ち行列の先頭へ直接引き渡す（FIFO）。同期版（WSGI の
+スレッド）と非同期版（asgi.py）は同じカウンタを共有するため、両方の経路が
+混在しても同時実行数の上限は1つに保たれる。
+"""
+
+import asyncio
+import collections
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+
+class Overloaded(Exception):
+    """スコアリングが混雑しているため受け付けられない"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """待ち行列の1要素（wake はスロットを引き渡されたときに呼ばれる）"""
+
+    __slots__ = ('wake', 'granted')
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class AdmissionController:
+    """上限付き同時実行数 + 期限付き待ち行列"""
+
+    def __init__(self, limit, max_queue, queue_timeout, retry_after=2):
+        """
+        Args:
+            limit (int): 同時に実行できるスコアリング数
+            max_queue (int): 待ち行列の最大長
+            queue_timeout (float): 待ち行列で待つ最大秒数
+            retry_after (int): 503 応答で返す再試行までの秒数
+        """
+        self.limit = max(1, int(limit))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self.retry_after = int(retry_after)
+
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+        self._in_flight = 0
+
+        # メトリクス
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._max_waiting = 0
+        self._wait_seconds = 0.0
+
+    def _try_enter(self, waiter):
+        """空きがあれば即時に入場、なければ待ち行列へ（満杯なら Overloaded）"""
+        with self._lock:
+            if self._in_flight < self.limit and not self._waiters:
+                self._in_flight += 1
+                self._admitted += 1
+                return True
+            if len(self._waiters) >= self.max_queue:
+                self._rejected += 1
+                raise Overloaded('queue_full', self.retry_after)
+            self._waiters.append(waiter)
+            self._queued += 1
+            self._max_waiting = max(self._max_waiting, len(self._waiters))
+            return False
+
+    def _give_up(self, waiter, started):
+        """
+        待ちを打ち切る。打ち切りと同時にスロットが引き渡されていた場合は False
+        （呼び出し側はそのまま入場済みとして扱う）
+        """
+        with self._lock:
+            self._wait_seconds += time.monotonic() - started
+            if waiter.granted:
+                self._admitted += 1
+                return False
+            self._waiters.remove(waiter)
+            return True
+
+    def _admit_waiter(self, started):
+        with self._lock:
+            self._wait_seconds += time.monotonic() - started
+            self._admitted += 1
+
+    def release(self):
+        """スロットを解放（待ちがあれば先頭に引き渡す）"""
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self._in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        """スコアリング1回分のスロットを確保（同期版）"""
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        if not self._try_enter(waiter):
+            started = time.monotonic()
+            if event.wait(self.queue_timeout):
+                self._admit_waiter(started)
+            elif self._give_up(waiter, started):
+                with self._lock:
+                    self._timed_out += 1
+                raise Overloaded('queue_timeout', self.retry_after)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self):
+        """スコアリング1回分のスロットを確保（非同期版、待機中にスレッドを占有しない）"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        waiter = _Waiter(wake)
+        if not self._try_enter(waiter):
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+                self._admit_waiter(started)
+            except asyncio.TimeoutError:
+                if self._give_up(waiter, started):
+                    with self._lock:
+                        self._timed_out += 1
+                    raise Overloaded('queue_timeout', self.retry_after)
+            except asyncio.CancelledError:
+                # クライアント切断: 引き渡し済みのスロットは返却する
+                if not self._give_up(waiter, started):
+                    self.release()
+                raise
+        try:
+            yield
+        finally:
+            self.release()
+
+    def status(self):
+        """メトリクス（管理画面・API 用）"""
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'max_queue': self.max_queue,
+                'queue_timeout': self.queue_timeout,
+                'in_flight': self._in_flight,
+                'waiting': len(self._waiters),
+                'max_waiting': self._max_waiting,
+                'admitted': self._admitted,
+                'queued': self._queued,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'avg_wait_ms': round(1000 * self._wait_seconds / self._queued, 1) if self._queued else 0.0
+            }
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# analytics.py - 管理画面・集計 API 用の読み取り専用スナップショット
+
+"""
+管理画面の集計やエクスポートは運用中のデータベースではなく、
+VACUUM INTO で定期的に作成したコピー（temp/analytics_snapshot.db）から読む。
+重い全件走査が受験者の回答の書き込み（submit_answer のコミット）と
+ロックを取り合わないようにするためのもの。
+
+- VACUUM INTO は1つの読み取りトランザクションでコピーする。運用中のデータベースは
+  WAL モードなので、コピー中も書き込みを止めず、書き込みがあっても最初から
+  やり直さない（バックアップ API のページ単位のコピーは、途中で書き込まれると
+  やり直しになり、回答が続く間は終わらない）。
+- コピーは別ファイルに作成してから os.replace で差し替えるため、読み取り中の
+  接続は差し替え前のファイルを最後まで読める。
+- 鮮度はファイルの更新時刻で判定するので、複数ワーカーでも同じコピーを共有する。
+  更新はロックファイル（fcntl.flock）で全プロセスを通じて1つだけ実行し、
+  ロックを取った後に鮮度を確認し直すので、同じコピーを何度も作らない。
+- コピーは運用中のデータベース全体を読む長い読み取りトランザクションで、その間は
+  WAL のチェックポイントが進まない。更新間隔（既定 DEFAULT_MAX_AGE = 20 分）は
+  コピーにかかる時間より十分長くし、管理画面には経過時間と更新間隔を表示する。
+- クエリプランナーの統計（sqlite_stat1）は VACUUM INTO で運用中のデータベースから
+  そのままコピーされるので、コピーごとに ANALYZE はしない（運用中に統計が
+  なければ、行数を制限した ANALYZE で作る）。
+- リクエストの処理中にはコピーしない。max_age を過ぎていれば古いコピーを返しつつ
+  バックグラウンドで更新し、コピーがまだなければ SnapshotBuilding を送出する
+  （呼び出し側は 503 + Retry-After を返す）。
+"""
+
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_PATH = os.path.join('temp', 'analytics_snapshot.db')
+DEFAULT_MAX_AGE = 20 * 60
+# 運用中のデータベースに統計がない場合の ANALYZE で、インデックスごとに読む行数
+ANALYSIS_LIMIT = 1000
+# コピーがまだない場合に、再試行までの待ち時間としてクライアントに返す秒数
+BUILDING_RETRY_AFTER = 10
+
+
+class SnapshotBuilding(Exception):
+    """コピーを作成中（まだ読めるコピーがない）"""
+
+    def __init__(self, retry_after=BUILDING_RETRY_AFTER):
+        super().__init__('集計用のスナップショットを作成中です')
+        self.retry_after = retry_after
+
+
+class AnalyticsSnapshot:
+    """定期的に更新する読み取り専用のデータベースコピー"""
+
+    def __init__(self, db_path, snapshot_path=DEFAULT_SNAPSHOT_PATH, max_age=DEFAULT_MAX_AGE,
+                 factory=sqlite3.Connection):
+        """
+        Args:
+            db_path (str): 運用中のデータベース
+            snapshot_path (str): コピーの保存先
+            max_age (float): この秒数より古いコピーは更新する
+            factory (type): connect() が返す接続のクラス（db_trace.TracedConnection など）
+        """
+        self.factory = factory
+        self.db_path = db_path
+        self.snapshot_path = snapshot_path
+        self.max_age = max_age
+        self.lock_path = f'{snapshot_path}.lock'
+        self._flag_lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self, max_age=None):
+        """
+        VACUUM INTO でコピーを作り直す（全プロセスで同時に1つだけ実行）
+
+        Args:
+            max_age (float): ロックを取った後、コピーがこの秒数より新しければ
+                             作り直さない（None なら常に作り直す）
+
+        Returns:
+            float: 更新にかかった秒数（他のプロセスが更新中、または
+                   既に新しい場合は None）
+        """
+        os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                # 待っている間に他のプロセスが更新したかもしれない
+                age = self.age()
+                if max_age is not None and age is not None and age <= max_age:
+                    return None
+                return self._copy()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _copy(self):
+        started = time.monotonic()
+        tmp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        if os.path.exists(tmp_path):
+            # 前回の異常終了で残ったファイル（VACUUM INTO は既存のファイルに書けない）
+            os.remove(tmp_path)
+
+        source = sqlite3.connect(self.db_path, timeout=10.0)
+        try:
+            source.execute('VACUUM INTO ?', (tmp_path,))
+        finally:
+            source.close()
+
+        target = sqlite3.connect(tmp_path)
+        try:
+            # 読み取り専用で開けるよう WAL を解除（WAL のままだと -shm の作成が必要）
+            target.execute('PRAGMA journal_mode=DELETE')
+            has_stats = target.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            ).fetchone()
+            if not has_stats:
+                target.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+                target.execute('ANALYZE')
+            target.commit()
+        finally:
+            target.close()
+
+        os.replace(tmp_path, self.snapshot_path)
+        elapsed = time.monotonic() - started
+        if elapsed * 10 > self.max_age:
+            logger.warning(f"Analytics snapshot copy took {elapsed:.0f}s "
+                           f"(max_age {self.max_age}s); consider a longer JACET_ANALYTICS_MAX_AGE")
+        return elapsed
+
+    def _refresh_in_background(self):
+        with self._flag_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh(self.max_age)
+            except Exception as e:
+                logger.error(f"Analytics snapshot refresh error: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='analytics-snapshot', daemon=True).start()
+
+    def refreshed_at(self):
+        """コピーの作成時刻（なければ None）"""
+        try:
+            return datetime.fromtimestamp(os.stat(self.snapshot_path).st_mtime)
+        except FileNotFoundError:
+            return None
+
+    def age(self):
+        """コピーの経過秒数（なければ None）"""
+        refreshed_at = self.refreshed_at()
+        if refreshed_at is None:
+            return None
+        return (datetime.now() - refreshed_at).total_seconds()
+
+    def connect(self):
+        """
+        コピーへの読み取り専用接続
+
+        max_age を過ぎていれば現在のコピーを返しつつバックグラウンドで更新する。
+
+        Raises:
+            SnapshotBuilding: コピーがまだない（バックグラウンドで作成を開始する）
+        """
+        age = self.age()
+        if age is None:
+            self._refresh_in_background()
+            raise SnapshotBuilding()
+        if age > self.max_age:
+            self._refresh_in_background()
+
+        conn = sqlite3.connect(f'file:{self.snapshot_path}?mode=ro', uri=True, timeout=10.0,
+                               factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def freshness(self):
+        """画面・API 表示用の鮮度情報"""
+        refreshed_at = self.refreshed_at()
+        return {
+            'snapshot_time': refreshed_at.isoformat(timespec='seconds') if refreshed_at else None,
+            'age_seconds': round(self.age(), 1) if refreshed_at else None,
+            'max_age_seconds': self.max_age
+        }
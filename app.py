@@ -11,36 +11,64 @@ License: MIT
 source jacet_env/bin/activate
 """
 
-from flask import Flask, render_template, request, session, jsonify, redirect, url_for, flash, Response
+from flask import Flask, render_template, request, session, jsonify, redirect, url_for, flash, Response, make_response
 import subprocess
 import json
 import os
 import tempfile
 import uuid
+import hashlib
+import csv
+import io
 import sqlite3
 import shutil
+import numpy as np
 import pandas as pd
-from datetime import datetime
-import logging, sys
+from datetime import datetime, timedelta, timezone
+import logging
 from functools import wraps
+from itertools import islice
 import random
 
-# ロギング設定
+import cat_engine
+import cdc
+import change_feed
+import db_trace
+import event_log
+import analytics
+import archive
+import estimators
+import item_query
+import jobs
+import norms
+import provisioning
+import reaper
+import response_matrix
+import results_store
+import transport
+import vocabulary
+from admission import AdmissionController, Overloaded
+from create_database import check_item_ids, import_item_bank, missing_indexes, enable_wal
+from item_bank import ItemBankManager, SnapshotMissing
+from reaper import SessionReaper
+
+# ロギング設定（JSON Lines、書き込み・ローテーションは別スレッド）
 LOG_DIR = os.path.join(os.path.dirname(__file__), 'logs')
-os.makedirs(LOG_DIR, exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOG_DIR, 'jacet_cat.log')),
-        logging.StreamHandler(sys.stdout)
-    ]
+event_log.configure(
+    LOG_DIR,
+    max_bytes=int(os.environ.get('JACET_LOG_MAX_BYTES', event_log.DEFAULT_MAX_BYTES)),
+    interval=int(os.environ.get('JACET_LOG_ROTATE_INTERVAL', event_log.DEFAULT_INTERVAL)),
+    backup_count=int(os.environ.get('JACET_LOG_BACKUP_COUNT', event_log.DEFAULT_BACKUP_COUNT))
 )
 logger = logging.getLogger(__name__)
 
 # Flaskアプリケーション初期化
 app = Flask(__name__)
-app.secret_key = 'jacet-cat-secret-key-change-this-in-production'
+# Cookie と共有リンクの署名鍵は環境変数 SECRET_KEY から読む。
+# 初期値（setup.py が作る .env の値を含む）のままでは共有リンクを作らない
+DEFAULT_SECRET_KEYS = ('jacet-cat-secret-key-change-this-in-production',
+                       'your-secret-key-change-this-in-production')
+app.secret_key = os.environ.get('SECRET_KEY') or DEFAULT_SECRET_KEYS[0]
 
 # アプリケーション設定
 app.config.update(
@@ -49,11 +77,42 @@ app.config.update(
     SEND_FILE_MAX_AGE_DEFAULT=300,  # 5分
     SESSION_COOKIE_SECURE=False,  # 本番環境ではTrueに
     SESSION_COOKIE_HTTPONLY=True,
-    SESSION_COOKIE_SAMESITE='Lax'
+    SESSION_COOKIE_SAMESITE='Lax',
+    # スコアリング方式: 'r'（Rscript）または 'python'（cat_engine）
+    SCORING_BACKEND=os.environ.get('JACET_SCORING_BACKEND', 'r'),
+    # Python スコアリングの能力値推定法（estimators.ESTIMATORS のキー）
+    ABILITY_ESTIMATOR=os.environ.get('JACET_ABILITY_ESTIMATOR', cat_engine.DEFAULT_ESTIMATOR),
+    ITEM_BANK_CSV='jacet_parameters.csv',
+    # スコアリングの同時実行数・待ち行列（超過分は 503 + Retry-After）
+    SCORING_CONCURRENCY=int(os.environ.get('JACET_SCORING_CONCURRENCY', os.cpu_count() or 2)),
+    SCORING_QUEUE_SIZE=int(os.environ.get('JACET_SCORING_QUEUE_SIZE', 2 * (os.cpu_count() or 2))),
+    SCORING_QUEUE_TIMEOUT=float(os.environ.get('JACET_SCORING_QUEUE_TIMEOUT', 5)),
+    SCORING_RETRY_AFTER=2,
+    # 放棄セッションの回収間隔（秒、0 で無効）
+    SESSION_REAPER_INTERVAL=int(os.environ.get('JACET_SESSION_REAPER_INTERVAL', 300)),
+    # 終了からこの日数を過ぎたセッションと回答を月別アーカイブへ移す
+    ARCHIVE_AFTER_DAYS=int(os.environ.get('JACET_ARCHIVE_AFTER_DAYS', archive.DEFAULT_DAYS)),
+    # 管理画面・集計 API が読むスナップショットの最大経過秒数
+    ANALYTICS_MAX_AGE=int(os.environ.get('JACET_ANALYTICS_MAX_AGE', analytics.DEFAULT_MAX_AGE)),
+    # 一括メンテナンス（統計リセット・セッション削除）の1トランザクションの行数とチャンク間の待ち時間
+    MAINTENANCE_CHUNK_SIZE=int(os.environ.get('JACET_MAINTENANCE_CHUNK_SIZE', jobs.DEFAULT_CHUNK_SIZE)),
+    MAINTENANCE_PAUSE=float(os.environ.get('JACET_MAINTENANCE_PAUSE', jobs.DEFAULT_PAUSE)),
+    # 集団基準（θ のヒストグラム）の差分をデータベースへ書き込む間隔（秒）
+    NORMS_FLUSH_INTERVAL=int(os.environ.get('JACET_NORMS_FLUSH_INTERVAL', norms.DEFAULT_FLUSH_INTERVAL)),
+    # SQL の計測（リクエストごとの件数・時間、この秒数以上の文は実行計画とともにログへ）
+    SQL_TRACE=os.environ.get('JACET_SQL_TRACE', '1') == '1',
+    SLOW_QUERY_MS=float(os.environ.get('JACET_SLOW_QUERY_MS', db_trace.DEFAULT_SLOW_MS)),
+    # 完了したセッションの結果をメモリに保持する件数（結果ページ・共有リンク）
+    RESULT_CACHE_SIZE=int(os.environ.get('JACET_RESULT_CACHE_SIZE', results_store.DEFAULT_CACHE_SIZE)),
+    # 結果の共有リンク（署名鍵が初期値のままなら無効）
+    SHARE_LINKS=app.secret_key not in DEFAULT_SECRET_KEYS
 )
 
+# 推定法名の誤りは起動時に検出する
+estimators.get_estimator(app.config['ABILITY_ESTIMATOR'])
+
 # 必要なディレクトリを作成
-for directory in ['logs', 'backups', 'temp']:
+for directory in ['logs', 'backups', 'temp', 'item_banks', archive.ARCHIVE_DIR]:
     os.makedirs(directory, exist_ok=True)
 
 # ============================================================================
@@ -114,16 +173,325 @@ def run_r_script(script_content, input_data=None, timeout=30):
         logger.error(f"R script execution error: {e}")
         return None, str(e)
 
+# SQL の計測を有効にする場合は接続クラスを差し替える
+db_trace.configure(app.config['SLOW_QUERY_MS'])
+DB_CONNECTION_FACTORY = db_trace.TracedConnection if app.config['SQL_TRACE'] else sqlite3.Connection
+
 def get_db_connection():
     """データベース接続を取得"""
     try:
-        conn = sqlite3.connect('jacet_cat.db', timeout=10.0)
+        conn = sqlite3.connect('jacet_cat.db', timeout=10.0, factory=DB_CONNECTION_FACTORY)
         conn.row_factory = sqlite3.Row
         return conn
     except sqlite3.Error as e:
         logger.error(f"Database connection error: {e}")
         raise
 
+# 管理画面・集計 API 用のスナップショット（受験中の書き込みとロックを取り合わない）
+analytics_snapshot = analytics.AnalyticsSnapshot('jacet_cat.db', max_age=app.config['ANALYTICS_MAX_AGE'],
+                                                factory=DB_CONNECTION_FACTORY)
+
+def get_analytics_connection():
+    """集計用の読み取り専用接続を取得（定期的に更新されるスナップショット）"""
+    try:
+        return analytics_snapshot.connect()
+    except sqlite3.Error as e:
+        logger.error(f"Analytics snapshot connection error: {e}")
+        raise
+
+def with_freshness(response, etag=None):
+    """
+    JSON 応答にスナップショットの作成時刻を付け、条件付き GET に対応する
+    
+    内容が変わっていなければ（ETag / Last-Modified が一致すれば）304 を返す。
+    ストリーミング応答は本文から ETag を作れないため etag を渡す。
+    """
+    freshness = analytics_snapshot.freshness()
+    if freshness['snapshot_time']:
+        response.headers['X-Snapshot-Time'] = freshness['snapshot_time']
+    refreshed_at = analytics_snapshot.refreshed_at()
+    return transport.conditional(response, request,
+                                 refreshed_at.astimezone(timezone.utc) if refreshed_at else None, etag)
+
+# 項目バンク（バージョン付きスナップショット）
+item_bank_manager = ItemBankManager(app.config['ITEM_BANK_CSV'])
+
+# スコアリングのアドミッション制御（Rscript の同時起動数を制限）
+scoring_admission = AdmissionController(
+    app.config['SCORING_CONCURRENCY'],
+    app.config['SCORING_QUEUE_SIZE'],
+    app.config['SCORING_QUEUE_TIMEOUT'],
+    app.config['SCORING_RETRY_AFTER']
+)
+
+def overloaded_response(e):
+    """混雑時の応答（503 + Retry-After、クライアントは待ってから再送する）"""
+    logger.warning(f"Scoring overloaded ({e.reason}): {scoring_admission.status()}")
+    response = jsonify({
+        'error': '現在アクセスが集中しています。しばらくお待ちください。',
+        'retryable': True,
+        'retry_after': e.retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def snapshot_building_response(e):
+    """集計用のコピーがまだない場合の応答（503 + Retry-After、作成はバックグラウンドで進む）"""
+    response = jsonify({
+        'success': False,
+        'error': str(e),
+        'retryable': True,
+        'retry_after': e.retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+# 放棄セッションの回収（期限切れの active セッションを abandoned にし、版の保持を解除）
+session_reaper = SessionReaper(
+    'jacet_cat.db',
+    max_age=app.config['PERMANENT_SESSION_LIFETIME'],
+    on_expire=item_bank_manager.release_many,
+    local_sessions=item_bank_manager.pinned_sessions,
+    interval=app.config['SESSION_REAPER_INTERVAL']
+)
+
+# 管理画面への変更通知（/admin/stream、データベースの位置の差分、全クライアントで共有）
+dashboard_feed = change_feed.ChangeFeed('jacet_cat.db')
+
+# 一括メンテナンスのバックグラウンドジョブ（短いトランザクションに分けて実行）
+job_manager = jobs.JobManager('jacet_cat.db',
+                              chunk_size=app.config['MAINTENANCE_CHUNK_SIZE'],
+                              pause=app.config['MAINTENANCE_PAUSE'])
+
+# 集団基準（パーセンタイル順位・語彙サイズ分布）
+norm_sketch = norms.NormSketch('jacet_cat.db', flush_interval=app.config['NORMS_FLUSH_INTERVAL'])
+
+# 完了したセッションの結果（session_results の行は変更されないのでそのまま保持）
+result_cache = results_store.ResultCache(app.config['RESULT_CACHE_SIZE'],
+                                         results_store.deletion_marker('jacet_cat.db'))
+if not app.config['SHARE_LINKS']:
+    logger.warning("SECRET_KEY is not set; result share links are disabled")
+
+if os.path.exists('jacet_cat.db'):
+    try:
+        # インデックスの作成・重複回答の削除は python create_database.py --migrate で行う
+        missing = missing_indexes('jacet_cat.db')
+        if missing:
+            logger.error(f"Missing indexes: {', '.join(missing)}; "
+                         f"run 'python create_database.py --migrate' before serving")
+        enable_wal('jacet_cat.db')
+        conn = sqlite3.connect('jacet_cat.db', timeout=10.0)
+        with conn:
+            provisioning.ensure_provisioning_table(conn)
+            results_store.ensure_results_table(conn)
+            cdc.ensure_change_tracking(conn)
+        conn.close()
+        if app.config['SESSION_REAPER_INTERVAL'] > 0:
+            session_reaper.start()
+        norm_sketch.load()
+        norm_sketch.start()
+    except sqlite3.Error as e:
+        logger.error(f"Database startup error: {e}")
+
+def get_item_bank(version=None, session_id=None):
+    """
+    項目バンクのスナップショットを取得
+    
+    Args:
+        version (str): セッション開始時のバージョン（None なら現在の版）
+        session_id (str): 指定するとそのセッションの使用版として保持する
+    
+    Raises:
+        SnapshotMissing: version のスナップショットが見つからない場合
+    """
+    return item_bank_manager.get(version, session_id)
+
+def score_answer(bank, admin_items, responses_prev, item_id, is_correct, previous=None):
+    """
+    回答をスコアリングし次項目を選択する（SCORING_BACKEND に応じて R / Python）
+    
+    Args:
+        bank (ItemBank): セッションが使用する項目バンクのスナップショット
+        admin_items (list): これまでの出題項目番号
+        responses_prev (list): これまでの正誤
+        item_id (int): 今回の項目番号
+        is_correct (int): 今回の正誤（1/0）
+        previous (tuple): 前回の (theta, se)（Python のみ使用）
+    
+    Returns:
+        tuple: (JSON文字列, エラー)
+    
+    Raises:
+        Overloaded: 同時実行数と待ち行列が上限に達している場合
+    """
+    with scoring_admission.slot():
+        return _score_answer(bank, admin_items, responses_prev, item_id, is_correct, previous)
+
+def _score_answer(bank, admin_items, responses_prev, item_id, is_correct, previous):
+    if app.config['SCORING_BACKEND'] == 'python':
+        result = cat_engine.process_answer(bank, admin_items, responses_prev,
+                                           int(item_id), is_correct,
+                                           app.config['ABILITY_ESTIMATOR'], previous)
+        return json.dumps(result), None
+    
+    return run_r_script(build_scoring_r_script(bank, admin_items, responses_prev, item_id, is_correct))
+
+def build_scoring_r_script(bank, admin_items, responses_prev, item_id, is_correct):
+    """回答処理と次項目選択を行う R スクリプトを生成（引数は score_answer と同じ）"""
+    return f'''
+    source('jacet_cat_function.r')
+    library(jsonlite)
+
+    # 現在のセッション状態を復元
+    administered_items <- c({",".join(map(str, admin_items))})
+    responses <- c({",".join(map(str, responses_prev))})
+
+    # 項目バンク読み込み（セッション開始時のスナップショット）
+    item_bank <- read.csv('{bank.csv_path}', stringsAsFactors = FALSE)
+
+    # 3PLモデルの確率関数
+    prob_3pl <- function(theta, a, b, c) {{
+        return(c + (1 - c) / (1 + exp(-a * (theta - b))))
+    }}
+
+    # 項目情報関数
+    item_info_3pl <- function(theta, a, b, c) {{
+        p <- prob_3pl(theta, a, b, c)
+        q <- 1 - p
+        if(p <= c || p >= 1) return(0)
+        info <- (a^2 * q * (p - c)^2) / (p * (1 - c)^2)
+        return(info)
+    }}
+
+    # EAP推定
+    estimate_ability_eap <- function(items, responses, item_bank) {{
+        if(length(responses) == 0) {{
+            return(list(theta = 0, se = Inf))
+        }}
+
+        theta_range <- seq(-4, 4, by = 0.01)
+        prior <- dnorm(theta_range, 0, 1)
+        likelihood <- rep(1, length(theta_range))
+
+        for(i in 1:length(items)) {{
+            item_idx <- items[i]
+            response <- responses[i]
+
+            a <- item_bank$Dscrimination[item_idx]
+            b <- item_bank$Difficulty[item_idx]
+            c <- item_bank$Guessing[item_idx]
+
+            prob <- prob_3pl(theta_range, a, b, c)
+
+            if(response == 1) {{
+                likelihood <- likelihood * prob
+            }} else {{
+                likelihood <- likelihood * (1 - prob)
+            }}
+        }}
+
+        posterior <- likelihood * prior
+        posterior <- posterior / sum(posterior)
+
+        theta_eap <- sum(theta_range * posterior)
+        variance <- sum((theta_range - theta_eap)^2 * posterior)
+        se <- sqrt(variance)
+
+        return(list(theta = theta_eap, se = se))
+    }}
+
+    # 回答を記録
+    administered_items <- c(administered_items, {item_id})
+    responses <- c(responses, {is_correct})
+
+    # 能力値更新
+    ability_result <- estimate_ability_eap(administered_items, responses, item_bank)
+    current_theta <- ability_result$theta
+    current_se <- ability_result$se
+
+    # 終了条件チェック
+    min_items      <- 20         # 最小出題数
+    max_items      <- 30         # 最大出題数
+    se_threshold   <- 0.4        # 精度基準 (標準誤差)
+
+    required_high  <- 2          # Level 7+ を最低 2 問
+    high_admin     <- sum(item_bank$Level[administered_items] >= 7)
+
+    should_continue <- (
+        current_se > se_threshold ||            # 精度がまだ低い
+        length(administered_items) < min_items  # 最小数未満
+        || high_admin < required_high           # 高レベル項目が足りない
+    ) && length(administered_items) < max_items
+
+    if(should_continue) {{
+        # 次項目選択（最大情報量基準）
+        available_items <- setdiff(1:nrow(item_bank), administered_items)
+
+        # 高レベル必須数を満たすまでは Level 7+ を優先
+        if(high_admin < required_high){{ 
+            hi_candidates <- intersect(available_items, which(item_bank$Level >= 7))
+            if(length(hi_candidates) > 0){{ 
+                available_items <- hi_candidates
+            }} 
+        }}
+
+        if(length(available_items) > 0) {{
+            info_values <- sapply(available_items, function(i) {{
+                a <- item_bank$Dscrimination[i]
+                b <- item_bank$Difficulty[i]
+                c <- item_bank$Guessing[i]
+                return(item_info_3pl(current_theta, a, b, c))
+            }})
+
+            next_item_idx <- available_items[which.max(info_values)]
+
+            result <- list(
+                current_theta = current_theta,
+                current_se = current_se,
+                items_count = length(administered_items),
+                should_continue = TRUE,
+                next_item = list(
+                    id = next_item_idx,
+                    word = item_bank$Item[next_item_idx],
+                    level = item_bank$Level[next_item_idx],
+                    correct_answer = item_bank$CorrectAnswer[next_item_idx],
+                    distractors = c(
+                        item_bank$Distractor_1[next_item_idx],
+                        item_bank$Distractor_2[next_item_idx],
+                        item_bank$Distractor_3[next_item_idx]
+                    )
+                ),
+                administered_items = administered_items,
+                responses = responses
+            )
+        }} else {{
+            should_continue <- FALSE
+        }}
+    }}
+
+    if(!should_continue) {{
+        # 語彙サイズ・信用区間は Python 側（vocabulary.describe）で付与
+        result <- list(
+            current_theta = current_theta,
+            current_se = current_se,
+            items_count = length(administered_items),
+            should_continue = FALSE,
+            final_result = list(
+                final_theta = current_theta,
+                final_se = current_se,
+                items_administered = length(administered_items),
+                efficiency = length(administered_items) / 160
+            ),
+            administered_items = administered_items,
+            responses = responses
+        )
+    }}
+
+    cat(toJSON(result, auto_unbox = TRUE))
+    '''
+
 def require_admin(f):
     """管理者認証デコレータ"""
     @wraps(f)
@@ -139,9 +507,57 @@ def shuffle_options(correct_answer, distractors):
     random.shuffle(all_options)
     return all_options
 
-def log_user_action(action, session_id=None, details=None):
-    """ユーザーアクションをログに記録"""
-    logger.info(f"Action: {action}, Session: {session_id}, Details: {details}")
+def answer_payload(cat_state):
+    """
+    回答送信への応答（次の問題の表示と進捗のみ）
+    
+    CAT 状態の全体（出題済み項目・正誤の履歴や次の問題の正答）は Cookie の
+    セッションに保存済みのため、クライアントには返さない。
+    """
+    payload = {
+        'should_continue': bool(cat_state.get('should_continue')),
+        'items_count': cat_state.get('items_count', 0)
+    }
+    next_item = cat_state.get('next_item')
+    if payload['should_continue'] and next_item:
+        payload['next_item'] = {
+            'id': next_item.get('id'),
+            'word': next_item.get('word'),
+            'level': next_item.get('level'),
+            'options': shuffle_options(next_item.get('correct_answer'), next_item.get('distractors', []))
+        }
+    return payload
+
+def log_user_action(action, session_id=None, details=None, **fields):
+    """
+    ユーザーアクションを構造化イベントとして記録（キューに入れるだけで、書き込みは別スレッド）
+    
+    Args:
+        action (str): 操作の種類
+        session_id (str): 受験セッション
+        details (str): 補足（自由記述）
+        **fields: イベントの項目（event_log.query で検索できる）
+    """
+    event_log.event(action, session_id, details=details, **fields)
+
+@app.before_request
+def trace_begin():
+    """リクエストごとの SQL の計測を開始"""
+    if app.config['SQL_TRACE']:
+        db_trace.begin(request.endpoint or 'unknown')
+
+@app.after_request
+def trace_end(response):
+    """SQL の件数・時間を Server-Timing ヘッダーに付ける"""
+    stats = db_trace.end()
+    if stats is not None and stats.queries:
+        response.headers['Server-Timing'] = db_trace.server_timing(stats)
+    return response
+
+@app.after_request
+def compress(response):
+    """一定サイズ以上のテキスト系応答を gzip / br で圧縮"""
+    return transport.compress_response(response, request.headers.get('Accept-Encoding'))
 
 # ============================================================================
 # エラーハンドラー
@@ -197,6 +613,10 @@ def index():
 def start_test():
     """テスト開始"""
     try:
+        access_code = request.form.get('access_code', '').strip()
+        if access_code:
+            return start_provisioned_test(access_code)
+        
         user_id = request.form.get('user_id', 'anonymous')
         session_id = str(uuid.uuid4())
         
@@ -216,7 +636,16 @@ def start_test():
         conn.commit()
         conn.close()
         
-        log_user_action('test_started', session_id, f'user_id: {user_id}')
+        log_user_action('test_started', session_id, user_id=user_id)
+        
+        # 項目バンクのバージョンをセッションに固定
+        bank = get_item_bank(session_id=session_id)
+        
+        if app.config['SCORING_BACKEND'] == 'python':
+            result = cat_engine.start_session(bank)
+            result['bank_version'] = bank.version
+            session['cat_state'] = result
+            return redirect(url_for('test_interface'))
         
         # R でCATセッション初期化
         r_script = '''
@@ -224,7 +653,7 @@ def start_test():
         library(jsonlite)
         
         # 項目バンク読み込み
-        item_bank <- read.csv('jacet_parameters.csv', stringsAsFactors = FALSE)
+        item_bank <- read.csv('BANK_CSV_PATH', stringsAsFactors = FALSE)
         
         # CATセッション初期化
         cat_session <- list(
@@ -265,9 +694,15 @@ def start_test():
         )
         
         cat(toJSON(result, auto_unbox = TRUE))
-        '''
+        '''.replace('BANK_CSV_PATH', bank.csv_path)
         
-        output, error = run_r_script(r_script)
+        try:
+            with scoring_admission.slot():
+                output, error = run_r_script(r_script)
+        except Overloaded as e:
+            logger.warning(f"start_test rejected ({e.reason}): {scoring_admission.status()}")
+            flash('現在アクセスが集中しています。しばらく待ってから再試行してください。', 'error')
+            return redirect(url_for('index'))
         
         if error and not output:
             logger.error(f"R script error in start_test: {error}")
@@ -276,6 +711,7 @@ def start_test():
         
         try:
             result = json.loads(output)
+            result['bank_version'] = bank.version
             session['cat_state'] = result
             return redirect(url_for('test_interface'))
         except json.JSONDecodeError as e:
@@ -288,6 +724,43 @@ def start_test():
         flash('テスト開始時にエラーが発生しました。', 'error')
         return redirect(url_for('index'))
 
+def start_provisioned_test(access_code):
+    """一括作成済みセッションをアクセスコードで開始（初期状態は作成時に決定済み）"""
+    conn = get_db_connection()
+    try:
+        claimed = provisioning.claim(
+            conn, access_code,
+            user_id=request.form.get('user_id') or None,
+            ip_address=request.environ.get('REMOTE_ADDR', 'unknown'),
+            user_agent=request.environ.get('HTTP_USER_AGENT', 'unknown')
+        )
+    finally:
+        conn.close()
+    
+    if claimed is None:
+        flash('アクセスコードが正しくないか、既に使用されています。', 'error')
+        return redirect(url_for('index'))
+    
+    session_id, user_id, cat_state = claimed
+    session['cat_session_id'] = session_id
+    session['user_id'] = user_id
+    session['start_time'] = datetime.now().isoformat()
+    session['cat_state'] = cat_state
+    
+    # 作成時の項目バンクの版をこのセッションに固定
+    try:
+        get_item_bank(cat_state.get('bank_version'), session_id)
+    except SnapshotMissing as e:
+        # 初期状態（最初の問題）はこの版で決まっているため、別の版では開始しない
+        log_user_action('bank_version_missing', session_id, version=e.version)
+        for key in ('cat_session_id', 'user_id', 'start_time', 'cat_state'):
+            session.pop(key, None)
+        flash('このアクセスコードの問題セットが見つからないため、テストを開始できません。管理者に連絡してください。', 'error')
+        return redirect(url_for('index'))
+    
+    log_user_action('test_started', session_id, user_id=user_id, provisioned=True)
+    return redirect(url_for('test_interface'))
+
 @app.route('/test')
 def test_interface():
     """テスト画面"""
@@ -314,6 +787,190 @@ def test_interface():
                          shuffled_options=shuffled_options,
                          progress=cat_state.get('items_count', 0))
 
+def complete_result(result, bank):
+    """
+    スコアリング結果に項目バンクの版と語彙サイズ（信用区間付き）を補う
+    
+    Args:
+        result (dict): R / Python スコアリングの出力
+        bank (ItemBank): 使用した項目バンク
+    """
+    result['bank_version'] = bank.version
+    if result.get('final_result'):
+        vocabulary.describe(result['final_result'])
+    return result
+
+def parse_submission(cat_state, data):
+    """
+    送信データと現在のCAT状態から採点に必要な値をまとめる
+    
+    Returns:
+        dict: item_id, user_answer, response_time, current_item,
+              admin_items, responses_prev, correct_answer, is_correct, previous
+    """
+    current_item = cat_state.get('next_item', {})
+
+    # ------------------------------------------------------------------
+    # jsonlite::toJSON(auto_unbox = TRUE) で要素数 1 のベクトルがスカラーに
+    # 化けるため、Python 側で必ずリストに正規化しておく
+    admin_items    = cat_state.get('administered_items', [])
+    if not isinstance(admin_items, list):
+        admin_items = [admin_items]
+
+    responses_prev = cat_state.get('responses', [])
+    if not isinstance(responses_prev, list):
+        responses_prev = [responses_prev]
+    # ------------------------------------------------------------------
+    
+    # 正答判定
+    user_answer = data.get('answer')
+    correct_answer = current_item.get('correct_answer')
+    
+    return {
+        'item_id': data.get('item_id'),
+        'user_answer': user_answer,
+        'response_time': data.get('response_time', 0),
+        'current_item': current_item,
+        'admin_items': admin_items,
+        'responses_prev': responses_prev,
+        'correct_answer': correct_answer,
+        'is_correct': 1 if user_answer == correct_answer else 0,
+        # 前回の推定値（Python スコアリングの反復法の初期値）
+        'previous': cat_engine.previous_estimate(cat_state)
+    }
+
+def classify_submission(cat_state, data):
+    """
+    送信が新しい回答か、再送（通信エラー・二重クリック）かを判定する
+    
+    クライアントは出題時の items_count を seq として送る。直前に処理した回答は
+    cat_state['last_submission'] に残しておき、同じ seq と item_id の送信は
+    採点も記録もせずに現在の状態（その回答の処理結果）を返す。
+    
+    Returns:
+        str: 'new'（新しい回答）/ 'replay'（処理済みの回答の再送）/
+             'stale'（現在の問題に対応しない送信。古い画面からの送信など）
+    """
+    try:
+        item_id = int(data.get('item_id'))
+    except (TypeError, ValueError):
+        return 'stale'
+    seq = data.get('seq')
+    
+    last = cat_state.get('last_submission')
+    if last and last.get('item_id') == item_id and (seq is None or seq == last.get('seq')):
+        return 'replay'
+    
+    if item_id != cat_state.get('next_item', {}).get('id'):
+        return 'stale'
+    if seq is not None and seq != cat_state.get('items_count', 0):
+        return 'stale'
+    return 'new'
+
+def stale_submission_response():
+    """現在の問題に対応しない送信への応答（クライアントは画面を再読み込みする）"""
+    return {'error': 'この問題は既に回答済みです。画面を更新してください。', 'stale': True}
+
+def bank_missing_response():
+    """使用中の項目バンクの版が失われたセッションへの応答（クライアントは最初からやり直す）"""
+    return {'error': 'この受験で使用中の問題セットが見つからないため続行できません。テストを最初からやり直してください。',
+            'restart': True}
+
+def record_answer(session_id, cat_state, submission, result):
+    """
+    回答と項目統計をデータベースに記録
+    
+    同じセッション・項目の回答が既にあれば（Cookie の更新が届かなかった再送など）
+    何も書き込まない。
+    
+    Returns:
+        bool: 記録した場合 True
+    """
+    conn = get_db_connection()
+    inserted = conn.execute('''
+        INSERT OR IGNORE INTO responses 
+        (session_id, item_id, item_word, item_level, response, 
+         correct_answer, user_answer, timestamp, theta_before, theta_after, se_after, response_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        session_id,
+        submission['item_id'],
+        submission['current_item'].get('word'),
+        submission['current_item'].get('level'),
+        submission['is_correct'],
+        submission['correct_answer'],
+        submission['user_answer'],
+        datetime.now(),
+        cat_state.get('current_theta', 0),
+        result.get('current_theta'),
+        result.get('current_se'),
+        submission['response_time']
+    )).rowcount
+    
+    if not inserted:
+        conn.close()
+        logger.info(f"Duplicate answer ignored: {session_id}, item_id: {submission['item_id']}")
+        return False
+    
+    # 項目統計更新（SET の右辺は更新前の値なので、p_value は更新後の件数で計算）
+    conn.execute('''
+        UPDATE item_statistics 
+        SET exposure_count = exposure_count + 1,
+            total_responses = total_responses + 1,
+            correct_count = correct_count + ?,
+            p_value = CAST(correct_count + ? AS FLOAT) / (total_responses + 1),
+            last_used = CURRENT_TIMESTAMP
+        WHERE item_id = ?
+    ''', (submission['is_correct'], submission['is_correct'], submission['item_id']))
+    
+    # 最後の回答なら、完了状態と結果の行を同じトランザクションで書き込む
+    completed = None
+    if result.get('final_result') and not result.get('should_continue'):
+        completed = results_store.complete_session(conn, session_id, result['final_result'],
+                                                   result.get('bank_version'))
+    
+    conn.commit()
+    conn.close()
+    
+    if completed:
+        after_completion(session_id, completed)
+    return True
+
+def after_completion(session_id, completed):
+    """
+    完了時の後処理（項目バンクの版の保持解除・集団基準・ログ）
+    
+    Args:
+        completed (dict): results_store.complete_session の戻り値
+    """
+    item_bank_manager.release(session_id)
+    norm_sketch.add(completed['final_theta'], completed['start_time'])
+    log_user_action('test_completed', session_id, vocabulary_size=completed['vocabulary_size'],
+                    items_administered=completed['items_administered'])
+
+def load_session_result(session_id):
+    """保存済みの結果（キャッシュ経由、なければ None）"""
+    def load(session_id):
+        conn = get_db_connection()
+        try:
+            return results_store.load_result(conn, session_id)
+        finally:
+            conn.close()
+    return result_cache.get(session_id, load)
+
+def render_results(result, share_url=None):
+    """結果ページ（本人・共有リンク共通）"""
+    return render_template('results.html', 
+                         result=result,
+                         response_history=result.get('history', []),
+                         share_url=share_url,
+                         percentile=norm_sketch.percentile_rank(result.get('final_theta')))
+
+def remember_submission(result, submission, seq):
+    """処理した回答を新しい CAT 状態に記録（再送の判定用）"""
+    result['last_submission'] = {'seq': seq, 'item_id': int(submission['item_id'])}
+    return result
+
 @app.route('/submit_answer', methods=['POST'])
 def submit_answer():
     """回答送信処理"""
@@ -321,309 +978,120 @@ def submit_answer():
         return jsonify({'error': 'No active session'}), 400
     
     try:
-        data = request.get_json()
-        item_id = data.get('item_id')
-        user_answer = data.get('answer')
-        response_time = data.get('response_time', 0)
+        session_id = session['cat_session_id']
         
         # 現在のCAT状態取得
         cat_state = session.get('cat_state', {})
-        current_item = cat_state.get('next_item', {})
-
-        # ------------------------------------------------------------------
-        # jsonlite::toJSON(auto_unbox = TRUE) で要素数 1 のベクトルがスカラーに
-        # 化けるため、Python 側で必ずリストに正規化しておく
-        admin_items    = cat_state.get('administered_items', [])
-        if not isinstance(admin_items, list):
-            admin_items = [admin_items]
-
-        responses_prev = cat_state.get('responses', [])
-        if not isinstance(responses_prev, list):
-            responses_prev = [responses_prev]
-        # ------------------------------------------------------------------
-        
-        # 正答判定
-        correct_answer = current_item.get('correct_answer')
-        is_correct = 1 if user_answer == correct_answer else 0
-        
-        log_user_action('answer_submitted', session['cat_session_id'], 
-                       f'item_id: {item_id}, correct: {is_correct}')
-        
-        # R で回答処理と次項目選択
-        r_script = f'''
-        source('jacet_cat_function.r')
-        library(jsonlite)
-        
-        # 現在のセッション状態を復元
-        administered_items <- c({",".join(map(str, admin_items))})
-        responses <- c({",".join(map(str, responses_prev))})
-        
-        # 項目バンク読み込み
-        item_bank <- read.csv('jacet_parameters.csv', stringsAsFactors = FALSE)
-        
-        # 3PLモデルの確率関数
-        prob_3pl <- function(theta, a, b, c) {{
-            return(c + (1 - c) / (1 + exp(-a * (theta - b))))
-        }}
-        
-        # 項目情報関数
-        item_info_3pl <- function(theta, a, b, c) {{
-            p <- prob_3pl(theta, a, b, c)
-            q <- 1 - p
-            if(p <= c || p >= 1) return(0)
-            info <- (a^2 * q * (p - c)^2) / (p * (1 - c)^2)
-            return(info)
-        }}
-        
-        # EAP推定
-        estimate_ability_eap <- function(items, responses, item_bank) {{
-            if(length(responses) == 0) {{
-                return(list(theta = 0, se = Inf))
-            }}
-            
-            theta_range <- seq(-4, 4, by = 0.01)
-            prior <- dnorm(theta_range, 0, 1)
-            likelihood <- rep(1, length(theta_range))
-            
-            for(i in 1:length(items)) {{
-                item_idx <- items[i]
-                response <- responses[i]
-                
-                a <- item_bank$Dscrimination[item_idx]
-                b <- item_bank$Difficulty[item_idx]
-                c <- item_bank$Guessing[item_idx]
-                
-                prob <- prob_3pl(theta_range, a, b, c)
-                
-                if(response == 1) {{
-                    likelihood <- likelihood * prob
-                }} else {{
-                    likelihood <- likelihood * (1 - prob)
-                }}
-            }}
-            
-            posterior <- likelihood * prior
-            posterior <- posterior / sum(posterior)
-            
-            theta_eap <- sum(theta_range * posterior)
-            variance <- sum((theta_range - theta_eap)^2 * posterior)
-            se <- sqrt(variance)
-            
-            return(list(theta = theta_eap, se = se))
-        }}
+        data = request.get_json()
         
-        # 回答を記録
-        administered_items <- c(administered_items, {item_id})
-        responses <- c(responses, {is_correct})
-        
-        # 能力値更新
-        ability_result <- estimate_ability_eap(administered_items, responses, item_bank)
-        current_theta <- ability_result$theta
-        current_se <- ability_result$se
-        
-        # 終了条件チェック
-        min_items      <- 20         # 最小出題数
-        max_items      <- 30         # 最大出題数
-        se_threshold   <- 0.4        # 精度基準 (標準誤差)
-
-        required_high  <- 2          # Level 7+ を最低 2 問
-        high_admin     <- sum(item_bank$Level[administered_items] >= 7)
-
-        should_continue <- (
-            current_se > se_threshold ||            # 精度がまだ低い
-            length(administered_items) < min_items  # 最小数未満
-            || high_admin < required_high           # 高レベル項目が足りない
-        ) && length(administered_items) < max_items
-        
-        if(should_continue) {{
-            # 次項目選択（最大情報量基準）
-            available_items <- setdiff(1:nrow(item_bank), administered_items)
-
-            # 高レベル必須数を満たすまでは Level 7+ を優先
-            if(high_admin < required_high){{ 
-                hi_candidates <- intersect(available_items, which(item_bank$Level >= 7))
-                if(length(hi_candidates) > 0){{ 
-                    available_items <- hi_candidates
-                }} 
-            }}
-
-            if(length(available_items) > 0) {{
-                info_values <- sapply(available_items, function(i) {{
-                    a <- item_bank$Dscrimination[i]
-                    b <- item_bank$Difficulty[i]
-                    c <- item_bank$Guessing[i]
-                    return(item_info_3pl(current_theta, a, b, c))
-                }})
-
-                next_item_idx <- available_items[which.max(info_values)]
-
-                result <- list(
-                    current_theta = current_theta,
-                    current_se = current_se,
-                    items_count = length(administered_items),
-                    should_continue = TRUE,
-                    next_item = list(
-                        id = next_item_idx,
-                        word = item_bank$Item[next_item_idx],
-                        level = item_bank$Level[next_item_idx],
-                        correct_answer = item_bank$CorrectAnswer[next_item_idx],
-                        distractors = c(
-                            item_bank$Distractor_1[next_item_idx],
-                            item_bank$Distractor_2[next_item_idx],
-                            item_bank$Distractor_3[next_item_idx]
-                        )
-                    ),
-                    administered_items = administered_items,
-                    responses = responses
-                )
-            }} else {{
-                should_continue <- FALSE
-            }}
-        }}
+        # 再送は採点せず、処理済みの結果を返す
+        kind = classify_submission(cat_state, data)
+        if kind == 'replay':
+            return jsonify(answer_payload(cat_state))
+        if kind == 'stale':
+            return jsonify(stale_submission_response()), 409
         
-        if(!should_continue) {{
-            # 語彙サイズ推定
-            level_difficulties <- c(-2.206, -1.512, -0.701, -0.075, 0.748, 1.152, 1.504, 2.089)
-            vocab_size <- 0
-            for(i in 1:8) {{
-                prob_mastery <- 1 / (1 + exp(-(current_theta - level_difficulties[i])))
-                vocab_size <- vocab_size + 1000 * prob_mastery
-            }}
-            
-            result <- list(
-                current_theta = current_theta,
-                current_se = current_se,
-                items_count = length(administered_items),
-                should_continue = FALSE,
-                final_result = list(
-                    final_theta = current_theta,
-                    final_se = current_se,
-                    vocabulary_size = round(vocab_size),
-                    items_administered = length(administered_items),
-                    efficiency = length(administered_items) / 160
-                ),
-                administered_items = administered_items,
-                responses = responses
-            )
-        }}
+        submission = parse_submission(cat_state, data)
         
-        cat(toJSON(result, auto_unbox = TRUE))
-        '''
+        log_user_action('answer_submitted', session_id, 
+                       item_id=submission['item_id'], correct=bool(submission['is_correct']))
         
-        output, error = run_r_script(r_script)
+        bank = get_item_bank(cat_state.get('bank_version'), session_id)
+        output, error = score_answer(bank, submission['admin_items'], submission['responses_prev'],
+                                     submission['item_id'], submission['is_correct'],
+                                     submission['previous'])
         
         if error and not output:
             logger.error(f"R script error in submit_answer: {error}")
             return jsonify({'error': f'回答処理エラー: {error}'}), 500
         
         try:
-            result = json.loads(output)
+            result = complete_result(json.loads(output), bank)
+            remember_submission(result, submission, data.get('seq'))
             
             # データベースに回答記録
-            conn = get_db_connection()
-            conn.execute('''
-                INSERT INTO responses 
-                (session_id, item_id, item_word, item_level, response, 
-                 correct_answer, user_answer, timestamp, theta_before, theta_after, se_after, response_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                session['cat_session_id'],
-                item_id,
-                current_item.get('word'),
-                current_item.get('level'),
-                is_correct,
-                correct_answer,
-                user_answer,
-                datetime.now(),
-                cat_state.get('current_theta', 0),
-                result.get('current_theta'),
-                result.get('current_se'),
-                response_time
-            ))
-            
-            # 項目統計更新
-            conn.execute('''
-                UPDATE item_statistics 
-                SET exposure_count = exposure_count + 1,
-                    total_responses = total_responses + 1,
-                    correct_count = correct_count + ?,
-                    p_value = CAST(correct_count AS FLOAT) / total_responses,
-                    last_used = CURRENT_TIMESTAMP
-                WHERE item_id = ?
-            ''', (is_correct, item_id))
-            
-            conn.commit()
-            conn.close()
+            record_answer(session_id, cat_state, submission, result)
             
             # セッション状態更新
             session['cat_state'] = result
             
-            return jsonify(result)
+            return jsonify(answer_payload(result))
         
         except json.JSONDecodeError as e:
             logger.error(f"JSON decode error in submit_answer: {e}")
             return jsonify({'error': 'JSON解析エラー'}), 500
     
+    except Overloaded as e:
+        return overloaded_response(e)
+    
+    except SnapshotMissing as e:
+        log_user_action('bank_version_missing', session.get('cat_session_id'), version=e.version)
+        return jsonify(bank_missing_response()), 409
+    
     except Exception as e:
         logger.error(f"Error in submit_answer: {e}")
         return jsonify({'error': '回答処理中にエラーが発生しました'}), 500
 
 @app.route('/results')
 def show_results():
-    """結果表示"""
+    """結果表示（完了時に保存した結果の行を読むだけで、データベースは更新しない）"""
     if 'cat_session_id' not in session:
         flash('有効なテストセッションがありません。', 'warning')
         return redirect(url_for('index'))
     
-    cat_state = session.get('cat_state', {})
-    final_result = cat_state.get('final_result')
-    
-    if not final_result:
-        flash('テスト結果が見つかりません。', 'error')
-        return redirect(url_for('test_interface'))
+    session_id = session['cat_session_id']
     
     try:
-        # データベースに最終結果保存
-        conn = get_db_connection()
-        conn.execute('''
-            UPDATE test_sessions 
-            SET end_time = ?, final_theta = ?, final_se = ?, 
-                vocabulary_size = ?, items_administered = ?, status = 'completed'
-            WHERE session_id = ?
-        ''', (
-            datetime.now(),
-            final_result.get('final_theta'),
-            final_result.get('final_se'),
-            final_result.get('vocabulary_size'),
-            final_result.get('items_administered'),
-            session['cat_session_id']
-        ))
-        
-        # 回答履歴取得
-        cursor = conn.execute('''
-            SELECT item_word, item_level, response, theta_after, timestamp
-            FROM responses 
-            WHERE session_id = ? 
-            ORDER BY timestamp
-        ''', (session['cat_session_id'],))
-        
-        response_history = cursor.fetchall()
-        conn.commit()
-        conn.close()
-        
-        log_user_action('test_completed', session['cat_session_id'], 
-                       f'vocab_size: {final_result.get("vocabulary_size")}')
-        
-        return render_template('results.html', 
-                             result=final_result,
-                             response_history=response_history)
+        result = load_session_result(session_id)
+        
+        if result is None:
+            # 完了時に結果を保存できなかった場合は、Cookie の最終結果から保存する
+            final_result = session.get('cat_state', {}).get('final_result')
+            if not final_result:
+                flash('テスト結果が見つかりません。', 'error')
+                return redirect(url_for('test_interface'))
+            
+            vocabulary.describe(final_result)
+            conn = get_db_connection()
+            completed = results_store.complete_session(conn, session_id, final_result,
+                                                       session.get('cat_state', {}).get('bank_version'))
+            conn.commit()
+            conn.close()
+            if completed:
+                after_completion(session_id, completed)
+            result = load_session_result(session_id)
+            if result is None:
+                # 既に完了済みで結果の行がない（この表ができる前に完了したセッション）
+                return render_results(final_result)
+        
+        share_url = None
+        if app.config['SHARE_LINKS']:
+            share_url = url_for('shared_results', token=results_store.share_token(session_id, app.secret_key),
+                                _external=True)
+        return render_results(result, share_url)
     
     except Exception as e:
         logger.error(f"Error in show_results: {e}")
+        final_result = session.get('cat_state', {}).get('final_result')
+        if not final_result:
+            flash('結果の取得中にエラーが発生しました。', 'error')
+            return redirect(url_for('index'))
         flash('結果の保存中にエラーが発生しました。', 'error')
         return render_template('results.html', 
-                             result=final_result,
-                             response_history=[])
+                             result=vocabulary.describe(final_result),
+                             response_history=[],
+                             share_url=None,
+                             percentile=None)
+
+@app.route('/results/shared/<token>')
+def shared_results(token):
+    """共有リンクの結果表示（ログイン・受験中の Cookie は不要）"""
+    # 初期値の鍵で署名されたトークンは誰でも作れるため受け付けない
+    session_id = results_store.session_from_token(token, app.secret_key) if app.config['SHARE_LINKS'] else None
+    result = load_session_result(session_id) if session_id else None
+    if result is None:
+        return page_not_found(None)
+    return render_results(result)
 
 # ============================================================================
 # 管理者機能
@@ -671,7 +1139,7 @@ def admin_logout():
 def admin_statistics():
     """管理者統計ダッシュボード"""
     try:
-        conn = get_db_connection()
+        conn = get_analytics_connection()
         
         # 基本統計
         stats = {}
@@ -684,136 +1152,258 @@ def admin_statistics():
         avg_items = conn.execute('SELECT AVG(items_administered) FROM test_sessions WHERE status = "completed"').fetchone()[0]
         stats['avg_items_administered'] = avg_items if avg_items else 0
         
-        # 語彙サイズ分布
-        vocab_distribution = conn.execute('''
-            SELECT 
-                CASE 
-                    WHEN vocabulary_size < 1000 THEN '0-999'
-                    WHEN vocabulary_size < 2000 THEN '1000-1999'
-                    WHEN vocabulary_size < 3000 THEN '2000-2999'
-                    WHEN vocabulary_size < 4000 THEN '3000-3999'
-                    WHEN vocabulary_size < 5000 THEN '4000-4999'
-                    WHEN vocabulary_size < 6000 THEN '5000-5999'
-                    WHEN vocabulary_size < 7000 THEN '6000-6999'
-                    ELSE '7000+'
-                END as range,
-                COUNT(*) as count
-            FROM test_sessions 
-            WHERE status = 'completed' AND vocabulary_size IS NOT NULL
-            GROUP BY range
-            ORDER BY 
-                CASE range
-                    WHEN '0-999' THEN 1
-                    WHEN '1000-1999' THEN 2
-                    WHEN '2000-2999' THEN 3
-                    WHEN '3000-3999' THEN 4
-                    WHEN '4000-4999' THEN 5
-                    WHEN '5000-5999' THEN 6
-                    WHEN '6000-6999' THEN 7
-                    ELSE 8
-                END
-        ''').fetchall()
+        # 語彙サイズ分布（スナップショットの集団基準のヒストグラムから、test_sessions は走査しない）
+        vocab_distribution = norm_sketch.vocabulary_bands(norms.read_counts(conn))
+        
+        # 変更通知はスナップショットの位置から購読し、上の集計値に差分を足す
+        stream_cursor = change_feed.format_cursor(change_feed.read_position(conn))
         
         conn.close()
         
         return render_template('admin_statistics.html', 
                              stats=stats, 
-                             vocab_distribution=vocab_distribution)
+                             vocab_distribution=vocab_distribution,
+                             vocab_total=sum(count for _, count in vocab_distribution),
+                             stream_cursor=stream_cursor,
+                             freshness=analytics_snapshot.freshness())
+    
+    except analytics.SnapshotBuilding as e:
+        flash(f'{e}。{e.retry_after}秒ほどで表示できます。', 'info')
+        empty = {'total_sessions': 0, 'completed_sessions': 0,
+                 'avg_vocabulary_size': 0, 'avg_items_administered': 0}
+        response = make_response(render_template('admin_statistics.html', 
+                                                  stats=empty, 
+                                                  vocab_distribution=[],
+                                                  vocab_total=0), 503)
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
     
     except Exception as e:
         logger.error(f"Admin statistics error: {e}")
         flash('統計データの取得でエラーが発生しました。', 'error')
         return render_template('admin_statistics.html', 
                              stats={}, 
-                             vocab_distribution=[])
+                             vocab_distribution=[],
+                             vocab_total=0)
+
+@app.route('/admin/stream')
+@require_admin
+def admin_stream():
+    """
+    ダッシュボードへの変更通知（Server-Sent Events）
+    
+    last_id（画面のスナップショットの位置）以降の差分を送って接続を閉じる。
+    ブラウザは Last-Event-ID 付きで再接続するので、ワーカーを占有し続けない。
+    """
+    cursor = (request.headers.get('Last-Event-ID') or request.args.get('last_id')
+              or change_feed.format_cursor(dashboard_feed.position))
+    return Response(
+        dashboard_feed.stream(cursor),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/admin/item_statistics')
 @require_admin
 def admin_item_statistics():
-    """項目統計API"""
+    """
+    項目統計API（キーセット方式のページング・絞り込み・列の選択）
+    
+    パラメータは item_query を参照。JSON は1ページ分をストリーミングで返す:
+    {"items": [...], "next_cursor": "...", "has_more": true/false}
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.execute('''
-            SELECT 
-                s.item_id,
-                s.item_word,
-                s.item_level,
-                s.exposure_count,
-                s.correct_count,
-                s.total_responses,
-                CASE 
-                    WHEN s.total_responses > 0 THEN CAST(s.correct_count AS FLOAT) / s.total_responses
-                    ELSE 0.0
-                END as p_value,
-                s.discrimination,
-                s.difficulty,
-                s.guessing,
-                s.last_used
-            FROM item_statistics s
-            ORDER BY s.item_level, s.item_id
-        ''')
-        
-        items = []
-        for row in cursor.fetchall():
-            items.append({
-                'item_id': row[0],
-                'word': row[1],
-                'level': row[2],
-                'exposure_count': row[3],
-                'correct_count': row[4],
-                'total_responses': row[5],
-                'p_value': row[6],
-                'discrimination': row[7],
-                'difficulty': row[8],
-                'guessing': row[9],
-                'last_used': row[10]
-            })
-        
-        conn.close()
-        return jsonify(items)
+        params = item_query.parse_params(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        conn = get_analytics_connection()
+        chunks, encoding = transport.compress_stream(item_query.stream_page(conn, params),
+                                                     request.headers.get('Accept-Encoding'))
+        response = Response(chunks, mimetype='application/json')
+        # 304 の場合は本文を生成しないので、応答の終了時に接続を閉じる
+        response.call_on_close(conn.close)
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        
+        # 内容はスナップショットとクエリで決まるため、本文を作らずに ETag を決める
+        refreshed_at = analytics_snapshot.refreshed_at()
+        etag = hashlib.sha1(f'{refreshed_at}|{request.query_string.decode()}'.encode()).hexdigest()[:20]
+        return with_freshness(response, etag)
     
+    except analytics.SnapshotBuilding as e:
+        return snapshot_building_response(e)
     except Exception as e:
         logger.error(f"Item statistics error: {e}")
         return jsonify({'error': str(e)}), 500
 
+EXPORT_CHUNK_ROWS = 5000
+
+def session_intervals(columns, rows):
+    """
+    セッションの行に語彙サイズの信用区間を付ける（保存済みの final_theta / final_se から一括計算）
+    
+    Returns:
+        list: 各行の (vocabulary_lower, vocabulary_upper)
+    """
+    theta_index, se_index = columns.index('final_theta'), columns.index('final_se')
+    scored = [i for i, row in enumerate(rows) if row[theta_index] is not None]
+    intervals = [(None, None)] * len(rows)
+    if scored:
+        lower, upper = vocabulary.interval_from_normal(
+            np.array([rows[i][theta_index] for i in scored], dtype=float),
+            np.array([rows[i][se_index] or 0 for i in scored], dtype=float)
+        )
+        for i, low, high in zip(scored, lower, upper):
+            intervals[i] = (int(low), int(high))
+    return intervals
+
+def csv_chunks(columns, rows, extra_columns=(), extra=None):
+    """
+    行を EXPORT_CHUNK_ROWS 行ずつ CSV にして返す（全体をメモリに載せない）
+    
+    Args:
+        columns (list): 列名
+        rows (iterator): 行
+        extra_columns (tuple): 追加する列名
+        extra (callable): (columns, 行のリスト) → 各行に追加する値のリスト
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(list(columns) + list(extra_columns))
+    while True:
+        chunk = list(islice(rows, EXPORT_CHUNK_ROWS))
+        if not chunk:
+            break
+        added = extra(columns, chunk) if extra else [()] * len(chunk)
+        writer.writerows(tuple(row) + tuple(values) for row, values in zip(chunk, added))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
 @app.route('/admin/export/<data_type>')
 @require_admin
 def admin_export(data_type):
-    """データエクスポート機能"""
+    """
+    データエクスポート機能
+    
+    sessions / responses は運用中のテーブル（archive=1 ならアーカイブも）を
+    並び順に読みながら CSV を少しずつ返す。
+    """
     try:
-        conn = get_db_connection()
+        conn = get_analytics_connection()
+        include_archive = request.args.get('archive') == '1'
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
         if data_type == 'sessions':
-            df = pd.read_sql_query('SELECT * FROM test_sessions ORDER BY start_time DESC', conn)
-            filename = f'sessions_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+            columns = archive.table_columns(conn, 'test_sessions')
+            rows = archive.iter_rows(conn, 'test_sessions', 'start_time DESC', include_archive)
+            chunks = csv_chunks(columns, rows, ('vocabulary_lower', 'vocabulary_upper'), session_intervals)
+            filename = f'sessions_export_{timestamp}.csv'
         elif data_type == 'responses':
-            df = pd.read_sql_query('SELECT * FROM responses ORDER BY timestamp DESC', conn)
-            filename = f'responses_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+            columns = archive.table_columns(conn, 'responses')
+            rows = archive.iter_rows(conn, 'responses', 'timestamp DESC', include_archive)
+            chunks = csv_chunks(columns, rows)
+            filename = f'responses_export_{timestamp}.csv'
         elif data_type == 'statistics':
             df = pd.read_sql_query('SELECT * FROM item_statistics ORDER BY item_level, item_id', conn)
-            filename = f'statistics_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+            conn.close()
+            chunks = [df.to_csv(index=False)]
+            filename = f'statistics_export_{timestamp}.csv'
         else:
             conn.close()
             return "Invalid data type", 400
         
-        conn.close()
+        log_user_action('data_export', type=data_type, archive=include_archive)
         
-        # CSVファイルとして出力
-        output = df.to_csv(index=False, encoding='utf-8-sig')
+        response = Response(
+            chunks,
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment;filename={filename}'}
+        )
+        if data_type != 'statistics':
+            # 本文を返し終えてから接続を閉じる（アーカイブの接続は iter_rows が閉じる）
+            response.call_on_close(rows.close)
+            response.call_on_close(conn.close)
+        return response
+    
+    except analytics.SnapshotBuilding as e:
+        return snapshot_building_response(e)
+    except Exception as e:
+        logger.error(f"Export error: {e}")
+        flash('データエクスポートでエラーが発生しました。', 'error')
+        return redirect(url_for('admin_statistics'))
+
+@app.route('/admin/export/matrix')
+@require_admin
+def admin_export_matrix():
+    """
+    反応行列のエクスポート（受験者 × 項目、NPZ / CSR 形式）
+    
+    クエリ: since / until（開始日時）、completed=1（完了のみ）、
+    times=1（回答時間を含める）、archive=1（アーカイブを含める）
+    """
+    try:
+        conn = get_analytics_connection()
+        try:
+            matrix = response_matrix.build_matrix(
+                conn,
+                since=request.args.get('since') or None,
+                until=request.args.get('until') or None,
+                completed_only=request.args.get('completed') == '1',
+                include_times=request.args.get('times') == '1',
+                include_archive=request.args.get('archive') == '1'
+            )
+        finally:
+            conn.close()
         
-        log_user_action('data_export', details=f'type: {data_type}')
+        n_sessions, n_items = matrix['shape']
+        log_user_action('data_export', type='matrix', sessions=int(n_sessions), items=int(n_items))
         
+        filename = f'response_matrix_{datetime.now().strftime("%Y%m%d_%H%M%S")}.npz'
         return Response(
-            output,
-            mimetype='text/csv',
+            response_matrix.to_bytes(matrix),
+            mimetype='application/octet-stream',
             headers={'Content-Disposition': f'attachment;filename={filename}'}
         )
     
+    except analytics.SnapshotBuilding as e:
+        return snapshot_building_response(e)
     except Exception as e:
-        logger.error(f"Export error: {e}")
+        logger.error(f"Matrix export error: {e}")
         flash('データエクスポートでエラーが発生しました。', 'error')
         return redirect(url_for('admin_statistics'))
 
+@app.route('/admin/export/changes')
+@require_admin
+def admin_export_changes():
+    """
+    差分エクスポート（データウェアハウスの増分同期用）
+    
+    クエリ: cursor（前回の next_cursor、省略時は最初から）、limit（1ページの行数）
+    has_more が true の間は next_cursor で続けて取得する。
+    """
+    try:
+        limit = request.args.get('limit', cdc.DEFAULT_PAGE_SIZE, type=int)
+        conn = get_db_connection()
+        try:
+            page = cdc.read_changes(conn, request.args.get('cursor'), limit)
+        finally:
+            conn.close()
+        
+        log_user_action('data_export', type='changes', sessions=len(page['sessions']),
+                       responses=len(page['responses']))
+        return jsonify({'success': True, **page})
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Change export error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/admin/backup', methods=['POST'])
 @require_admin
 def admin_backup():
@@ -829,7 +1419,7 @@ def admin_backup():
         # データベースファイルをコピー
         shutil.copy2('jacet_cat.db', backup_path)
         
-        log_user_action('database_backup', details=f'file: {backup_filename}')
+        log_user_action('database_backup', file=backup_filename)
         
         return jsonify({
             'success': True,
@@ -863,7 +1453,7 @@ def admin_settings():
                 ''', (value, key))
             
             conn.commit()
-            log_user_action('settings_updated', details=f'keys: {list(settings.keys())}')
+            log_user_action('settings_updated', keys=list(settings.keys()))
             flash('設定を更新しました。', 'success')
         
         # 現在の設定を取得
@@ -872,7 +1462,7 @@ def admin_settings():
         
         conn.close()
         
-        return render_template('admin_settings.html', settings=settings)
+        return render_template('admin_settings.html', settings=settings, now=datetime.now())
     
     except Exception as e:
         logger.error(f"Settings error: {e}")
@@ -885,15 +1475,19 @@ def admin_update_statistics():
     """項目統計手動更新"""
     try:
         conn = get_db_connection()
+        archive.ensure_totals_table(conn)
         
-        # 各項目の統計を計算
+        # 各項目の統計を計算（アーカイブ済みの回答は項目別集計を加算）
         cursor = conn.execute('''
-            SELECT 
-                r.item_id,
-                COUNT(*) as total_responses,
-                SUM(r.response) as correct_count
-            FROM responses r
-            GROUP BY r.item_id
+            SELECT item_id, SUM(total_responses), SUM(correct_count)
+            FROM (
+                SELECT r.item_id, COUNT(*) as total_responses, SUM(r.response) as correct_count
+                FROM responses r
+                GROUP BY r.item_id
+                UNION ALL
+                SELECT item_id, total_responses, correct_count FROM archived_item_totals
+            )
+            GROUP BY item_id
         ''')
         
         stats = cursor.fetchall()
@@ -913,15 +1507,7 @@ def admin_update_statistics():
             ''', (total_responses, total_responses, correct_count, p_value, item_id))
         
         # 最後に使用された日時を更新
-        conn.execute('''
-            UPDATE item_statistics 
-            SET last_used = (
-                SELECT MAX(timestamp) 
-                FROM responses 
-                WHERE responses.item_id = item_statistics.item_id
-            )
-            WHERE item_id IN (SELECT DISTINCT item_id FROM responses)
-        ''')
+        conn.execute(archive.LAST_USED_UPDATE_SQL)
         
         conn.commit()
         conn.close()
@@ -934,6 +1520,214 @@ def admin_update_statistics():
         logger.error(f"Statistics update error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/admin/item_bank/reload', methods=['POST'])
+@require_admin
+def admin_reload_item_bank():
+    """項目バンクの再読み込み（実行中のセッションは開始時の版を使い続ける）"""
+    try:
+        # 項目番号がずれたCSVは、現在のスナップショットを差し替える前に拒否する
+        check_item_ids(item_bank_manager.csv_path, 'jacet_cat.db')
+        bank = item_bank_manager.reload()
+        
+        # item_bank / item_statistics テーブルも差分更新
+        counts = import_item_bank(bank.csv_path, 'jacet_cat.db')
+        
+        log_user_action('item_bank_reloaded', version=bank.version, counts=counts)
+        
+        return jsonify({
+            'success': True,
+            'version': bank.version,
+            'items': len(bank),
+            'changes': counts,
+            'status': item_bank_manager.status()
+        })
+    
+    except ValueError as e:
+        logger.error(f"Item bank reload rejected: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Item bank reload error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/archive', methods=['POST'])
+@require_admin
+def admin_archive():
+    """古いセッションと回答を月別アーカイブへ移動"""
+    try:
+        days = int((request.get_json(silent=True) or {}).get('days', app.config['ARCHIVE_AFTER_DAYS']))
+        moved = archive.archive_sessions('jacet_cat.db', days)
+        
+        sessions = sum(counts['sessions'] for counts in moved.values())
+        responses = sum(counts['responses'] for counts in moved.values())
+        log_user_action('data_archive', days=days, sessions=sessions, responses=responses)
+        
+        return jsonify({
+            'success': True,
+            'days': days,
+            'sessions': sessions,
+            'responses': responses,
+            'months': moved,
+            'archives': [month for month, _ in archive.list_archives()]
+        })
+    
+    except Exception as e:
+        logger.error(f"Archive error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/provision', methods=['GET', 'POST'])
+@require_admin
+def admin_provision():
+    """クラス単位のセッション一括作成（GET: 画面、POST: 作成して JSON を返す）"""
+    if request.method == 'GET':
+        try:
+            conn = get_db_connection()
+            batches = provisioning.list_batches(conn)
+            batch_id = request.args.get('batch')
+            sessions = provisioning.batch_sessions(conn, batch_id) if batch_id else []
+            conn.close()
+            return render_template('admin_provision.html',
+                                 batches=batches,
+                                 batch_id=batch_id,
+                                 sessions=sessions,
+                                 max_batch_size=provisioning.MAX_BATCH_SIZE)
+        except Exception as e:
+            logger.error(f"Provision page error: {e}")
+            flash('一括作成画面の表示でエラーが発生しました。', 'error')
+            return redirect(url_for('admin_statistics'))
+    
+    try:
+        data = request.get_json(silent=True) or request.form
+        count = int(data.get('count', 0))
+        label = (data.get('label') or '').strip()
+        
+        bank = get_item_bank()
+        conn = get_db_connection()
+        try:
+            batch = provisioning.provision_sessions(conn, bank, count, label,
+                                                    (data.get('user_prefix') or '').strip() or None)
+        finally:
+            conn.close()
+        
+        log_user_action('sessions_provisioned', batch=batch['batch_id'], count=count, label=label)
+        
+        return jsonify({'success': True, 'bank_version': bank.version, **batch})
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    except Exception as e:
+        logger.error(f"Provision error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/provision/<batch_id>.csv')
+@require_admin
+def admin_provision_export(batch_id):
+    """バッチのアクセスコードと結果の一覧（配布・クラス別の結果用 CSV）"""
+    try:
+        conn = get_db_connection()
+        sessions = provisioning.batch_sessions(conn, batch_id)
+        conn.close()
+        
+        df = pd.DataFrame(sessions, columns=['user_id', 'access_code', 'status', 'claimed_at', 'completed_at',
+                                             'vocabulary_size', 'vocabulary_lower', 'vocabulary_upper',
+                                             'items_administered', 'session_id'])
+        output = df.to_csv(index=False, encoding='utf-8-sig')
+        
+        return Response(
+            output,
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment;filename=access_codes_{batch_id}.csv'}
+        )
+    
+    except Exception as e:
+        logger.error(f"Provision export error: {e}")
+        flash('アクセスコードの出力でエラーが発生しました。', 'error')
+        return redirect(url_for('admin_provision'))
+
+def start_job(kind, **params):
+    """メンテナンスジョブを開始し、状態確認用の応答を返す（202）"""
+    try:
+        job = job_manager.submit(kind, **params)
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    
+    log_user_action(f'maintenance_{kind}', job=job['job_id'], params=params)
+    return jsonify({
+        'success': True,
+        'job': job,
+        'status_url': url_for('admin_job_status', job_id=job['job_id'])
+    }), 202
+
+@app.route('/admin/reset_statistics', methods=['POST'])
+@require_admin
+def admin_reset_statistics():
+    """項目統計のリセット（バックグラウンドジョブ）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        return start_job('reset_statistics', vacuum=bool(data.get('vacuum', False)))
+    except Exception as e:
+        logger.error(f"Reset statistics error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/clear_sessions', methods=['POST'])
+@require_admin
+def admin_clear_sessions():
+    """古いセッションと回答の削除（バックグラウンドジョブ）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        days = int(data.get('days', 30))
+        if days < 0:
+            return jsonify({'success': False, 'error': '日数は0以上で指定してください'}), 400
+        return start_job('clear_sessions', days=days, vacuum=bool(data.get('vacuum', False)))
+    except Exception as e:
+        logger.error(f"Clear sessions error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/factory_reset', methods=['POST'])
+@require_admin
+def admin_factory_reset():
+    """システム設定を初期値に戻す（バックグラウンドジョブ）"""
+    try:
+        return start_job('factory_reset')
+    except Exception as e:
+        logger.error(f"Factory reset error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/jobs')
+@require_admin
+def admin_jobs():
+    """最近のメンテナンスジョブ"""
+    try:
+        return jsonify({'success': True, 'jobs': job_manager.recent()})
+    except Exception as e:
+        logger.error(f"Job list error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/jobs/<job_id>')
+@require_admin
+def admin_job_status(job_id):
+    """メンテナンスジョブの進捗"""
+    try:
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'ジョブが見つかりません'}), 404
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        logger.error(f"Job status error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/jobs/<job_id>/cancel', methods=['POST'])
+@require_admin
+def admin_job_cancel(job_id):
+    """メンテナンスジョブの中止（処理中のチャンクの完了後に停止）"""
+    try:
+        cancelled = job_manager.cancel(job_id)
+        log_user_action('maintenance_cancel', job=job_id, accepted=cancelled)
+        return jsonify({'success': cancelled, 'job': job_manager.get(job_id)})
+    except Exception as e:
+        logger.error(f"Job cancel error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # ============================================================================
 # API エンドポイント
 # ============================================================================
@@ -946,11 +1740,10 @@ def api_system_status():
         
         # 基本統計
         total_sessions = conn.execute('SELECT COUNT(*) FROM test_sessions').fetchone()[0]
-        active_sessions = conn.execute('SELECT COUNT(*) FROM test_sessions WHERE status = "active"').fetchone()[0]
-        completed_today = conn.execute('''
-            SELECT COUNT(*) FROM test_sessions 
-            WHERE status = "completed" AND DATE(end_time) = DATE('now')
-        ''').fetchone()[0]
+        active_sessions = conn.execute(reaper.ACTIVE_SESSIONS_SQL).fetchone()[0]
+        today = datetime.now().date()
+        completed_today = conn.execute(results_store.COMPLETED_BETWEEN_SQL,
+                                       (today.isoformat(), (today + timedelta(days=1)).isoformat())).fetchone()[0]
         
         conn.close()
         
@@ -959,6 +1752,13 @@ def api_system_status():
             'total_sessions': total_sessions,
             'active_sessions': active_sessions,
             'completed_today': completed_today,
+            'scoring': scoring_admission.status(),
+            'session_reaper': session_reaper.status(),
+            'norms': norm_sketch.status(),
+            'dashboard_feed': dashboard_feed.status(),
+            'sql': db_trace.summary(),
+            'event_log': event_log.status(),
+            'result_cache': result_cache.status(),
             'timestamp': datetime.now().isoformat()
         })
     
@@ -972,28 +1772,30 @@ def api_system_status():
 
 @app.route('/api/vocabulary_distribution')
 def api_vocabulary_distribution():
-    """語彙サイズ分布API"""
+    """語彙サイズ分布API（?since=YYYY-MM&until=YYYY-MM で期間を指定）"""
     try:
-        conn = get_db_connection()
-        
-        cursor = conn.execute('''
-            SELECT vocabulary_size, COUNT(*) as count
-            FROM test_sessions 
-            WHERE status = 'completed' AND vocabulary_size IS NOT NULL
-            GROUP BY vocabulary_size
-            ORDER BY vocabulary_size
-        ''')
-        
-        distribution = [{'vocabulary_size': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        
-        conn.close()
-        
-        return jsonify(distribution)
+        counts = norm_sketch.counts(request.args.get('since'), request.args.get('until'))
+        return transport.conditional(jsonify(norm_sketch.distribution(counts)), request)
     
     except Exception as e:
         logger.error(f"Vocabulary distribution error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/norms')
+def api_norms():
+    """集団基準API（受験者数と θ・語彙サイズの分位点、期間指定は分布APIと同じ）"""
+    try:
+        counts = norm_sketch.counts(request.args.get('since'), request.args.get('until'))
+        return transport.conditional(jsonify({
+            'total': int(counts.sum()),
+            'quantiles': norm_sketch.quantiles(counts=counts),
+            'min_norm_size': norms.MIN_NORM_SIZE
+        }), request)
+    
+    except Exception as e:
+        logger.error(f"Norms error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # ============================================================================
 # メイン実行部
 # ============================================================================
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# archive.py - 古い回答データの月別アーカイブ
+
+"""
+終了（completed / abandoned）から一定日数が過ぎたセッションと、その回答を
+月別の SQLite ファイル（archive/jacet_cat_YYYY_MM.db、月は開始日時）へ移し、
+運用中のデータベースを小さく保つ。セッション単位で移すため、1セッションの
+回答は常にどちらか一方のファイルにまとまっている。
+
+- 移動は batch_size セッションずつ、ATTACH したアーカイブへのコピーをコミットしてから
+  運用中のデータベースから削除する（途中で止まっても重複・欠落しない）。
+- 項目統計の再計算（admin_update_statistics）が過去の回答を失わないよう、
+  移した回答の項目別集計を archived_item_totals に加算しておく。
+- エクスポートでは iter_rows() が運用中のテーブルと各月のアーカイブを別々の接続で
+  並び順に読み、併合しながら1行ずつ返す（ATTACH 数の上限がなく、全体をメモリに
+  載せない）。
+
+使い方:
+    python archive.py --days 180     # 終了から180日を過ぎたセッションを移動
+    python archive.py --list         # アーカイブの一覧
+"""
+
+import argparse
+import glob
+import heapq
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+DB_PATH = 'jacet_cat.db'
+ARCHIVE_DIR = 'archive'
+DEFAULT_DAYS = 180
+DEFAULT_BATCH_SIZE = 500
+
+ARCHIVE_PATTERN = re.compile(r'jacet_cat_(\d{4})_(\d{2})\.db$')
+ARCHIVED_TABLES = ('test_sessions', 'responses')
+
+TOTALS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS archived_item_totals (
+        item_id INTEGER PRIMARY KEY,
+        total_responses INTEGER DEFAULT 0,
+        correct_count INTEGER DEFAULT 0,
+        last_used TIMESTAMP
+    )
+'''
+
+
+def archive_path(month, archive_dir=ARCHIVE_DIR):
+    """月（'YYYY-MM'）のアーカイブファイルのパス"""
+    year, mon = month.split('-')
+    return os.path.join(archive_dir, f'jacet_cat_{year}_{mon}.db')
+
+
+def list_archives(archive_dir=ARCHIVE_DIR):
+    """
+    既存のアーカイブ
+
+    Returns:
+        list: (月 'YYYY-MM', パス) のリスト（古い順）
+    """
+    archives = []
+    for path in glob.glob(os.path.join(archive_dir, 'jacet_cat_*.db')):
+        match = ARCHIVE_PATTERN.search(path)
+        if match:
+            archives.append((f'{match.group(1)}-{match.group(2)}', path))
+    return sorted(archives)
+
+
+# 項目ごとの最終使用日時（運用中の回答とアーカイブ済みの集計の新しい方）。
+# 回答のある項目だけを EXISTS で選び、各項目は idx_responses_item_time の端だけを読む
+LAST_USED_UPDATE_SQL = '''
+    UPDATE item_statistics
+    SET last_used = (
+        SELECT MAX(last_used) FROM (
+            SELECT MAX(timestamp) AS last_used
+            FROM responses
+            WHERE responses.item_id = item_statistics.item_id
+            UNION ALL
+            SELECT last_used FROM archived_item_totals
+            WHERE archived_item_totals.item_id = item_statistics.item_id
+        )
+    )
+    WHERE EXISTS (SELECT 1 FROM responses WHERE responses.item_id = item_statistics.item_id)
+       OR item_id IN (SELECT item_id FROM archived_item_totals)
+'''
+
+
+def ensure_totals_table(conn):
+    """archived_item_totals がなければ作成"""
+    conn.execute(TOTALS_TABLE_SQL)
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def _create_archive_tables(conn, schema):
+    """ATTACH 済みのアーカイブ（arch）に運用中と同じ定義のテーブルを作成"""
+    for table in ARCHIVED_TABLES:
+        ddl = schema[table].replace(f'CREATE TABLE {table}', f'CREATE TABLE IF NOT EXISTS arch.{table}', 1)
+        conn.execute(ddl)
+        # 以前に作成したアーカイブには後から追加された列（change_seq など）がない
+        archived = set(_columns(conn, 'arch', table))
+        for column in _columns(conn, 'main', table):
+            if column not in archived:
+                conn.execute(f'ALTER TABLE arch.{table} ADD COLUMN {column}')
+    conn.execute('CREATE INDEX IF NOT EXISTS arch.idx_archive_responses_session '
+                 'ON responses(session_id, timestamp)')
+
+
+def archive_sessions(db_path=DB_PATH, days=DEFAULT_DAYS, archive_dir=ARCHIVE_DIR,
+                     batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """
+    終了から days 日を過ぎたセッションと回答を月別アーカイブへ移動
+
+    Args:
+        db_path (str): 運用中のデータベース
+        days (int): アーカイブ対象とする終了後の日数
+        archive_dir (str): アーカイブの保存先
+        batch_size (int): 1トランザクションで移すセッション数
+
+    Returns:
+        dict: 月ごとの {'sessions': 件数, 'responses': 件数}
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=days)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    moved = {}
+    try:
+        schema = dict(conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)", ARCHIVED_TABLES
+        ).fetchall())
+        with conn:
+            ensure_totals_table(conn)
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (session_id TEXT PRIMARY KEY)')
+
+        months = [row[0] for row in conn.execute('''
+            SELECT DISTINCT substr(start_time, 1, 7) FROM test_sessions
+            WHERE status IN ('completed', 'abandoned') AND COALESCE(end_time, start_time) < ?
+        ''', (cutoff,))]
+
+        for month in sorted(m for m in months if m):
+            conn.execute('ATTACH DATABASE ? AS arch', (archive_path(month, archive_dir),))
+            try:
+                with conn:
+                    _create_archive_tables(conn, schema)
+                counts = {'sessions': 0, 'responses': 0}
+                while True:
+                    # 1) アーカイブへコピー（INSERT OR IGNORE なので再実行しても重複しない）
+                    with conn:
+                        conn.execute('DELETE FROM archive_batch')
+                        conn.execute('''
+                            INSERT INTO archive_batch
+                            SELECT session_id FROM test_sessions
+                            WHERE status IN ('completed', 'abandoned')
+                              AND COALESCE(end_time, start_time) < ?
+                              AND substr(start_time, 1, 7) = ?
+                            LIMIT ?
+                        ''', (cutoff, month, batch_size))
+                        n_sessions = conn.execute('SELECT COUNT(*) FROM archive_batch').fetchone()[0]
+                        if n_sessions == 0:
+                            break
+
+                        conn.execute('''
+                            INSERT OR IGNORE INTO arch.test_sessions
+                            SELECT * FROM test_sessions WHERE session_id IN (SELECT session_id FROM archive_batch)
+                        ''')
+                        n_responses = conn.execute('''
+                            INSERT OR IGNORE INTO arch.responses
+                            SELECT * FROM responses WHERE session_id IN (SELECT session_id FROM archive_batch)
+                        ''').rowcount
+
+                    # 2) 運用中のデータベースから削除し、項目別集計を加算
+                    #    WAL モードでは複数ファイルにまたがるトランザクションが原子的でないため、
+                    #    コピーのコミット後に運用中のファイルだけを更新する
+                    with conn:
+                        conn.execute('''
+                            INSERT INTO archived_item_totals (item_id, total_responses, correct_count, last_used)
+                            SELECT item_id, COUNT(*), SUM(response), MAX(timestamp)
+                            FROM responses WHERE session_id IN (SELECT session_id FROM archive_batch)
+                            GROUP BY item_id
+                            ON CONFLICT(item_id) DO UPDATE SET
+                                total_responses = total_responses + excluded.total_responses,
+                                correct_count = correct_count + excluded.correct_count,
+                                last_used = MAX(COALESCE(last_used, ''), excluded.last_used)
+                        ''')
+                        conn.execute('DELETE FROM responses WHERE session_id IN (SELECT session_id FROM archive_batch)')
+                        conn.execute('DELETE FROM test_sessions WHERE session_id IN (SELECT session_id FROM archive_batch)')
+
+                    counts['sessions'] += n_sessions
+                    counts['responses'] += n_responses
+                moved[month] = counts
+            finally:
+                conn.execute('DETACH DATABASE arch')
+    finally:
+        conn.close()
+    return moved
+
+
+def table_columns(conn, table):
+    """エクスポートの列（運用中のテーブルの列、古いアーカイブにない列は NULL）"""
+    if table not in ARCHIVED_TABLES:
+        raise ValueError(f'アーカイブ対象外のテーブル: {table}')
+    return _columns(conn, 'main', table)
+
+
+def iter_rows(conn, table, order_by, include_archive=True, archive_dir=ARCHIVE_DIR):
+    """
+    運用中のテーブルと全アーカイブの行を order_by の順に1行ずつ返す
+
+    各ファイルを ORDER BY で読み、heapq.merge で併合するため、同時に持つのは
+    ファイルごとのカーソルだけ。列は table_columns() の順。
+
+    Args:
+        conn (sqlite3.Connection): 運用中のデータベースへの接続
+        table (str): 'test_sessions' または 'responses'
+        order_by (str): 並び順（例 'start_time DESC'）
+        include_archive (bool): False なら運用中のテーブルだけ
+
+    Yields:
+        tuple: 1行
+    """
+    columns = table_columns(conn, table)
+    column, _, direction = order_by.partition(' ')
+    if column not in columns:
+        raise ValueError(f'並び替えできない列: {column}')
+    descending = direction.upper() == 'DESC'
+    order = f'{column} {"DESC" if descending else "ASC"}'
+
+    sources = [conn.execute(f'SELECT {", ".join(columns)} FROM {table} ORDER BY {order}')]
+    archives = []
+    try:
+        for _, path in (list_archives(archive_dir) if include_archive else []):
+            archives.append(sqlite3.connect(f'file:{path}?mode=ro', uri=True))
+            present = set(_columns(archives[-1], 'main', table))
+            select = ', '.join(c if c in present else f'NULL AS {c}' for c in columns)
+            sources.append(archives[-1].execute(f'SELECT {select} FROM {table} ORDER BY {order}'))
+
+        # SQLite と同じく NULL を最小として比較する
+        index = columns.index(column)
+        yield from heapq.merge(*sources, key=lambda row: (row[index] is not None, row[index]),
+                               reverse=descending)
+    finally:
+        for archive in archives:
+            archive.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='JACET CAT 回答データの月別アーカイブ')
+    parser.add_argument('--db', default=DB_PATH, help='データベースファイル')
+    parser.add_argument('--dir', default=ARCHIVE_DIR, help='アーカイブの保存先')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS,
+                        help='終了からこの日数を過ぎたセッションを移動する')
+    parser.add_argument('--list', action='store_true', help='アーカイブの一覧を表示')
+    args = parser.parse_args()
+
+    if args.list:
+        for month, path in list_archives(args.dir):
+            conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            sessions = conn.execute('SELECT COUNT(*) FROM test_sessions').fetchone()[0]
+            responses = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            conn.close()
+            print(f"{month}: セッション {sessions} / 回答 {responses}  ({path})")
+    else:
+        moved = archive_sessions(args.db, args.days, args.dir)
+        for month, counts in moved.items():
+            print(f"✓ {month}: セッション {counts['sessions']} / 回答 {counts['responses']} を移動しました")
+        if not moved:
+            print("アーカイブ対象のセッションはありません")
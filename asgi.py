@@ -0,0 +1,373 @@
+# asgi.py - 非同期サーバー（uvicorn 等）用エントリポイント
+#
+# 起動例:
+#   uvicorn asgi:application --host 0.0.0.0 --port 5001 --workers 2
+#
+# /submit_answer だけをネイティブの ASGI ハンドラで処理し、R スクリプトは
+# asyncio のサブプロセス、Python スコアリングと DB 書き込みは上限付きの
+# スレッドプールで実行する。待機中はスレッドを占有しないため、少数の
+# ワーカーで多数の受験セッションを同時に保持できる。
+# クライアントが切断した場合は採点を中止し、R プロセスも終了させる。
+# 管理画面の変更通知 /admin/stream もネイティブに配信し、接続中の管理画面ごとに
+# スレッドを占有しない。
+# それ以外のページは WSGI の Flask アプリにそのまま委譲する。
+
+import asyncio
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.http import dump_cookie
+
+import cat_engine
+import change_feed
+import transport
+from admission import Overloaded
+from app import (app, logger, log_user_action, get_item_bank, parse_submission,
+                 answer_payload, classify_submission, stale_submission_response, remember_submission,
+                 bank_missing_response, record_answer, complete_result, build_scoring_r_script,
+                 scoring_admission, dashboard_feed)
+from item_bank import SnapshotMissing
+
+# 上限付きの実行プール（CPU 処理と SQLite 書き込みを分ける）
+SCORING_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 2,
+                                      thread_name_prefix='scoring')
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='db')
+
+wsgi_application = WsgiToAsgi(app)
+
+
+async def run_r_script_async(script_content, timeout=30):
+    """
+    R スクリプトを非同期に実行（run_r_script の非同期版）
+
+    タイムアウトまたはキャンセル時は Rscript プロセスを終了させる。
+
+    Returns:
+        tuple: (stdout, stderr)。失敗時は (None, エラーメッセージ)
+    """
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.R', delete=False) as f:
+        f.write(script_content)
+        r_script_path = f.name
+
+    env = os.environ.copy()
+    env['R_LIBS_USER'] = os.path.expanduser('~/R/library')
+
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            'Rscript', r_script_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env
+        )
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+
+        if proc.returncode != 0:
+            logger.error(f"R script error: {stderr.decode()}")
+            return None, f"R script error: {stderr.decode()}"
+        return stdout.decode().strip(), stderr.decode()
+
+    except asyncio.TimeoutError:
+        logger.error("R script timeout")
+        return None, "R script execution timeout"
+    except Exception as e:
+        logger.error(f"R script execution error: {e}")
+        return None, str(e)
+    finally:
+        # キャンセル（クライアント切断）・タイムアウト時もプロセスを残さない
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+            await asyncio.shield(proc.wait())
+        os.unlink(r_script_path)
+
+
+async def score_answer_async(bank, admin_items, responses_prev, item_id, is_correct, previous=None):
+    """score_answer の非同期版（アドミッション制御は WSGI 側と共有）"""
+    async with scoring_admission.slot_async():
+        return await _score_answer_async(bank, admin_items, responses_prev, item_id, is_correct,
+                                         previous)
+
+
+async def _score_answer_async(bank, admin_items, responses_prev, item_id, is_correct, previous):
+    if app.config['SCORING_BACKEND'] == 'python':
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            SCORING_EXECUTOR, cat_engine.process_answer,
+            bank, admin_items, responses_prev, int(item_id), is_correct,
+            app.config['ABILITY_ESTIMATOR'], previous
+        )
+        return json.dumps(result), None
+
+    return await run_r_script_async(
+        build_scoring_r_script(bank, admin_items, responses_prev, item_id, is_correct)
+    )
+
+
+# ============================================================================
+# Flask セッション Cookie の読み書き
+# ============================================================================
+
+def load_session(scope):
+    """リクエストヘッダーから Flask の署名付きセッションを復元"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookie.load(value.decode('latin-1'))
+
+    morsel = cookie.get(app.config['SESSION_COOKIE_NAME'])
+    if morsel is None or serializer is None:
+        return {}
+    try:
+        return serializer.loads(morsel.value,
+                                max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return {}
+
+
+def session_cookie_header(data):
+    """セッションを Set-Cookie ヘッダーに変換（Flask と同じ属性）"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    max_age = None
+    if data.get('_permanent'):
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+    return dump_cookie(
+        app.config['SESSION_COOKIE_NAME'],
+        serializer.dumps(dict(data)),
+        max_age=max_age,
+        path=app.config['SESSION_COOKIE_PATH'] or app.config['APPLICATION_ROOT'] or '/',
+        domain=app.config['SESSION_COOKIE_DOMAIN'] or None,
+        secure=app.config['SESSION_COOKIE_SECURE'],
+        httponly=app.config['SESSION_COOKIE_HTTPONLY'],
+        samesite=app.config['SESSION_COOKIE_SAMESITE']
+    )
+
+
+def header(scope, name):
+    """リクエストヘッダーの値（なければ None）"""
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def send_json(send, status, payload, extra_headers=(), accept_encoding=None):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    body, encoding = transport.compress_body(body, accept_encoding)
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+        (b'vary', b'Accept-Encoding'),
+        *extra_headers
+    ]
+    if encoding:
+        headers.append((b'content-encoding', encoding.encode()))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+# ============================================================================
+# /submit_answer（非同期版）
+# ============================================================================
+
+async def read_body(receive):
+    """リクエストボディを読み切る。途中で切断されたら None"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def process_submission(session_data, data):
+    """採点から DB 記録までを行い、(ステータス, 応答, 新しいセッション) を返す"""
+    session_id = session_data['cat_session_id']
+    cat_state = session_data.get('cat_state', {})
+
+    # 再送は採点せず、処理済みの結果を返す
+    kind = classify_submission(cat_state, data)
+    if kind == 'replay':
+        return 200, answer_payload(cat_state), None
+    if kind == 'stale':
+        return 409, stale_submission_response(), None
+
+    submission = parse_submission(cat_state, data)
+
+    log_user_action('answer_submitted', session_id,
+                    item_id=submission['item_id'], correct=bool(submission['is_correct']))
+
+    loop = asyncio.get_running_loop()
+    try:
+        bank = await loop.run_in_executor(SCORING_EXECUTOR, get_item_bank,
+                                          cat_state.get('bank_version'), session_id)
+    except SnapshotMissing as e:
+        log_user_action('bank_version_missing', session_id, version=e.version)
+        return 409, bank_missing_response(), None
+    output, error = await score_answer_async(bank, submission['admin_items'],
+                                             submission['responses_prev'],
+                                             submission['item_id'], submission['is_correct'],
+                                             submission['previous'])
+    if error and not output:
+        logger.error(f"R script error in submit_answer: {error}")
+        return 500, {'error': f'回答処理エラー: {error}'}, None
+
+    try:
+        result = complete_result(json.loads(output), bank)
+        remember_submission(result, submission, data.get('seq'))
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON decode error in submit_answer: {e}")
+        return 500, {'error': 'JSON解析エラー'}, None
+
+    await loop.run_in_executor(DB_EXECUTOR, record_answer, session_id, cat_state, submission, result)
+
+    session_data = dict(session_data)
+    session_data['cat_state'] = result
+    return 200, answer_payload(result), session_data
+
+
+async def submit_answer(scope, receive, send):
+    """回答送信処理（非同期版、app.submit_answer と同じ応答）"""
+    session_data = load_session(scope)
+    if 'cat_session_id' not in session_data:
+        await send_json(send, 400, {'error': 'No active session'})
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        return
+
+    try:
+        data = json.loads(body or b'{}')
+    except json.JSONDecodeError:
+        await send_json(send, 400, {'error': 'Invalid JSON'})
+        return
+
+    work = asyncio.ensure_future(process_submission(session_data, data))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({work, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+
+    if not work.done():
+        # クライアント切断: 採点を中止（R プロセスは run_r_script_async が終了させる）
+        work.cancel()
+        logger.info(f"submit_answer cancelled by client disconnect: {session_data['cat_session_id']}")
+        return
+
+    headers = []
+    try:
+        status, payload, new_session = work.result()
+    except Overloaded as e:
+        logger.warning(f"Scoring overloaded ({e.reason}): {scoring_admission.status()}")
+        status, new_session = 503, None
+        payload = {
+            'error': '現在アクセスが集中しています。しばらくお待ちください。',
+            'retryable': True,
+            'retry_after': e.retry_after
+        }
+        headers.append((b'retry-after', str(e.retry_after).encode()))
+    except Exception as e:
+        logger.error(f"Error in submit_answer: {e}")
+        status, payload, new_session = 500, {'error': '回答処理中にエラーが発生しました'}, None
+
+    if new_session is not None:
+        headers.append((b'set-cookie', session_cookie_header(new_session).encode('latin-1')))
+        headers.append((b'vary', b'Cookie'))
+    await send_json(send, status, payload, headers, header(scope, b'accept-encoding'))
+
+
+# ============================================================================
+# /admin/stream（非同期版）
+# ============================================================================
+
+async def admin_stream(scope, receive, send):
+    """管理画面への変更通知（Server-Sent Events、app.admin_stream と同じ内容）"""
+    if not load_session(scope).get('admin_logged_in'):
+        await send_json(send, 403, {'error': 'Forbidden'})
+        return
+
+    # 再接続時は Last-Event-ID、最初は画面のスナップショットの位置（last_id）から
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    cursor = (header(scope, b'last-event-id') or (query.get('last_id') or [None])[0]
+              or change_feed.format_cursor(await asyncio.get_running_loop().run_in_executor(
+                  DB_EXECUTOR, lambda: dashboard_feed.position)))
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]
+    })
+
+    async def pump():
+        nonlocal cursor
+        await send({'type': 'http.response.body', 'body': f'retry: {change_feed.RETRY_MS}\n\n'.encode(),
+                    'more_body': True})
+        while True:
+            events = await dashboard_feed.wait_async(cursor, change_feed.HEARTBEAT)
+            if events:
+                chunk = ''.join(change_feed.format_event(event) for event in events)
+                cursor = events[-1]['id']
+            else:
+                chunk = ': heartbeat\n\n'
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+
+    dashboard_feed.subscribe(1)
+    work = asyncio.ensure_future(pump())
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({work, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        work.cancel()
+        disconnect.cancel()
+        dashboard_feed.subscribe(-1)
+    if work.done() and not work.cancelled() and work.exception() is not None:
+        logger.info(f"admin stream closed: {work.exception()}")
+
+
+async def lifespan(receive, send):
+    """起動・終了通知（終了時に実行プールを解放）"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            SCORING_EXECUTOR.shutdown(wait=False)
+            DB_EXECUTOR.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI アプリケーション"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/submit_answer' and scope['method'] == 'POST':
+        await submit_answer(scope, receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/admin/stream' and scope['method'] == 'GET':
+        await admin_stream(scope, receive, send)
+    else:
+        await wsgi_application(scope, receive, send)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# cat_engine.py - JACET CAT Python スコアリングエンジン
+
+"""
+app.py の R スクリプトと同じ手順（EAP推定・終了判定・最大情報量による次項目選択）を
+NumPy で実行する。戻り値は R スクリプトが出力する JSON と同じ形式の dict。
+
+次項目選択は ItemIndex を使い、θ の近傍のバケットだけを調べる。
+能力値推定法は estimators.ESTIMATORS から選べる（既定は R と同じ 801 点の EAP）。
+"""
+
+import random
+
+import numpy as np
+
+import estimators
+import vocabulary
+from item_index import ALL_LEVELS, level_mask
+
+# CAT設定（submit_answer の R スクリプトと同じ値）
+MIN_ITEMS = 20
+MAX_ITEMS = 30
+SE_THRESHOLD = 0.4
+REQUIRED_HIGH = 2      # Level 7+ を最低 2 問
+HIGH_LEVEL = 7
+INITIAL_LEVELS = (3, 4, 5)
+HIGH_LEVELS = level_mask(range(HIGH_LEVEL, 63))
+
+# EAP の評価点: seq(-4, 4, by = 0.01)
+THETA_GRID = np.arange(-400, 401) / 100.0
+PRIOR = np.exp(-THETA_GRID ** 2 / 2) / np.sqrt(2 * np.pi)
+
+DEFAULT_ESTIMATOR = 'eap_grid'
+
+# 各レベルの平均困難度（語彙サイズ推定用）
+LEVEL_DIFFICULTIES = vocabulary.LEVEL_DIFFICULTIES
+
+
+def prob_3pl(theta, a, b, c):
+    """3PLモデルの正答確率"""
+    return c + (1 - c) / (1 + np.exp(-a * (theta - b)))
+
+
+def item_info_3pl(theta, a, b, c):
+    """3PLモデルの項目情報量"""
+    p = prob_3pl(theta, a, b, c)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        info = (a ** 2 * (1 - p) * (p - c) ** 2) / (p * (1 - c) ** 2)
+    return np.where((p > c) & (p < 1), info, 0.0)
+
+
+def posterior(bank, items, responses):
+    """
+    THETA_GRID 上の事後分布（和が 1）
+
+    Args:
+        bank (ItemBank): 項目バンク
+        items (list): 出題済み項目番号（1始まり）
+        responses (list): 正誤（1/0）
+
+    Returns:
+        ndarray: 事後確率（長さ len(THETA_GRID)）
+    """
+    pos = np.asarray(items, dtype=np.int64) - 1
+    u = np.asarray(responses, dtype=float)[:, None]
+    if bank.log_p is not None:
+        # 保存済みの log P / log Q 表を参照（exp の再計算なし）
+        log_likelihood = np.where(u == 1, bank.log_p[pos], bank.log_q[pos]).sum(axis=0, dtype=float)
+        likelihood = np.exp(log_likelihood - log_likelihood.max())
+    else:
+        p = prob_3pl(THETA_GRID[None, :], bank.a[pos, None], bank.b[pos, None], bank.c[pos, None])
+        likelihood = np.prod(np.where(u == 1, p, 1 - p), axis=0)
+
+    weights = likelihood * PRIOR
+    return weights / weights.sum()
+
+
+def estimate_ability_eap(bank, items, responses):
+    """
+    EAP（事後平均）による能力値推定
+
+    Returns:
+        tuple: (theta, se)
+    """
+    if len(responses) == 0:
+        return 0.0, float('inf')
+
+    weights = posterior(bank, items, responses)
+    theta = float(np.sum(THETA_GRID * weights))
+    se = float(np.sqrt(np.sum((THETA_GRID - theta) ** 2 * weights)))
+    return theta, se
+
+
+def previous_estimate(state):
+    """
+    CAT 状態（process_answer・initial_state の戻り値）から前回の推定値
+
+    Returns:
+        tuple: (theta, se)（まだ推定していない・R の出力で数値でなければ None）
+    """
+    theta, se = state.get('current_theta'), state.get('current_se')
+    if not all(isinstance(x, (int, float)) and not isinstance(x, bool) and np.isfinite(x)
+               for x in (theta, se)):
+        return None
+    return float(theta), float(se)
+
+
+def estimate_ability(bank, items, responses, estimator=DEFAULT_ESTIMATOR, previous=None):
+    """
+    指定した推定法による能力値推定
+
+    Args:
+        bank (ItemBank): 項目バンク
+        items (list): 出題済み項目番号（1始まり）
+        responses (list): 正誤（1/0）
+        estimator (str): estimators.ESTIMATORS のキー
+        previous (tuple): 1問前までの (theta, se)（反復法の初期値）
+
+    Returns:
+        tuple: (theta, se)
+    """
+    if estimator == 'eap_grid' or len(responses) == 0:
+        return estimate_ability_eap(bank, items, responses)
+
+    pos = np.asarray(items, dtype=np.int64) - 1
+    return estimators.estimate(estimator, bank.a[pos], bank.b[pos], bank.c[pos],
+                               np.asarray(responses, dtype=float), previous)
+
+
+def estimate_vocabulary_size(theta):
+    """語彙サイズ推定（JACET 8000語、各レベル1000語、vocabulary の変換表を参照）"""
+    return vocabulary.vocabulary_size(theta)
+
+
+def count_high_level(bank, items):
+    """出題済みの Level 7+ 項目数"""
+    pos = np.asarray(items, dtype=np.int64) - 1
+    return int(np.sum(bank.levels[pos] >= HIGH_LEVEL))
+
+
+def should_continue(bank, items, se):
+    """終了条件チェック"""
+    return (
+        se > SE_THRESHOLD
+        or len(items) < MIN_ITEMS
+        or count_high_level(bank, items) < REQUIRED_HIGH
+    ) and len(items) < MAX_ITEMS
+
+
+def select_next_item(bank, theta, items):
+    """
+    次項目選択（最大情報量基準）
+
+    Level 7+ の必須数を満たすまでは Level 7+ を優先し、候補がなければ全項目から選ぶ。
+
+    Returns:
+        int or None: 項目番号（1始まり）
+    """
+    exclude = [item_id - 1 for item_id in items]
+    pos = None
+    if count_high_level(bank, items) < REQUIRED_HIGH:
+        pos = bank.index.select(theta, exclude, HIGH_LEVELS)
+    if pos is None:
+        pos = bank.index.select(theta, exclude, ALL_LEVELS)
+    return None if pos is None else pos + 1
+
+
+def start_session(bank, rng=random):
+    """
+    CATセッション初期化（最初の項目は Level 3-5 からランダム）
+
+    Returns:
+        dict: R スクリプトの start_test 出力と同じ形式
+    """
+    initial_items = [int(pos) + 1 for pos in np.flatnonzero(np.isin(bank.levels, INITIAL_LEVELS))]
+    return initial_state(bank, rng.choice(initial_items))
+
+
+def initial_state(bank, item_id):
+    """
+    最初の項目を item_id とした CAT 初期状態（一括作成でも使用）
+
+    Returns:
+        dict: R スクリプトの start_test 出力と同じ形式
+    """
+    return {
+        'current_theta': 0,
+        'current_se': None,
+        'items_count': 0,
+        'should_continue': True,
+        'next_item': bank.item(int(item_id)),
+        'administered_items': [],
+        'responses': []
+    }
+
+
+def process_answer(bank, administered_items, responses, item_id, is_correct,
+                   estimator=DEFAULT_ESTIMATOR, previous=None):
+    """
+    回答処理と次項目選択
+
+    Args:
+        bank (ItemBank): 項目バンク
+        administered_items (list): これまでの出題項目番号
+        responses (list): これまでの正誤
+        item_id (int): 今回の項目番号
+        is_correct (int): 今回の正誤（1/0）
+        estimator (str): 能力値推定法（estimators.ESTIMATORS のキー）
+        previous (tuple): 前回の (theta, se)（previous_estimate の戻り値）
+
+    Returns:
+        dict: R スクリプトの submit_answer 出力と同じ形式
+    """
+    items = list(administered_items) + [int(item_id)]
+    answers = list(responses) + [int(is_correct)]
+
+    theta, se = estimate_ability(bank, items, answers, estimator, previous)
+
+    if should_continue(bank, items, se):
+        next_item = select_next_item(bank, theta, items)
+        if next_item is not None:
+            return {
+                'current_theta': theta,
+                'current_se': se,
+                'items_count': len(items),
+                'should_continue': True,
+                'next_item': bank.item(next_item),
+                'administered_items': items,
+                'responses': answers
+            }
+
+    # 語彙サイズの信用区間は事後分布を変換表に通して求める
+    interval = vocabulary.posterior_summary(posterior(bank, items, answers))
+    return {
+        'current_theta': theta,
+        'current_se': se,
+        'items_count': len(items),
+        'should_continue': False,
+        'final_result': {
+            'final_theta': theta,
+            'final_se': se,
+            'vocabulary_size': estimate_vocabulary_size(theta),
+            'vocabulary_lower': interval['vocabulary_lower'],
+            'vocabulary_upper': interval['vocabulary_upper'],
+            'items_administered': len(items),
+            'efficiency': len(items) / len(bank)
+        },
+        'administered_items': items,
+        'responses': answers
+    }
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# cdc.py - データウェアハウス向けの差分エクスポート（カーソル方式）
+
+"""
+前回の同期以降に追加・変更された行だけをページ単位で返す。
+/admin/export/<data_type> のような全件ダンプと違い、同期のコストは
+その間の受験量に比例する。
+
+- responses は追加のみなので、AUTOINCREMENT の id（再利用されない）を位置とする。
+- test_sessions は開始後に status / end_time / 結果が更新される（完了・放棄・
+  アクセスコードでの開始など）。終了時刻は書き込み前の時計の値でコミット順と
+  一致しないため使わず、挿入・更新のたびにトリガーで change_seq を振る。
+  番号は change_sequence テーブルの値を書き込みトランザクション内で増やすので、
+  SQLite の書き込みが直列であることからコミット順に単調増加し、削除でも巻き戻らない。
+  後から状態が変わったセッションは新しい change_seq で再度出力されるため、
+  受け取る側は session_id で上書き（upsert）する。
+- カーソルは両方の位置をまとめた不透明な文字列。クライアントは中身を解釈せず、
+  応答の next_cursor をそのまま次の要求に渡す。
+- 削除（古いセッションの削除・アーカイブへの移動）は出力しない。アーカイブ
+  （既定で終了後180日）より長く同期が止まると、その間の行は取得できない。
+
+使い方:
+    python cdc.py --cursor <前回の next_cursor> > changes.ndjson
+"""
+
+import argparse
+import base64
+import json
+import sqlite3
+import sys
+
+DB_PATH = 'jacet_cat.db'
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+CURSOR_VERSION = 1
+
+SEQUENCE_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS change_sequence (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+'''
+
+# 挿入・更新のたびに change_seq を振り直す（トリガー自身の UPDATE では再実行しない）
+TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS test_sessions_change_insert
+    AFTER INSERT ON test_sessions
+    BEGIN
+        UPDATE change_sequence SET value = value + 1 WHERE name = 'test_sessions';
+        UPDATE test_sessions
+        SET change_seq = (SELECT value FROM change_sequence WHERE name = 'test_sessions'),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE session_id = NEW.session_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS test_sessions_change_update
+    AFTER UPDATE ON test_sessions
+    WHEN NEW.change_seq IS OLD.change_seq
+    BEGIN
+        UPDATE change_sequence SET value = value + 1 WHERE name = 'test_sessions';
+        UPDATE test_sessions
+        SET change_seq = (SELECT value FROM change_sequence WHERE name = 'test_sessions'),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE session_id = NEW.session_id;
+    END
+    '''
+]
+
+# 変更されたセッション・追加された回答（位置より後ろを位置の順に）
+CHANGED_SESSIONS_SQL = 'SELECT * FROM test_sessions WHERE change_seq > ? ORDER BY change_seq LIMIT ?'
+NEW_RESPONSES_SQL = 'SELECT * FROM responses WHERE id > ? ORDER BY id LIMIT ?'
+
+CHANGE_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_sessions_change_seq ON test_sessions(change_seq)'
+
+
+def ensure_change_tracking(conn):
+    """
+    change_seq / updated_at 列・番号テーブル・トリガーがなければ作成
+
+    既存のセッションには rowid の順に番号を振る（最初の同期で全件出力される）。
+
+    Returns:
+        bool: 列を追加した場合 True
+    """
+    conn.execute(SEQUENCE_TABLE_SQL)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(test_sessions)')}
+    added = 'change_seq' not in columns
+    if added:
+        conn.execute('ALTER TABLE test_sessions ADD COLUMN change_seq INTEGER')
+        conn.execute('ALTER TABLE test_sessions ADD COLUMN updated_at TIMESTAMP')
+        conn.execute('UPDATE test_sessions SET change_seq = rowid, '
+                     'updated_at = COALESCE(end_time, start_time, created_at)')
+    conn.execute('''
+        INSERT OR IGNORE INTO change_sequence (name, value)
+        SELECT 'test_sessions', COALESCE(MAX(change_seq), 0) FROM test_sessions
+    ''')
+    conn.execute(CHANGE_INDEX_SQL)
+    for trigger_sql in TRIGGERS:
+        conn.execute(trigger_sql)
+    return added
+
+
+def encode_cursor(response_id=0, session_seq=0):
+    """位置 → 不透明なカーソル文字列"""
+    payload = json.dumps({'v': CURSOR_VERSION, 'r': int(response_id), 's': int(session_seq)},
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    カーソル文字列 → (responses.id, test_sessions.change_seq)
+
+    空のカーソルは最初から。
+
+    Raises:
+        ValueError: カーソルが不正な場合
+    """
+    if not cursor:
+        return 0, 0
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload.get('v') != CURSOR_VERSION:
+            raise ValueError('unsupported version')
+        response_id, session_seq = int(payload['r']), int(payload['s'])
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f'不正なカーソルです: {e}')
+    if response_id < 0 or session_seq < 0:
+        raise ValueError('不正なカーソルです')
+    return response_id, session_seq
+
+
+def read_changes(conn, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    カーソル以降の変更を1ページ分読む
+
+    Args:
+        conn (sqlite3.Connection): 運用中のデータベースへの接続
+        cursor (str): 前回の next_cursor（None なら最初から）
+        limit (int): テーブルごとの最大行数
+
+    Returns:
+        dict: sessions / responses（dict のリスト）、next_cursor、
+              has_more（どちらかが limit 件に達した場合 True）
+
+    Raises:
+        ValueError: カーソルが不正な場合
+    """
+    response_id, session_seq = decode_cursor(cursor)
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    # 両テーブルを同じ時点で読む（WAL では書き込みを止めない）
+    conn.execute('BEGIN')
+    try:
+        sessions = conn.execute(CHANGED_SESSIONS_SQL, (session_seq, limit))
+        session_columns = [d[0] for d in sessions.description]
+        sessions = [dict(zip(session_columns, row)) for row in sessions.fetchall()]
+
+        responses = conn.execute(NEW_RESPONSES_SQL, (response_id, limit))
+        response_columns = [d[0] for d in responses.description]
+        responses = [dict(zip(response_columns, row)) for row in responses.fetchall()]
+    finally:
+        conn.rollback()
+
+    if sessions:
+        session_seq = sessions[-1]['change_seq']
+    if responses:
+        response_id = responses[-1]['id']
+
+    return {
+        'sessions': sessions,
+        'responses': responses,
+        'next_cursor': encode_cursor(response_id, session_seq),
+        'has_more': len(sessions) == limit or len(responses) == limit
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='JACET CAT 差分エクスポート（NDJSON を標準出力へ）')
+    parser.add_argument('--db', default=DB_PATH, help='データベースファイル')
+    parser.add_argument('--cursor', default='', help='前回の next_cursor（省略時は最初から）')
+    parser.add_argument('--limit', type=int, default=DEFAULT_PAGE_SIZE, help='1ページの行数')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=10.0)
+    try:
+        with conn:
+            ensure_change_tracking(conn)
+        cursor = args.cursor
+        while True:
+            page = read_changes(conn, cursor, args.limit)
+            for table in ('sessions', 'responses'):
+                for row in page[table]:
+                    print(json.dumps({'table': table, 'row': row}, ensure_ascii=False, default=str))
+            cursor = page['next_cursor']
+            if not page['has_more']:
+                break
+    finally:
+        conn.close()
+    # 次回の同期に渡すカーソル
+    print(cursor, file=sys.stderr)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# change_feed.py - 管理画面向けの変更通知（Server-Sent Events）
+
+"""
+データベースの位置（responses.id・test_sessions の rowid・cdc の change_seq）の
+差分から、管理画面のダッシュボードへ Server-Sent Events（/admin/stream）で
+前回からの変化だけを送る。
+
+- 変更はどのワーカーのものでもデータベースから読むため、複数ワーカー構成でも
+  全ワーカーの回答・開始・完了が届く。
+- 各プロセスで1つのスレッド（ポーラー）が interval 秒ごとに位置を読み、
+  進んでいれば差分を1つの 'changes' イベントとしてリングバッファに追加する。
+  接続中の全クライアントは同じバッファを読むため、クライアント数が増えても
+  データベースへの問い合わせは増えない。ポーラーは接続がある間だけ読み、
+  IDLE_RESET 秒接続がなければ位置を忘れる。
+- イベントの id は差分の終わりの位置（カーソル）。管理画面はスナップショットの
+  位置（read_position）から購読を始めるので、画面の集計値に差分を足すと現在の
+  値になる。バッファより前の位置からは、その分の差分をデータベースから読み直す。
+  差分が大きすぎる場合は 'reset' を送り、クライアントは画面を読み直す。
+- WSGI では接続ごとにワーカーのスレッドを占有するため、stream() は
+  差分を送るか timeout 秒待って接続を閉じる（EventSource が Last-Event-ID 付きで
+  再接続する）。ASGI（asgi.py）は wait_async で接続を保ったまま送り続ける。
+- 開始数は test_sessions の rowid（挿入順に増える）で数える。最大の rowid の
+  セッションが削除されると次の挿入で番号が再利用され、その分は数え漏れる。
+
+イベント:
+    changes : {'sessions_started': 件数, 'items': {item_id: [露出数, 正答数]},
+               'completions': [{'vocabulary_size', 'band', 'items_administered'}]}
+    reset   : {}
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 1000
+DEFAULT_INTERVAL = 1.0
+HEARTBEAT = 15.0
+# WSGI の stream() が差分を待つ最大秒数（この後は接続を閉じて再接続させる）
+LONG_POLL_TIMEOUT = 10.0
+RETRY_MS = 1000
+# データベースから読み直す完了セッションの上限（超えたら 'reset'）
+MAX_CATCHUP_COMPLETIONS = 1000
+# 接続がこの秒数ないとポーラーは位置を忘れる（次の接続では現在の位置から始める）
+IDLE_RESET = 60.0
+
+POSITION_SQL = '''
+    SELECT (SELECT COALESCE(MAX(id), 0) FROM responses),
+           (SELECT COALESCE(MAX(rowid), 0) FROM test_sessions),
+           (SELECT COALESCE(MAX(change_seq), 0) FROM test_sessions)
+'''
+
+
+def vocabulary_band(size):
+    """語彙サイズ → 管理画面の分布の区間（'0-999' … '7000+'）"""
+    if size is None:
+        return None
+    lower = min(int(size) // 1000, 7) * 1000
+    return '7000+' if lower == 7000 else f'{lower}-{lower + 999}'
+
+
+def format_cursor(position):
+    """位置 (responses.id, test_sessions の rowid, change_seq) → カーソル文字列"""
+    return '-'.join(str(int(value)) for value in position)
+
+
+def parse_cursor(cursor):
+    """
+    カーソル文字列 → 位置
+
+    Returns:
+        tuple: 位置（空・不正なら None）
+    """
+    try:
+        position = tuple(int(value) for value in (cursor or '').split('-'))
+    except ValueError:
+        return None
+    if len(position) != 3 or min(position) < 0:
+        return None
+    return position
+
+
+def read_position(conn):
+    """データベース（またはスナップショット）の現在の位置"""
+    return tuple(conn.execute(POSITION_SQL).fetchone())
+
+
+def _covers(later, earlier):
+    """later がすべての位置で earlier 以降か"""
+    return all(a >= b for a, b in zip(later, earlier))
+
+
+def read_changes(conn, start, end, max_completions=None):
+    """
+    位置 start より後、end まで（end を含む）の変化
+
+    Returns:
+        dict: 'changes' イベントの data（完了数が max_completions を超えれば None）
+    """
+    (response_start, row_start, seq_start), (response_end, row_end, seq_end) = start, end
+    started = conn.execute('SELECT COUNT(*) FROM test_sessions WHERE rowid > ? AND rowid <= ?',
+                           (row_start, row_end)).fetchone()[0]
+    items = {
+        item_id: [total, correct or 0]
+        for item_id, total, correct in conn.execute('''
+            SELECT item_id, COUNT(*), SUM(response) FROM responses
+            WHERE id > ? AND id <= ? GROUP BY item_id
+        ''', (response_start, response_end))
+    }
+    completions = conn.execute('''
+        SELECT vocabulary_size, items_administered FROM test_sessions
+        WHERE change_seq > ? AND change_seq <= ? AND status = 'completed'
+        ORDER BY change_seq LIMIT ?
+    ''', (seq_start, seq_end, -1 if max_completions is None else max_completions + 1)).fetchall()
+    if max_completions is not None and len(completions) > max_completions:
+        return None
+    return {
+        'sessions_started': started,
+        'items': items,
+        'completions': [{'vocabulary_size': size, 'band': vocabulary_band(size), 'items_administered': count}
+                        for size, count in completions]
+    }
+
+
+def format_event(event):
+    """イベントを SSE の形式に変換"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+
+class ChangeFeed:
+    """データベースの変化の通知（プロセスごとに1つのポーラー、全クライアント共有のリングバッファ）"""
+
+    def __init__(self, db_path, buffer_size=DEFAULT_BUFFER_SIZE, interval=DEFAULT_INTERVAL):
+        """
+        Args:
+            db_path (str): 運用中のデータベース
+            buffer_size (int): 保持するイベント数
+            interval (float): 位置を読む間隔（秒）
+        """
+        self.db_path = db_path
+        self.interval = interval
+        self._events = deque(maxlen=buffer_size)
+        self._position = None
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+        self._thread = None
+        self.subscribers = 0
+
+    def _connect(self):
+        return sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, timeout=10.0)
+
+    @property
+    def position(self):
+        """ポーラーが読んだ最新の位置（まだ読んでいなければデータベースから読む）"""
+        with self._cond:
+            if self._position is not None:
+                return self._position
+        conn = self._connect()
+        try:
+            return read_position(conn)
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # ポーラー
+    # ------------------------------------------------------------------
+
+    def _ensure_poller(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = None
+        idle_since = None
+        while True:
+            try:
+                if self.subscribers > 0:
+                    idle_since = None
+                    conn = conn or self._connect()
+                    self.poll(conn)
+                elif idle_since is None:
+                    # WSGI の再接続の間も含め、接続がない間は読まない
+                    idle_since = time.monotonic()
+                elif conn is not None and time.monotonic() - idle_since > IDLE_RESET:
+                    conn.close()
+                    conn = None
+                    with self._cond:
+                        self._position = None
+                        self._events.clear()
+            except sqlite3.Error as e:
+                logger.error(f"Change feed poll error: {e}")
+                if conn is not None:
+                    conn.close()
+                    conn = None
+            time.sleep(self.interval)
+
+    def poll(self, conn):
+        """位置を読み、進んでいれば差分をイベントとして追加して待機中のクライアントを起こす"""
+        position = read_position(conn)
+        with self._cond:
+            previous = self._position
+        if previous is None:
+            with self._cond:
+                self._position = position
+            return
+        # 最大の行の削除で位置が戻っても、位置は減らさない
+        position = tuple(max(a, b) for a, b in zip(position, previous))
+        if position == previous:
+            return
+        data = read_changes(conn, previous, position)
+        with self._cond:
+            self._events.append({'from': previous, 'to': position, 'data': data})
+            self._position = position
+            self._cond.notify_all()
+            for loop, event in list(self._async_waiters):
+                loop.call_soon_threadsafe(event.set)
+
+    # ------------------------------------------------------------------
+    # 購読
+    # ------------------------------------------------------------------
+
+    def since(self, cursor):
+        """
+        カーソルより後のイベント
+
+        Returns:
+            list: SSE のイベント（id / type / data）。まだ変化がなければ空
+        """
+        start = parse_cursor(cursor)
+        with self._cond:
+            buffered = list(self._events)
+            head = self._position
+        if start is None:
+            return [{'id': format_cursor(head or self.position), 'type': 'reset', 'data': {}}]
+        if head is None or start == head or not _covers(head, start):
+            return []
+
+        # バッファ内のどこから送るか（start 以降の最初の境界、なければ最新の位置）
+        boundaries = [event['from'] for event in buffered] + [head]
+        index = next(i for i, boundary in enumerate(boundaries) if _covers(boundary, start))
+        events = [{'id': format_cursor(event['to']), 'type': 'changes', 'data': event['data']}
+                  for event in buffered[index:]]
+        if boundaries[index] != start:
+            # スナップショットの位置など、バッファの境界にない位置からは差分を読み直す
+            conn = self._connect()
+            try:
+                data = read_changes(conn, start, boundaries[index], MAX_CATCHUP_COMPLETIONS)
+            finally:
+                conn.close()
+            if data is None:
+                return [{'id': format_cursor(head), 'type': 'reset', 'data': {}}]
+            events.insert(0, {'id': format_cursor(boundaries[index]), 'type': 'changes', 'data': data})
+        return events
+
+    def wait(self, cursor, timeout):
+        """
+        カーソルより後のイベントを待つ（スレッド版）
+
+        Returns:
+            list: イベント（timeout までに何もなければ空）
+        """
+        self._ensure_poller()
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self.since(cursor)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            with self._cond:
+                self._cond.wait(min(remaining, self.interval))
+
+    async def wait_async(self, cursor, timeout):
+        """wait() の asyncio 版（待機中にスレッドを占有しない）"""
+        self._ensure_poller()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        event = asyncio.Event()
+        waiter = (loop, event)
+        with self._cond:
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                event.clear()
+                # バッファより前の位置からの読み直しはデータベースを読むのでスレッドで
+                events = await loop.run_in_executor(None, self.since, cursor)
+                remaining = deadline - loop.time()
+                if events or remaining <= 0:
+                    return events
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, self.interval))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+    def stream(self, cursor, timeout=LONG_POLL_TIMEOUT):
+        """
+        SSE の本文を生成（WSGI 用、差分を送るか timeout 秒待って終わる）
+
+        EventSource は接続が閉じると retry ミリ秒後に Last-Event-ID 付きで
+        再接続するため、ワーカーのスレッドを占有するのは最長 timeout 秒。
+        """
+        self.subscribe(1)
+        try:
+            yield f'retry: {RETRY_MS}\n\n'
+            events = self.wait(cursor, timeout)
+            if not events:
+                yield ': heartbeat\n\n'
+            for event in events:
+                yield format_event(event)
+        finally:
+            self.subscribe(-1)
+
+    def subscribe(self, delta):
+        """接続数の増減（status() 用）。接続がある間だけポーラーが読む"""
+        with self._cond:
+            self.subscribers += delta
+        if delta > 0:
+            self._ensure_poller()
+
+    def status(self):
+        """管理画面・API 用の状態"""
+        with self._cond:
+            position = self._position
+            buffered = len(self._events)
+        return {'subscribers': self.subscribers,
+                'position': format_cursor(position) if position else None,
+                'buffered': buffered}
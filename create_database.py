@@ -4,9 +4,105 @@
 import sqlite3
 import pandas as pd
 from datetime import datetime
+import argparse
 import os
 
-def create_database():
+DB_PATH = 'jacet_cat.db'
+PARAMETER_CSV = 'jacet_parameters.csv'
+
+# インデックス定義（一括投入後にまとめて作成する）
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_sessions_start_time ON test_sessions(start_time)",
+    # 受験中のセッションだけを持つ部分インデックス（放棄セッションの回収・件数集計用）
+    # 全行の status を持つ idx_sessions_status は完了・放棄セッションとともに肥大化するため廃止
+    "CREATE INDEX IF NOT EXISTS idx_sessions_active ON test_sessions(start_time) WHERE status = 'active'",
+    # 完了セッションを終了時刻順に持つ部分インデックス（本日の完了数など）
+    "CREATE INDEX IF NOT EXISTS idx_sessions_completed_end ON test_sessions(end_time) WHERE status = 'completed'",
+    # セッションごとの最終回答時刻を索引だけで求める
+    "CREATE INDEX IF NOT EXISTS idx_responses_session_time ON responses(session_id, timestamp)",
+    # 同じセッションで同じ項目は一度しか出題しないため、再送による重複記録を防ぐ
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_responses_session_item ON responses(session_id, item_id)",
+    # 項目ごとの最終使用日時（MAX(timestamp)）を索引の端だけで求める（item_id 単独の検索にも使える）
+    "CREATE INDEX IF NOT EXISTS idx_responses_item_time ON responses(item_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_responses_timestamp ON responses(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_item_stats_level ON item_statistics(item_level)",
+    # 項目統計 API の並べ替え・絞り込み用（rowid = item_id が後ろに付くのでキーセット方式に使える）
+    "CREATE INDEX IF NOT EXISTS idx_item_stats_exposure ON item_statistics(exposure_count)",
+    "CREATE INDEX IF NOT EXISTS idx_item_stats_p_value ON item_statistics(p_value)",
+    "CREATE INDEX IF NOT EXISTS idx_item_stats_last_used ON item_statistics(last_used)",
+    "CREATE INDEX IF NOT EXISTS idx_item_bank_level ON item_bank(level)",
+    "CREATE INDEX IF NOT EXISTS idx_item_bank_active ON item_bank(active)"
+]
+
+# 以前のバージョンで作成され、上の定義に置き換えられたインデックス
+OBSOLETE_INDEXES = ['idx_sessions_status', 'idx_responses_session_id', 'idx_responses_item_id']
+
+# システム設定の初期値（工場出荷時設定）
+DEFAULT_SETTINGS = [
+    ('se_threshold', '0.4', 'CAT終了のためのSE閾値'),
+    ('max_items', '30', 'CAT最大出題数'),
+    ('min_items', '5', 'CAT最小出題数'),
+    ('time_limit_per_item', '180', '項目あたりの制限時間（秒）'),
+    ('exposure_control', '1', '項目露出制御の有効/無効'),
+    ('admin_password', 'admin123', '管理者パスワード（要変更）'),
+    ('system_version', '1.0.0', 'システムバージョン')
+]
+
+# item_bank の比較対象列（item_id を除く）
+ITEM_BANK_COLUMNS = [
+    'level', 'item_word', 'part_of_speech', 'correct_answer',
+    'distractor_1', 'distractor_2', 'distractor_3',
+    'discrimination', 'difficulty', 'guessing'
+]
+
+def read_parameter_csv(csv_path=PARAMETER_CSV):
+    """
+    項目パラメータCSVを item_bank の行タプルのリストに変換
+    
+    Args:
+        csv_path (str): パラメータCSVファイルのパス
+    
+    Returns:
+        list: (item_id, level, item_word, ..., guessing) のタプルのリスト
+    """
+    df = pd.read_csv(csv_path)
+    columns = ['Level', 'Item', 'PartOfSpeech', 'CorrectAnswer',
+               'Distractor_1', 'Distractor_2', 'Distractor_3',
+               'Dscrimination', 'Difficulty', 'Guessing']
+    
+    # item_id は従来通り CSV の行番号 + 1
+    rows = []
+    for item_id, values in enumerate(df[columns].itertuples(index=False, name=None), start=1):
+        level, word, pos, correct, d1, d2, d3, a, b, c = values
+        rows.append((item_id, int(level), word, pos, correct, d1, d2, d3,
+                     float(a), float(b), float(c)))
+    return rows
+
+def bulk_load_item_bank(cursor, rows):
+    """
+    item_bank と item_statistics へ executemany で一括挿入
+    
+    トランザクション管理は呼び出し側で行う。
+    
+    Args:
+        cursor: SQLiteカーソル
+        rows (list): read_parameter_csv() の戻り値
+    """
+    cursor.executemany('''
+        INSERT INTO item_bank 
+        (item_id, level, item_word, part_of_speech, correct_answer,
+         distractor_1, distractor_2, distractor_3, 
+         discrimination, difficulty, guessing, active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ''', rows)
+    
+    cursor.executemany('''
+        INSERT INTO item_statistics
+        (item_id, item_word, item_level, discrimination, difficulty, guessing)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(r[0], r[2], r[1], r[8], r[9], r[10]) for r in rows])
+
+def create_database(db_path=DB_PATH, csv_path=PARAMETER_CSV):
     """
     JACET CAT システム用のSQLiteデータベースを作成・初期化
     """
@@ -14,14 +110,17 @@ def create_database():
     print("JACET CAT データベースを初期化中...")
     
     # 既存のデータベースファイルがある場合のバックアップ
-    if os.path.exists('jacet_cat.db'):
+    if os.path.exists(db_path):
         backup_name = f'jacet_cat_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db'
-        os.rename('jacet_cat.db', backup_name)
+        os.rename(db_path, backup_name)
         print(f"既存データベースを {backup_name} にバックアップしました")
     
-    # 新しいデータベース接続
-    conn = sqlite3.connect('jacet_cat.db')
+    # 新しいデータベース接続（一括投入中は自動コミットせず単一トランザクションで処理）
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    # 削除で空いたページを少しずつ返せるようにする（テーブル作成前にのみ設定可能）
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    cursor.execute('BEGIN')
     
     # 1. テストセッションテーブル
     cursor.execute('''
@@ -114,86 +213,30 @@ def create_database():
     ''')
     print("✓ system_settings テーブルを作成しました")
     
-    # インデックスの作成
-    indexes = [
-        "CREATE INDEX idx_sessions_status ON test_sessions(status)",
-        "CREATE INDEX idx_sessions_start_time ON test_sessions(start_time)",
-        "CREATE INDEX idx_responses_session_id ON responses(session_id)",
-        "CREATE INDEX idx_responses_item_id ON responses(item_id)",
-        "CREATE INDEX idx_responses_timestamp ON responses(timestamp)",
-        "CREATE INDEX idx_item_stats_level ON item_statistics(item_level)",
-        "CREATE INDEX idx_item_bank_level ON item_bank(level)",
-        "CREATE INDEX idx_item_bank_active ON item_bank(active)"
-    ]
-    
-    for index_sql in indexes:
-        cursor.execute(index_sql)
-    print("✓ インデックスを作成しました")
-    
     # 項目バンクデータの読み込み
     try:
         print("項目パラメータファイルを読み込み中...")
-        df = pd.read_csv('jacet_parameters.csv')
-        print(f"✓ {len(df)} 項目のパラメータファイルを読み込みました")
-        
-        # 項目バンクテーブルへデータ挿入
-        for index, row in df.iterrows():
-            cursor.execute('''
-                INSERT INTO item_bank 
-                (item_id, level, item_word, part_of_speech, correct_answer,
-                 distractor_1, distractor_2, distractor_3, 
-                 discrimination, difficulty, guessing, active)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-            ''', (
-                index + 1,
-                row['Level'],
-                row['Item'],
-                row['PartOfSpeech'],
-                row['CorrectAnswer'],
-                row['Distractor_1'],
-                row['Distractor_2'],
-                row['Distractor_3'],
-                row['Dscrimination'],
-                row['Difficulty'],
-                row['Guessing']
-            ))
+        rows = read_parameter_csv(csv_path)
+        print(f"✓ {len(rows)} 項目のパラメータファイルを読み込みました")
         
-        # 項目統計テーブルの初期化
-        for index, row in df.iterrows():
-            cursor.execute('''
-                INSERT INTO item_statistics
-                (item_id, item_word, item_level, discrimination, difficulty, guessing)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                index + 1,
-                row['Item'],
-                row['Level'],
-                row['Dscrimination'],
-                row['Difficulty'],
-                row['Guessing']
-            ))
+        bulk_load_item_bank(cursor, rows)
         
-        print(f"✓ {len(df)} 項目をitem_bankテーブルに挿入しました")
-        print(f"✓ {len(df)} 項目をitem_statisticsテーブルに挿入しました")
+        print(f"✓ {len(rows)} 項目をitem_bankテーブルに挿入しました")
+        print(f"✓ {len(rows)} 項目をitem_statisticsテーブルに挿入しました")
         
     except FileNotFoundError:
-        print("⚠️  警告: jacet_parameters.csv が見つかりません")
+        print(f"⚠️  警告: {csv_path} が見つかりません")
         print("   項目バンクデータは後で手動で追加してください")
     except Exception as e:
         print(f"❌ エラー: 項目データの読み込みに失敗しました: {e}")
     
-    # システム設定の初期値
-    default_settings = [
-        ('se_threshold', '0.4', 'CAT終了のためのSE閾値'),
-        ('max_items', '30', 'CAT最大出題数'),
-        ('min_items', '5', 'CAT最小出題数'),
-        ('time_limit_per_item', '180', '項目あたりの制限時間（秒）'),
-        ('exposure_control', '1', '項目露出制御の有効/無効'),
-        ('admin_password', 'admin123', '管理者パスワード（要変更）'),
-        ('system_version', '1.0.0', 'システムバージョン')
-    ]
+    # インデックスの作成（データ投入後にまとめて構築）
+    for index_sql in INDEXES:
+        cursor.execute(index_sql)
+    print("✓ インデックスを作成しました")
     
-    for key, value, desc in default_settings:
+    # システム設定の初期値
+    for key, value, desc in DEFAULT_SETTINGS:
         cursor.execute('''
             INSERT INTO system_settings (setting_key, setting_value, description)
             VALUES (?, ?, ?)
@@ -221,11 +264,11 @@ def create_database():
     print("\n" + "="*50)
     print("✅ JACET CAT データベースの初期化が完了しました！")
     print("="*50)
-    print(f"データベースファイル: jacet_cat.db")
+    print(f"データベースファイル: {db_path}")
     print(f"作成日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     # データベース情報の表示
-    conn = sqlite3.connect('jacet_cat.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     cursor.execute("SELECT COUNT(*) FROM item_bank WHERE active = 1")
@@ -259,14 +302,245 @@ def create_database():
     print("3. 管理者画面は http://localhost:5000/admin/statistics")
     print("\n⚠️  本番環境では admin_password を必ず変更してください！")
 
-def verify_database():
+def renamed_items(rows, existing):
+    """
+    項目番号は同じで単語が変わった項目
+    
+    Args:
+        rows (list): read_parameter_csv の戻り値
+        existing (dict): item_id → item_bank の (ITEM_BANK_COLUMNS..., active)
+    
+    Returns:
+        list: (item_id, 登録済みの単語, CSV の単語)
+    """
+    word = ITEM_BANK_COLUMNS.index('item_word')
+    return [
+        (row[0], existing[row[0]][word], row[1 + word])
+        for row in rows
+        if row[0] in existing and existing[row[0]][word] != row[1 + word]
+    ]
+
+def _raise_if_renamed(rows, existing):
+    renamed = renamed_items(rows, existing)
+    if renamed:
+        examples = ', '.join(f'{item_id}: {old} → {new}' for item_id, old, new in renamed[:5])
+        raise ValueError(
+            f'項目番号と単語の対応が変わっています（{len(renamed)} 件: {examples}）。'
+            f'既存の行は並べ替え・削除せず、新しい項目はCSVの末尾に追加してください'
+        )
+
+def _read_item_bank(conn):
+    return {
+        row[0]: row[1:]
+        for row in conn.execute(
+            f"SELECT item_id, {', '.join(ITEM_BANK_COLUMNS)}, active FROM item_bank"
+        )
+    }
+
+def check_item_ids(csv_path=PARAMETER_CSV, db_path=DB_PATH):
+    """
+    パラメータCSVの項目番号が登録済みの項目と同じ単語を指しているか確認
+    
+    項目番号は CSV の行位置で、回答・項目統計・実行中のセッションはこの番号で
+    項目を参照する。行の並べ替えや途中の行の削除で番号がずれたCSVを取り込むと、
+    過去の回答が別の単語の統計として扱われるため受け付けない。
+    
+    Raises:
+        ValueError: 単語が変わった項目番号がある場合
+    """
+    rows = read_parameter_csv(csv_path)
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=10.0)
+    try:
+        existing = _read_item_bank(conn)
+    finally:
+        conn.close()
+    _raise_if_renamed(rows, existing)
+
+def import_item_bank(csv_path=PARAMETER_CSV, db_path=DB_PATH):
+    """
+    既存データベースの項目バンクを差分更新（セッションデータは保持）
+    
+    新しいパラメータCSVと item_bank を項目番号で比較し、変更・追加された行のみを
+    単一トランザクションで更新する。CSVから消えた項目は削除せず active = 0 にする。
+    項目番号の単語が変わっている場合（行の並べ替え・途中の行の削除）は
+    何も更新せずに ValueError を送出する（check_item_ids 参照）。
+    
+    Args:
+        csv_path (str): 新しいパラメータCSVファイルのパス
+        db_path (str): 更新対象のデータベースファイル
+    
+    Returns:
+        dict: inserted / updated / deactivated / unchanged の件数
+    
+    Raises:
+        ValueError: 単語が変わった項目番号がある場合
+    """
+    rows = read_parameter_csv(csv_path)
+    
+    conn = sqlite3.connect(db_path)
+    try:
+        existing = _read_item_bank(conn)
+        _raise_if_renamed(rows, existing)
+        
+        inserts, updates = [], []
+        for row in rows:
+            current = existing.get(row[0])
+            if current is None:
+                inserts.append(row)
+            elif tuple(current[:-1]) != row[1:] or current[-1] != 1:
+                updates.append(row)
+        
+        csv_ids = {row[0] for row in rows}
+        deactivations = [
+            (item_id,) for item_id, current in existing.items()
+            if item_id not in csv_ids and current[-1] == 1
+        ]
+        
+        with conn:
+            if inserts:
+                bulk_load_item_bank(conn, inserts)
+            if updates:
+                conn.executemany(f'''
+                    UPDATE item_bank
+                    SET {', '.join(f'{col} = ?' for col in ITEM_BANK_COLUMNS)}, active = 1
+                    WHERE item_id = ?
+                ''', [row[1:] + (row[0],) for row in updates])
+                conn.executemany('''
+                    UPDATE item_statistics
+                    SET item_word = ?, item_level = ?,
+                        discrimination = ?, difficulty = ?, guessing = ?
+                    WHERE item_id = ?
+                ''', [(r[2], r[1], r[8], r[9], r[10], r[0]) for r in updates])
+            if deactivations:
+                conn.executemany('UPDATE item_bank SET active = 0 WHERE item_id = ?', deactivations)
+    finally:
+        conn.close()
+    
+    return {
+        'inserted': len(inserts),
+        'updated': len(updates),
+        'deactivated': len(deactivations),
+        'unchanged': len(rows) - len(inserts) - len(updates)
+    }
+
+def index_name(index_sql):
+    """CREATE INDEX 文 → インデックス名"""
+    return index_sql.split(' ON ')[0].split()[-1]
+
+def missing_indexes(db_path=DB_PATH):
+    """
+    現在の定義にあってデータベースにないインデックス（データベースは変更しない）
+    
+    Returns:
+        list: インデックス名（すべてあれば空）
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=10.0)
+    try:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        conn.close()
+    return [index_name(sql) for sql in INDEXES if index_name(sql) not in existing]
+
+def migrate(db_path=DB_PATH):
+    """
+    既存データベースのインデックスを現在の定義に合わせる（python create_database.py --migrate）
+    
+    一度だけ明示的に実行する移行処理（アプリの起動時には実行しない）。
+    回答の一意インデックスを初めて作成する際は、以前の再送で重複記録された
+    回答を最初の1件だけ残して削除し、該当する項目の item_statistics の
+    件数・正答数・p_value を残った回答（とアーカイブ済みの集計）から数え直す。
+    p_value のインデックスを初めて作成する際は、以前の回答記録で1件遅れていた
+    p_value を正答数 / 回答数に揃える（それ以外のデータは変更しない）。
+    
+    Args:
+        db_path (str): 対象のデータベースファイル
+    
+    Returns:
+        dict: removed（削除した重複回答の件数）、items（数え直した項目数）
+    """
+    conn = sqlite3.connect(db_path, timeout=10.0)
+    try:
+        with conn:
+            has_unique = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_responses_session_item'"
+            ).fetchone()
+            removed, items = 0, []
+            if not has_unique:
+                # 一意インデックス作成前に、以前の再送で重複した回答を最初の1件に揃える
+                duplicates = '''
+                    SELECT id FROM responses WHERE id NOT IN (
+                        SELECT MIN(id) FROM responses GROUP BY session_id, item_id
+                    )
+                '''
+                items = [row[0] for row in conn.execute(
+                    f'SELECT DISTINCT item_id FROM responses WHERE id IN ({duplicates})'
+                )]
+                removed = conn.execute(f'DELETE FROM responses WHERE id IN ({duplicates})').rowcount
+            if items:
+                has_totals = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_item_totals'"
+                ).fetchone()
+                archived = '''
+                    UNION ALL
+                    SELECT item_id, total_responses, correct_count FROM archived_item_totals
+                ''' if has_totals else ''
+                placeholders = ','.join('?' * len(items))
+                # admin_update_statistics と同じ集計を、重複のあった項目だけに行う
+                counts = conn.execute(f'''
+                    SELECT item_id, SUM(total), SUM(correct)
+                    FROM (
+                        SELECT item_id, COUNT(*) AS total, SUM(response) AS correct
+                        FROM responses WHERE item_id IN ({placeholders})
+                        GROUP BY item_id
+                        {archived}
+                    )
+                    GROUP BY item_id
+                ''', items).fetchall()
+                conn.executemany('''
+                    UPDATE item_statistics
+                    SET exposure_count = ?, total_responses = ?, correct_count = ?, p_value = ?
+                    WHERE item_id = ?
+                ''', [(total, total, correct, correct / total if total > 0 else 0.0, item_id)
+                      for item_id, total, correct in counts])
+            has_p_value = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_item_stats_p_value'"
+            ).fetchone()
+            if not has_p_value:
+                conn.execute('''
+                    UPDATE item_statistics
+                    SET p_value = CASE WHEN total_responses > 0
+                                       THEN CAST(correct_count AS FLOAT) / total_responses ELSE 0.0 END
+                    WHERE p_value IS NOT (CASE WHEN total_responses > 0
+                                               THEN CAST(correct_count AS FLOAT) / total_responses ELSE 0.0 END)
+                ''')
+            for index_sql in INDEXES:
+                conn.execute(index_sql)
+            for name in OBSOLETE_INDEXES:
+                conn.execute(f'DROP INDEX IF EXISTS {name}')
+    finally:
+        conn.close()
+    return {'removed': removed, 'items': len(items)}
+
+def enable_wal(db_path=DB_PATH):
+    """
+    WAL モードに切り替える（読み取りと書き込みが互いにブロックしない）
+    
+    設定はデータベースファイルに保存されるため、一度実行すればよい。
+    """
+    conn = sqlite3.connect(db_path, timeout=10.0)
+    try:
+        return conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    finally:
+        conn.close()
+
+def verify_database(db_path=DB_PATH):
     """
     データベースの整合性を確認
     """
     print("\nデータベースの整合性を確認中...")
     
     try:
-        conn = sqlite3.connect('jacet_cat.db')
+        conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         
         # テーブル存在確認
@@ -297,5 +571,32 @@ def verify_database():
         print(f"❌ データベース検証エラー: {e}")
 
 if __name__ == "__main__":
-    create_database()
-    verify_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='JACET CAT データベース初期化・項目バンク更新')
+    parser.add_argument('--db', default=DB_PATH, help='データベースファイル')
+    parser.add_argument('--csv', default=PARAMETER_CSV, help='項目パラメータCSV')
+    parser.add_argument('--update', action='store_true',
+                        help='既存データベースを再作成せず項目バンクのみ差分更新する')
+    parser.add_argument('--migrate', action='store_true',
+                        help='既存データベースのインデックスを現在の定義に合わせる（重複回答の削除を含む）')
+    args = parser.parse_args()
+    
+    if args.migrate:
+        result = migrate(args.db)
+        if result['removed']:
+            print(f"✓ 重複した回答 {result['removed']} 件を削除し、{result['items']} 項目の統計を数え直しました")
+        enable_wal(args.db)
+        print("✓ インデックスを現在の定義に合わせました")
+    if args.update:
+        missing = missing_indexes(args.db)
+        if missing:
+            print(f"⚠️  インデックスがありません: {', '.join(missing)}（--migrate を実行してください）")
+        enable_wal(args.db)
+        try:
+            counts = import_item_bank(args.csv, args.db)
+            print(f"✓ 項目バンクを差分更新しました: 追加 {counts['inserted']} / 更新 {counts['updated']} / "
+                  f"無効化 {counts['deactivated']} / 変更なし {counts['unchanged']}")
+        except ValueError as e:
+            print(f"❌ 項目バンクを更新しませんでした: {e}")
+    if not (args.migrate or args.update):
+        create_database(args.db, args.csv)
+    verify_database(args.db)
\ No newline at end of file
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# db_trace.py - SQL の計測（リクエスト単位の件数・時間、遅いクエリの実行計画、計画の回帰チェック）
+
+"""
+SQLite のトレース・進捗コールバックで、リクエストごとに実行された SQL を計測する。
+
+- TracedConnection: sqlite3.connect(..., factory=TracedConnection) で使う接続クラス
+    - set_trace_callback   : 実行された文の数（トリガー内の文・暗黙の BEGIN/COMMIT を含む）
+    - set_progress_handler : 仮想マシンの命令数（PROGRESS_STEPS 単位、走査量の目安）
+    - execute の所要時間   : slow_ms 以上かかった文は EXPLAIN QUERY PLAN とともに警告ログへ
+  SELECT の時間は execute（最初の行まで）の分で、fetch の時間は含まない。
+- begin() / end(): リクエストの開始・終了（Flask の before_request / after_request）。
+  集計はスレッドごとなので、別スレッドで実行した SQL（ASGI の実行プールなど）は含まれない。
+- summary(): エンドポイント別の累計（/api/system_status の 'sql'）
+- check_plans(): 主要なクエリがインデックスを使うことを確認する。運用規模の
+  合成データ（synthetic_data.py）で確認する場合は CLI を使う（失敗があれば終了コード 1）。
+
+使い方:
+    python db_trace.py --check-plans --sessions 100000
+    python db_trace.py --check-plans --db jacet_cat.db
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import archive
+import cdc
+import item_query
+import reaper
+import results_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_MS = 100.0
+PROGRESS_STEPS = 1000
+
+_local = threading.local()
+_summary_lock = threading.Lock()
+_summary = {}
+
+
+class RequestStats:
+    """1リクエストの SQL の集計"""
+
+    def __init__(self, label):
+        self.label = label
+        self.statements = 0
+        self.queries = 0
+        self.seconds = 0.0
+        self.steps = 0
+        self.slow = 0
+
+
+def begin(label):
+    """リクエストの計測を開始"""
+    _local.stats = RequestStats(label)
+
+
+def end():
+    """
+    リクエストの計測を終了し、エンドポイント別の累計に加える
+
+    Returns:
+        RequestStats: 計測結果（begin していなければ None）
+    """
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    if stats is None:
+        return None
+    with _summary_lock:
+        total = _summary.setdefault(stats.label, {'requests': 0, 'queries': 0, 'statements': 0,
+                                                  'time_ms': 0.0, 'steps': 0, 'slow': 0,
+                                                  'max_queries': 0, 'max_statements': 0})
+        total['requests'] += 1
+        total['queries'] += stats.queries
+        total['statements'] += stats.statements
+        total['time_ms'] += stats.seconds * 1000
+        total['steps'] += stats.steps
+        total['slow'] += stats.slow
+        total['max_queries'] = max(total['max_queries'], stats.queries)
+        total['max_statements'] = max(total['max_statements'], stats.statements)
+    return stats
+
+
+def current():
+    """このスレッドで計測中のリクエスト（なければ None）"""
+    return getattr(_local, 'stats', None)
+
+
+def summary():
+    """エンドポイント別の累計（平均を含む）"""
+    with _summary_lock:
+        result = {}
+        for label, total in _summary.items():
+            result[label] = dict(total, time_ms=round(total['time_ms'], 2),
+                                 avg_queries=round(total['queries'] / total['requests'], 2),
+                                 avg_statements=round(total['statements'] / total['requests'], 2),
+                                 avg_time_ms=round(total['time_ms'] / total['requests'], 2))
+        return result
+
+
+def server_timing(stats):
+    """Server-Timing ヘッダーの値（ブラウザの開発者ツールに表示される）"""
+    return (f'db;dur={stats.seconds * 1000:.1f};desc="{stats.queries} queries, '
+            f'{stats.statements} statements, {stats.steps} steps"')
+
+
+class TracedCursor(sqlite3.Cursor):
+    """execute / executemany の所要時間を接続に報告するカーソル"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection._record(sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection._record(sql, seq_of_parameters[0] if seq_of_parameters else (),
+                                    time.perf_counter() - started)
+
+
+class TracedConnection(sqlite3.Connection):
+    """SQL を計測する接続（sqlite3.connect の factory に指定）"""
+
+    slow_ms = DEFAULT_SLOW_MS
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._explaining = False
+        self.set_trace_callback(self._on_statement)
+        self.set_progress_handler(self._on_progress, PROGRESS_STEPS)
+
+    def _on_statement(self, sql):
+        stats = current()
+        if stats is not None and not self._explaining:
+            stats.statements += 1
+
+    def _on_progress(self):
+        stats = current()
+        if stats is not None:
+            stats.steps += PROGRESS_STEPS
+        return 0  # 0 以外を返すと実行が中断される
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TracedCursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def explain(self, sql, parameters=()):
+        """
+        EXPLAIN QUERY PLAN の結果（計測の対象外）
+
+        Returns:
+            list: 計画の各行の説明（例 'SEARCH responses USING INDEX ...'）
+        """
+        self._explaining = True
+        try:
+            return [row[3] for row in super().execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+        except sqlite3.Error as e:
+            return [f'(EXPLAIN できません: {e})']
+        finally:
+            self._explaining = False
+
+    def _record(self, sql, parameters, seconds):
+        stats = current()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += seconds
+        if seconds * 1000 >= self.slow_ms and not self._explaining:
+            if stats is not None:
+                stats.slow += 1
+            plan = self.explain(sql, parameters)
+            logger.warning(f"Slow query ({seconds * 1000:.1f} ms, "
+                           f"{stats.label if stats else 'no request'}): {' '.join(sql.split())}\n"
+                           + '\n'.join(f'    {line}' for line in plan))
+
+
+def configure(slow_ms=DEFAULT_SLOW_MS):
+    """遅いクエリの閾値（ミリ秒）を設定"""
+    TracedConnection.slow_ms = float(slow_ms)
+
+
+# ============================================================================
+# 実行計画の回帰チェック
+# ============================================================================
+
+# 大きくなるテーブル（全件走査・並べ替えを許さない）
+LARGE_TABLES = ('responses', 'test_sessions')
+# 件数が受験中のセッション数に比例する部分インデックス（走査してよい）
+BOUNDED_INDEXES = ('idx_sessions_active',)
+
+
+def _critical_queries(today):
+    """
+    受験中・管理画面で頻繁に実行されるクエリ
+
+    Returns:
+        list: (名前, SQL, パラメータ, 使うべきインデックス)
+    """
+    tomorrow = today + timedelta(days=1)
+    page_sql, page_params = item_query.build_query(
+        item_query.parse_params({'sort': 'p_value', 'order': 'desc'}))
+    return [
+        # app.show_results / results_store.complete_session: 回答履歴
+        ('results_history', results_store.HISTORY_SQL, ('session-000001',), 'idx_responses_session_time'),
+        # app.admin_update_statistics: 項目ごとの最終使用日時（相関サブクエリ）
+        ('item_last_used', archive.LAST_USED_UPDATE_SQL, (), 'idx_responses_item_time'),
+        # app.api_system_status: 本日の完了数
+        ('completed_today', results_store.COMPLETED_BETWEEN_SQL,
+         (today.isoformat(), tomorrow.isoformat()), 'idx_sessions_completed_end'),
+        # app.api_system_status: 受験中の件数
+        ('active_sessions', reaper.ACTIVE_SESSIONS_SQL, (), 'idx_sessions_active'),
+        # reaper: 放棄セッションの候補
+        ('stale_sessions', reaper.STALE_SESSIONS_SQL,
+         (datetime.now().isoformat(), datetime.now().isoformat(), 500), 'idx_sessions_active'),
+        # cdc.read_changes: 変更されたセッション・追加された回答
+        ('changed_sessions', cdc.CHANGED_SESSIONS_SQL, (0, 1000), 'idx_sessions_change_seq'),
+        ('new_responses', cdc.NEW_RESPONSES_SQL, (0, 1000), None),
+        # app.admin_item_statistics: 正答率順のページ
+        ('item_statistics_page', page_sql, page_params, 'idx_item_stats_p_value')
+    ]
+
+
+def plan_problems(plan, index):
+    """
+    計画の問題点
+
+    Args:
+        plan (list): EXPLAIN QUERY PLAN の説明
+        index (str): 使うべきインデックス（None なら確認しない）
+
+    Returns:
+        list: 問題の説明（なければ空）
+    """
+    problems = []
+    for line in plan:
+        words = line.split()
+        table = words[1] if len(words) > 1 and words[0] in ('SCAN', 'SEARCH') else None
+        # インデックスの走査も、そのインデックスが大きくなるなら全件走査と同じ
+        if (words[:1] == ['SCAN'] and table in LARGE_TABLES
+                and not any(index in line for index in BOUNDED_INDEXES)):
+            problems.append(f'全件走査: {line}')
+        if 'TEMP B-TREE' in line and any(t in ' '.join(plan) for t in LARGE_TABLES):
+            problems.append(f'並べ替え: {line}')
+    if index and not any(index in line for line in plan):
+        problems.append(f'{index} を使用していません')
+    return problems
+
+
+def check_plans(conn, today=None):
+    """
+    主要なクエリの実行計画を確認
+
+    Returns:
+        list: (名前, 計画, 問題のリスト)
+    """
+    results = []
+    for name, sql, params, index in _critical_queries(today or datetime.now().date()):
+        try:
+            plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        except sqlite3.Error as e:
+            results.append((name, [], [f'EXPLAIN できません: {e}']))
+            continue
+        results.append((name, plan, plan_problems(plan, index)))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='JACET CAT 主要クエリの実行計画チェック')
+    parser.add_argument('--check-plans', action='store_true', help='実行計画を確認する')
+    parser.add_argument('--db', help='確認するデータベース（省略時は合成データを作成）')
+    parser.add_argument('--sessions', type=int, default=20000, help='合成データのセッション数')
+    args = parser.parse_args()
+
+    if not args.check_plans:
+        parser.print_help()
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db
+        if db_path is None:
+            import synthetic_data
+            db_path = os.path.join(tmp, 'scale.db')
+            counts = synthetic_data.generate(db_path, args.sessions, progress=lambda message: None)
+            print(f"合成データ: セッション {counts['sessions']} / 回答 {counts['responses']}"
+                  f"（{counts['seconds']} 秒）")
+
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+        try:
+            results = check_plans(conn)
+        finally:
+            conn.close()
+
+    failed = 0
+    for name, plan, problems in results:
+        print(f"{'✓' if not problems else '✗'} {name}")
+        for line in plan:
+            print(f'    {line}')
+        for problem in problems:
+            print(f'    ⚠️  {problem}')
+        failed += bool(problems)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# estimators.py - 能力値推定法（EAP の数値積分・MAP・WLE）
+
+"""
+3PL モデルの能力値推定法をまとめたモジュール。
+
+- eap_grid     : 従来の EAP（seq(-4, 4, by = 0.01) の 801 点、R スクリプトと同じ）
+- eap_uniform  : 等間隔の少数点（既定 81 点）による EAP
+- eap_gh       : 適応型 Gauss-Hermite 求積（既定 41 点）による EAP
+- map          : 事後モード（Newton 法 / Fisher スコアリング法）
+- wle          : Warm の重み付き最尤推定（Newton 法 / Fisher スコアリング法）
+
+CAT では1問ごとに推定し直すため、map・wle・eap_gh は前回の推定値
+（previous = (theta, se)）から始められる。map・wle は前回の θ から Newton 法を
+WARM_ITERATIONS 回だけ進め（幅の半減・収束判定なし）、eap_gh は前回の θ・SE に
+評価点を合わせて粗い格子の計算を省く。前回の推定値がなければ粗い格子
+（START_POINTS 点）で初期値を求め、Fisher スコアリング法で収束まで解く
+（3PL の事後分布は多峰になりうるため EAP から始めると局所解に収束することがある）。
+
+いずれも項目（と評価点）についてベクトル化されており、反応行列を渡せば
+複数受験者をまとめて推定できる（items の最後の軸が項目）。
+SE は EAP が事後標準偏差、MAP が 1/sqrt(I(θ) + 1)（標準正規事前分布）、
+WLE が 1/sqrt(I(θ))。eap_gh 以外は θ を従来の EAP と同じ [-4, 4] に収める。
+
+精度と速度の比較:
+    python estimators.py --bench
+
+測定結果（200 人の模擬 CAT、eap_grid に対する速度比）:
+- 1問ごとの推定（運用の cat_engine.estimate_ability）は 1 回 100 µs 前後で、
+  NumPy の関数呼び出しの固定費が大半を占めるため 10 倍には届かない。
+  eap_uniform 1.2〜2.7 倍、eap_gh 1.0〜3.1 倍、map 0.8〜2.2 倍、wle 0.7〜1.9 倍
+  （5〜30 問。項目数が少ないほど差が小さい）。
+- 多数の受験者をまとめて推定する場合（replay.py --backend batch）は
+  eap_uniform・eap_gh が 14〜32 倍、map が 1〜18 倍、wle が 1〜10 倍。
+- eap_uniform・eap_gh の θ・SE は eap_grid と 0.03 以内で一致する。
+  map・wle は別の推定量（事後モード・重み付き最尤）で、10 問の時点でも
+  θ が最大 0.6〜0.8 ずれるため、報告する得点を変えずに置き換えることはできない。
+"""
+
+import argparse
+import functools
+import time
+
+import numpy as np
+from numpy.polynomial.hermite_e import hermegauss
+
+THETA_MIN, THETA_MAX = -4.0, 4.0
+GRID = np.arange(-400, 401) / 100.0
+
+DEFAULT_UNIFORM_POINTS = 81
+DEFAULT_GH_POINTS = 41
+MAX_ITER = 50
+MAX_STEP = 1.0
+MAX_HALVING = 8
+START_POINTS = 33
+TOLERANCE = 1e-6
+# 前回の推定値から始める場合の Newton 法の反復回数（収束判定なし）
+WARM_ITERATIONS = 3
+MIN_CURVATURE = 1e-3
+# eap_gh の評価点の幅の下限（前回の se が極端に小さい場合）
+MIN_GH_SCALE = 0.05
+
+
+def _as_arrays(a, b, c, u):
+    """パラメータと反応を float 配列に変換（最後の軸が項目）"""
+    a, b, c, u = (np.asarray(x, dtype=float) for x in (a, b, c, u))
+    if a.shape == b.shape == c.shape == u.shape:
+        # 1問ごとの推定では形状が揃っているので broadcast_arrays の固定費を省く
+        return a, b, c, u
+    return np.broadcast_arrays(a, b, c, u)
+
+
+def _log_likelihood(theta, a, b, c, u):
+    """評価点 theta（形状 (..., K)）での対数尤度"""
+    p = c[..., None] + (1 - c[..., None]) / (1 + np.exp(a[..., None] * (b[..., None] - theta[..., None, :])))
+    # 正答なら P、誤答なら Q の対数だけを取る（log は1回）
+    p = np.where(u[..., None] > 0, p, 1 - p)
+    return np.log(np.maximum(p, 1e-12)).sum(axis=-2)
+
+
+def _derivatives(theta, a, b, c, u):
+    """
+    θ における対数尤度のスコア・テスト情報量・Warm の補正項 J・2階微分
+
+    Returns:
+        tuple: (score, information, j, curvature)（それぞれ形状 (...)。
+               curvature は対数尤度の2階微分で、Newton 法の分母に使う）
+    """
+    # 1問ごとの推定では配列が小さく関数呼び出しの固定費が支配的なため、
+    # np.clip・np.sum ではなく np.minimum/np.maximum・ndarray.sum を使う
+    logistic = 1 / (1 + np.exp(a * (b - theta[..., None])))
+    p = np.minimum(np.maximum(c + (1 - c) * logistic, 1e-12), 1 - 1e-12)
+    pq = p * (1 - p)
+    dp = a * (1 - c) * logistic * (1 - logistic)
+    weight = dp / pq
+    residual = u - p
+    shape = a * (1 - 2 * logistic)
+
+    score = (weight * residual).sum(axis=-1)
+    information = (weight * dp).sum(axis=-1)
+    j = (weight * dp * shape).sum(axis=-1)
+    curvature = (weight * (shape * residual - dp * (1 + residual * (1 - 2 * p) / pq))).sum(axis=-1)
+    return score, information, j, curvature
+
+
+def _posterior_moments(nodes, log_weights):
+    """評価点と対数重みから事後平均・事後標準偏差"""
+    log_weights = log_weights - log_weights.max(axis=-1, keepdims=True)
+    weights = np.exp(log_weights)
+    weights /= weights.sum(axis=-1, keepdims=True)
+    theta = (nodes * weights).sum(axis=-1)
+    deviation = nodes - theta[..., None]
+    se = np.sqrt((deviation * deviation * weights).sum(axis=-1))
+    return theta, se
+
+
+def eap_grid(a, b, c, u):
+    """従来の EAP（801 点の格子、R スクリプトと同じ）"""
+    return eap_uniform(a, b, c, u, points=len(GRID))
+
+
+def eap_uniform(a, b, c, u, points=DEFAULT_UNIFORM_POINTS):
+    """
+    等間隔格子による EAP
+
+    Args:
+        a, b, c (array): 項目パラメータ（形状 (..., n)）
+        u (array): 正誤（1/0）
+        points (int): [-4, 4] の評価点数
+
+    Returns:
+        tuple: (theta, se)
+    """
+    a, b, c, u = _as_arrays(a, b, c, u)
+    nodes = np.linspace(THETA_MIN, THETA_MAX, points)
+    log_weights = _log_likelihood(nodes, a, b, c, u) - nodes ** 2 / 2
+    return _posterior_moments(nodes, log_weights)
+
+
+def _fisher_scoring(equation, theta):
+    """
+    推定方程式 g(θ) = 0 を Fisher スコアリング法で解く（受験者ごとに独立）
+
+    1回の更新幅を MAX_STEP に制限し、根を飛び越えて |g| が増える更新は
+    幅を半分にしてやり直す（3PL の多峰性による振動を防ぐ）。
+
+    Args:
+        equation (callable): θ → (g, h, slope)。h は正の分母（情報量）
+        theta (array): 初期値
+
+    Returns:
+        tuple: (theta, h)（h は解での分母、SE の計算に使う）
+    """
+    g, h, _ = equation(theta)
+    for _ in range(MAX_ITER):
+        step = np.minimum(np.maximum(g / h, -MAX_STEP), MAX_STEP)
+        for _ in range(MAX_HALVING):
+            candidate = np.minimum(np.maximum(theta + step, THETA_MIN), THETA_MAX)
+            g_new, h_new, _ = equation(candidate)
+            worse = (g_new * g < 0) & (np.abs(g_new) > np.abs(g))
+            if not worse.any():
+                break
+            step = np.where(worse, step / 2, step)
+        moved = np.abs(candidate - theta)
+        theta, g, h = candidate, g_new, h_new
+        if (moved < TOLERANCE).all():
+            break
+    return theta, h
+
+
+def _warm_newton(equation, theta, secant=False):
+    """
+    前回の推定値から Newton 法を WARM_ITERATIONS 回だけ進める（1問ごとの推定用）
+
+    1問増えても解はほとんど動かないため、幅の半減・収束判定は行わない。
+    分母は -g'(θ)（secant=True なら2回目以降は割線の傾き）で、正でなければ
+    情報量（Fisher スコアリング）に切り替える。
+
+    Args:
+        equation (callable): θ → (g, h, slope)。slope は g'(θ)（近似でもよい）
+        theta (array): 初期値（前回の推定値）
+
+    Returns:
+        tuple: (theta, h)（h は最後に評価した点での情報量、SE の計算に使う）
+    """
+    previous = None
+    for _ in range(WARM_ITERATIONS):
+        g, h, slope = equation(theta)
+        if secant and previous is not None:
+            moved = theta - previous[0]
+            slope = np.where(moved != 0, (g - previous[1]) / np.where(moved != 0, moved, 1), slope)
+        previous = (theta, g)
+        denominator = np.where(slope < -MIN_CURVATURE, -slope, h)
+        step = np.minimum(np.maximum(g / denominator, -MAX_STEP), MAX_STEP)
+        theta = np.minimum(np.maximum(theta + step, THETA_MIN), THETA_MAX)
+    return theta, h
+
+
+def _coarse_start(a, b, c, u, objective):
+    """粗い格子上で目的関数が最大の点（前回の推定値がないときの初期値、局所解を避ける）"""
+    nodes = np.linspace(THETA_MIN, THETA_MAX, START_POINTS)
+    values = objective(nodes, np.broadcast_to(nodes, a.shape[:-1] + nodes.shape))
+    return nodes[np.argmax(values, axis=-1)]
+
+
+def map_estimate(a, b, c, u, start=None):
+    """
+    MAP 推定（標準正規事前分布）
+
+    前回の推定値があれば Newton 法を WARM_ITERATIONS 回、なければ粗い格子の
+    最大点から Fisher スコアリング法で収束まで解く。
+
+    Args:
+        start (array): 初期値（前回の推定値。None なら粗い格子で探す）
+
+    Returns:
+        tuple: (theta, se)
+    """
+    a, b, c, u = _as_arrays(a, b, c, u)
+
+    def equation(theta):
+        score, information, _, curvature = _derivatives(theta, a, b, c, u)
+        return score - theta, information + 1, curvature - 1
+
+    if start is not None:
+        theta, posterior_information = _warm_newton(equation, np.asarray(start, dtype=float))
+        return theta, 1 / np.sqrt(posterior_information)
+    start = _coarse_start(a, b, c, u, lambda nodes, _: _log_likelihood(nodes, a, b, c, u) - nodes ** 2 / 2)
+    theta, posterior_information = _fisher_scoring(equation, start)
+    return theta, 1 / np.sqrt(posterior_information)
+
+
+def wle(a, b, c, u, start=None):
+    """
+    Warm の重み付き最尤推定（全問正答・全問誤答でも有限、[-4, 4] に制限）
+
+    前回の推定値があれば Newton 法（補正項の微分は割線で近似）を
+    WARM_ITERATIONS 回、なければ粗い格子の最大点から Fisher スコアリング法で解く。
+
+    Args:
+        start (array): 初期値（前回の推定値。None なら粗い格子で探す）
+
+    Returns:
+        tuple: (theta, se)
+    """
+    a, b, c, u = _as_arrays(a, b, c, u)
+
+    def equation(theta):
+        score, information, j, curvature = _derivatives(theta, a, b, c, u)
+        information = np.maximum(information, 1e-10)
+        return score + j / (2 * information), information, curvature
+
+    def objective(nodes, theta):
+        # 2PL では WLE は L(θ)·sqrt(I(θ)) の最大点
+        _, information, _, _ = _derivatives(theta, a[..., None, :], b[..., None, :],
+                                         c[..., None, :], u[..., None, :])
+        return _log_likelihood(nodes, a, b, c, u) + np.log(np.maximum(information, 1e-10)) / 2
+
+    if start is not None:
+        theta, information = _warm_newton(equation, np.asarray(start, dtype=float), secant=True)
+        return theta, 1 / np.sqrt(information)
+    theta, information = _fisher_scoring(equation, _coarse_start(a, b, c, u, objective))
+    return theta, 1 / np.sqrt(information)
+
+
+@functools.lru_cache(maxsize=None)
+def _hermite_nodes(points):
+    """
+    Gauss-Hermite（確率論者版、重み exp(-x²/2)）の評価点と log 重み
+
+    1問ごとに呼ばれるため点数ごとに一度だけ計算し、書き換えられないよう
+    読み取り専用の配列で返す。
+    """
+    x, w = hermegauss(points)
+    log_w = np.log(w) + x ** 2 / 2
+    x.flags.writeable = False
+    log_w.flags.writeable = False
+    return x, log_w
+
+
+def eap_gh(a, b, c, u, points=DEFAULT_GH_POINTS, start=None, scale=None):
+    """
+    適応型 Gauss-Hermite 求積による EAP
+
+    事後平均・事後標準偏差の見込み（前回の推定値、なければ粗い格子の EAP）に
+    合わせて評価点を平行移動・拡大縮小するため、反応数が増えて事後分布が
+    鋭くなっても少ない評価点で精度が保たれる。
+    [-4, 4] で打ち切らない事後分布の積分なので、事後分布が ±4 付近に
+    かかる極端な反応パターンでは eap_grid とわずかに異なる。
+
+    Args:
+        start, scale (array): 評価点の中心と幅（前回の theta と se）
+
+    Returns:
+        tuple: (theta, se)
+    """
+    a, b, c, u = _as_arrays(a, b, c, u)
+    x, log_w = _hermite_nodes(points)
+
+    def integrate(center, scale):
+        nodes = center[..., None] + np.maximum(scale, MIN_GH_SCALE)[..., None] * x
+        # ∫ f(θ) dθ ≈ σ Σ w_k exp(x_k² / 2) f(μ + σ x_k)（σ は正規化で消える）
+        log_weights = _log_likelihood(nodes, a, b, c, u) - nodes ** 2 / 2 + log_w
+        return _posterior_moments(nodes, log_weights)
+
+    if start is None or scale is None:
+        center, scale = eap_uniform(a, b, c, u, points=START_POINTS)
+        # 粗い格子の間隔より鋭い事後分布では標準偏差が過小になるため下限を設ける
+        return integrate(center, np.maximum(scale, (THETA_MAX - THETA_MIN) / (START_POINTS - 1)))
+
+    center, scale = np.asarray(start, dtype=float), np.asarray(scale, dtype=float)
+    theta, se = integrate(center, scale)
+    # 今回の反応で事後分布が大きく動いた場合は、求めた事後平均・標準偏差で積分し直す
+    moved = np.abs(theta - center) > scale / 2
+    if moved.any():
+        refined = integrate(theta, se)
+        theta, se = np.where(moved, refined[0], theta), np.where(moved, refined[1], se)
+    return theta, se
+
+
+ESTIMATORS = {
+    'eap_grid': eap_grid,
+    'eap_uniform': eap_uniform,
+    'eap_gh': eap_gh,
+    'map': map_estimate,
+    'wle': wle,
+}
+
+
+def get_estimator(name):
+    """推定法名から関数を取得"""
+    try:
+        return ESTIMATORS[name]
+    except KeyError:
+        raise ValueError(f"未知の推定法: {name}（{', '.join(ESTIMATORS)}）")
+
+
+def estimate(name, a, b, c, u, previous=None):
+    """
+    指定した推定法で能力値を推定
+
+    Args:
+        name (str): ESTIMATORS のキー
+        a, b, c (array): 出題済み項目のパラメータ
+        u (array): 正誤（1/0）
+        previous (tuple): 前回の (theta, se)。map・wle・eap_gh の初期値に使う
+
+    Returns:
+        tuple: (theta, se)（1人分なら float）
+    """
+    kwargs = {}
+    if previous is not None:
+        if name in ('map', 'wle'):
+            kwargs = {'start': previous[0]}
+        elif name == 'eap_gh':
+            kwargs = {'start': previous[0], 'scale': previous[1]}
+    theta, se = get_estimator(name)(a, b, c, u, **kwargs)
+    if np.ndim(theta) == 0:
+        return float(theta), float(se)
+    return theta, se
+
+
+# ============================================================================
+# 精度・速度の比較
+# ============================================================================
+
+def _simulate_cat(bank, true_theta, length, rng):
+    """
+    eap_grid で1問ずつ推定・最大情報量で選択する CAT の出題と反応を生成
+
+    Returns:
+        tuple: (項目番号のリスト, 正誤のリスト)
+    """
+    import random
+
+    import cat_engine
+
+    item_id = cat_engine.start_session(bank, random.Random(int(rng.integers(2 ** 31))))['next_item']['id']
+    items, answers = [], []
+    while item_id is not None and len(items) < length:
+        pos = item_id - 1
+        p = cat_engine.prob_3pl(true_theta, bank.a[pos], bank.b[pos], bank.c[pos])
+        items.append(item_id)
+        answers.append(int(rng.random() < p))
+        theta, _ = cat_engine.estimate_ability(bank, items, answers)
+        item_id = cat_engine.select_next_item(bank, theta, items)
+    return items, answers
+
+
+def benchmark(csv_path, examinees=200, lengths=(5, 10, 20, 30), seed=1):
+    """
+    運用と同じく cat_engine.estimate_ability を1問ごとに呼び、eap_grid との差と
+    1回の推定時間を比較する
+
+    模擬受験者ごとに CAT の出題・反応を生成し、各推定法で1問目から順に推定する。
+    warm は前回の推定値から始めた場合（運用と同じ）、cold は前回の推定値を
+    渡さない場合の時間。batch は同じ項目数の全受験者を estimators に一括で
+    渡した場合（replay.py --backend batch）の1人あたりの時間。
+
+    Returns:
+        list: 推定法・項目数ごとの dict
+    """
+    import cat_engine
+    from item_bank import ItemBank
+
+    bank = ItemBank.from_csv(csv_path)
+    rng = np.random.default_rng(seed)
+    true_theta = rng.normal(size=examinees)
+    sessions = [_simulate_cat(bank, theta, max(lengths), rng) for theta in true_theta]
+
+    def run(name, warm):
+        """推定法 name で全受験者を1問ずつ推定 → (theta, se, 秒)（形状 (受験者, 項目数)）"""
+        shape = (examinees, max(lengths))
+        theta, se, seconds = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+        for i, (items, answers) in enumerate(sessions):
+            previous = None
+            for k in range(len(items)):
+                started = time.perf_counter()
+                estimate = cat_engine.estimate_ability(bank, items[:k + 1], answers[:k + 1], name,
+                                                       previous if warm else None)
+                seconds[i, k] = time.perf_counter() - started
+                theta[i, k], se[i, k] = estimate
+                previous = estimate
+        return theta, se, seconds
+
+    def run_batch(name, n):
+        """項目数 n の時点の全受験者を一括で推定した場合の1人あたりの秒数"""
+        pos = np.array([items[:n] for items, _ in sessions]) - 1
+        u = np.array([answers[:n] for _, answers in sessions], dtype=float)
+        started = time.perf_counter()
+        ESTIMATORS[name](bank.a[pos], bank.b[pos], bank.c[pos], u)
+        return (time.perf_counter() - started) / examinees
+
+    reference = run('eap_grid', False)
+    reference_batch = {n: run_batch('eap_grid', n) for n in lengths}
+    rows = []
+    for name in ESTIMATORS:
+        theta, se, warm = reference if name == 'eap_grid' else run(name, True)
+        cold = reference[2] if name == 'eap_grid' else run(name, False)[2]
+        for n in lengths:
+            k = n - 1
+            batch = reference_batch[n] if name == 'eap_grid' else run_batch(name, n)
+            rows.append({
+                'method': name,
+                'items': n,
+                'us_per_call': np.nanmean(warm[:, k]) * 1e6,
+                'us_cold': np.nanmean(cold[:, k]) * 1e6,
+                'speedup': np.nanmean(reference[2][:, k]) / np.nanmean(warm[:, k]),
+                'us_batch': batch * 1e6,
+                'speedup_batch': reference_batch[n] / batch,
+                'max_theta_diff': float(np.nanmax(np.abs(theta[:, k] - reference[0][:, k]))),
+                'max_se_diff': float(np.nanmax(np.abs(se[:, k] - reference[1][:, k]))),
+                'rmse_true': float(np.sqrt(np.nanmean((theta[:, k] - true_theta) ** 2)))
+            })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='能力値推定法の精度・速度比較')
+    parser.add_argument('--bench', action='store_true', help='eap_grid との比較を実行')
+    parser.add_argument('--csv', default='jacet_parameters.csv', help='項目パラメータCSV')
+    parser.add_argument('--examinees', type=int, default=200, help='模擬受験者数')
+    args = parser.parse_args()
+
+    if args.bench:
+        print(f"{'method':<12}{'items':>6}{'us/call':>10}{'x':>6}{'us/cold':>10}{'us/batch':>10}{'x':>6}"
+              f"{'max|dθ|':>10}{'max|dSE|':>10}{'RMSE':>8}")
+        for row in benchmark(args.csv, args.examinees):
+            print(f"{row['method']:<12}{row['items']:>6}"
+                  f"{row['us_per_call']:>10.1f}{row['speedup']:>6.1f}{row['us_cold']:>10.1f}"
+                  f"{row['us_batch']:>10.1f}{row['speedup_batch']:>6.1f}"
+                  f"{row['max_theta_diff']:>10.5f}{row['max_se_diff']:>10.5f}{row['rmse_true']:>8.3f}")
+    else:
+        parser.print_help()
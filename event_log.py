@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# event_log.py - 構造化（JSON Lines）ログ、別スレッドでの書き込み、ローテーションと検索
+
+"""
+ログを1行1レコードの JSON で書き出す。リクエストのスレッドはレコードを
+キューに入れるだけで、整形・ファイルへの書き込み・ローテーション・圧縮は
+QueueListener のスレッドが行う。
+
+- event(action, session_id, **fields): ユーザー操作のイベント（app.log_user_action）。
+  action / session_id / fields はレコードの項目としてそのまま JSON に入る。
+- ファイル: <log_dir>/jacet_cat.<pid>.jsonl（すべてのロガーの出力、INFO 以上）。
+  ワーカーのプロセスごとに別のファイルに書くため、ローテーションが他のプロセスの
+  書き込み中のファイルを移すことはない。標準出力には従来どおりの1行テキストも出す。
+- ローテーション: max_bytes を超えるか、最初のレコードから interval 秒を過ぎたら
+  jacet_cat.<pid>.<最初の時刻>.<最後の時刻>.jsonl.gz に圧縮して移し、全プロセス分の
+  うち新しい backup_count 個を残す（0 ならローテーションしない、logging.handlers と同じ）。
+  ファイル名に期間が入っているため、検索では範囲外のファイルを開かない。
+  終了したプロセスのファイルは、次に起動したプロセスが圧縮して移す。
+- キューが一杯のとき（書き込みが追いつかない場合）はレコードを捨てて数える。
+  リクエストを待たせない方を優先する。
+
+レコードの例:
+    {"ts": "2026-10-19T10:15:02.123", "level": "INFO", "logger": "jacet_cat.events",
+     "message": "answer_submitted", "action": "answer_submitted",
+     "session_id": "…", "item_id": 42, "correct": true}
+
+使い方（条件に合うレコードを NDJSON で標準出力へ）:
+    python event_log.py --session <session_id> --action answer_submitted --since 2026-10-01
+"""
+
+import argparse
+import atexit
+import copy
+import glob
+import gzip
+import heapq
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import time
+from datetime import datetime
+
+LOG_DIR = 'logs'
+BASE_NAME = 'jacet_cat'
+EVENT_LOGGER = 'jacet_cat.events'
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_INTERVAL = 24 * 60 * 60
+DEFAULT_BACKUP_COUNT = 60
+DEFAULT_QUEUE_SIZE = 10000
+STAMP_FORMAT = '%Y%m%dT%H%M%S%f'
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# LogRecord の標準属性（これ以外の属性は extra として JSON に入れる）
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_events = logging.getLogger(EVENT_LOGGER)
+_listener = None
+_queue_handler = None
+_config = None
+
+
+def event(action, session_id=None, **fields):
+    """
+    ユーザー操作のイベントを記録（キューに入れるだけで、書き込みを待たない）
+
+    Args:
+        action (str): 操作の種類（'answer_submitted' など）
+        session_id (str): 受験セッション
+        **fields: レコードに追加する項目（JSON に変換できる値）
+    """
+    if _events.isEnabledFor(logging.INFO):
+        _events.info(action, extra={'action': action, 'session_id': session_id, **fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """LogRecord → 1行の JSON"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """標準出力用の1行テキスト（イベントの項目は key=value で末尾に付ける）"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        text = super().format(record)
+        extra = [f'{key}={value}' for key, value in vars(record).items()
+                 if key not in _RECORD_ATTRIBUTES and key != 'action' and value is not None]
+        return f"{text} {' '.join(extra)}" if extra else text
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    レコードをキューに入れるだけのハンドラー
+
+    メッセージの整形は書き込みスレッドで行う（例外のトレースバックのみ、
+    フレームが変わる前にここで文字列にする）。キューが一杯なら捨てる。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RotatingJsonFileHandler(logging.FileHandler):
+    """
+    サイズ・経過時間でローテーションし、gzip で圧縮するファイルハンドラー（プロセスごとのファイル）
+
+    移したファイルの名前は <base>.<pid>.<最初のレコードの時刻>.<ローテーションの時刻>.jsonl.gz。
+    backup_count が 0 ならローテーションしない。
+    """
+
+    def __init__(self, log_dir, base_name=BASE_NAME, max_bytes=DEFAULT_MAX_BYTES,
+                 interval=DEFAULT_INTERVAL, backup_count=DEFAULT_BACKUP_COUNT):
+        if backup_count < 0:
+            raise ValueError('backup_count は 0 以上で指定してください')
+        self.log_dir = log_dir
+        self.base_name = base_name
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.pid = os.getpid()
+        path = os.path.join(log_dir, f'{base_name}.{self.pid}.jsonl')
+        self.started = _first_timestamp(path)
+        super().__init__(path, encoding='utf-8')
+        if backup_count:
+            self._rotate_orphans()
+
+    def emit(self, record):
+        try:
+            if self.should_rollover(record):
+                self.rollover(record.created)
+            if self.started is None:
+                self.started = record.created
+        except Exception:
+            self.handleError(record)
+        super().emit(record)
+
+    def should_rollover(self, record):
+        if self.started is None or not self.backup_count:
+            return False
+        if self.interval and record.created - self.started >= self.interval:
+            return True
+        return bool(self.max_bytes) and self.stream is not None and self.stream.tell() >= self.max_bytes
+
+    def rollover(self, now=None):
+        """現在のファイルを圧縮して移し、新しいファイルを開く"""
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            self._compress(self.baseFilename, self.pid, self.started, now or time.time())
+            os.remove(self.baseFilename)
+        self.started = None
+        self._prune()
+        self.stream = self._open()
+
+    def _compress(self, path, pid, started, ended):
+        """ログファイルを期間の入った名前で圧縮する（元のファイルは残す）"""
+        started = datetime.fromtimestamp(started or ended).strftime(STAMP_FORMAT)
+        while True:
+            stamp = datetime.fromtimestamp(ended).strftime(STAMP_FORMAT)
+            target = os.path.join(self.log_dir, f'{self.base_name}.{pid}.{started}.{stamp}.jsonl.gz')
+            if not os.path.exists(target):
+                break
+            ended += 1e-6
+        with open(path, 'rb') as source, gzip.open(target, 'wb') as dest:
+            shutil.copyfileobj(source, dest)
+
+    def _prune(self):
+        """全プロセス分のローテーション済みファイルのうち、新しい backup_count 個を残す"""
+        for path, _, _ in rotated_files(self.log_dir, self.base_name)[:-self.backup_count]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # 他のプロセスが先に削除した
+
+    def _rotate_orphans(self):
+        """終了したプロセスのログファイル（と以前の共有ファイル）を圧縮して移す"""
+        for path, pid in current_files(self.log_dir, self.base_name):
+            if pid == self.pid or (pid is not None and _running(pid)):
+                continue
+            # 同時に起動した他のプロセスと取り合わないよう、先に名前を変えたものだけが移す
+            claimed = f'{path}.{self.pid}.rotating'
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                if os.path.getsize(claimed) > 0:
+                    self._compress(claimed, pid if pid is not None else 0,
+                                   _first_timestamp(claimed), os.path.getmtime(claimed))
+                os.remove(claimed)
+            except OSError as e:
+                logging.getLogger(__name__).error(f"Log rotation error ({path}): {e}")
+        self._prune()
+
+
+def _running(pid):
+    """プロセスが動いているか"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _first_timestamp(path):
+    """既存のログファイルの最初のレコードの時刻（なければ None）"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return datetime.fromisoformat(json.loads(f.readline())['ts']).timestamp()
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def current_files(log_dir=LOG_DIR, base_name=BASE_NAME):
+    """
+    書き込み中（ローテーション前）のファイル
+
+    Returns:
+        list: (パス, pid) のリスト（以前の全プロセス共有のファイルは pid が None）
+    """
+    files = []
+    for path in glob.glob(os.path.join(log_dir, f'{base_name}.*jsonl')):
+        name = os.path.basename(path)[len(base_name) + 1:-len('.jsonl')]
+        if name == '':
+            files.append((path, None))
+        elif name.isdigit():
+            files.append((path, int(name)))
+    return sorted(files)
+
+
+def rotated_files(log_dir=LOG_DIR, base_name=BASE_NAME):
+    """
+    ローテーション済みのファイル（全プロセス分、古い順）
+
+    Returns:
+        list: (パス, 最初の時刻, 最後の時刻) のリスト（時刻は ISO 形式）
+    """
+    files = []
+    for path in glob.glob(os.path.join(log_dir, f'{base_name}.*.*.jsonl.gz')):
+        # <base>.<pid>.<最初>.<最後>.jsonl.gz（以前の形式は pid なし）
+        parts = os.path.basename(path).split('.')
+        try:
+            started, ended = (datetime.strptime(p, STAMP_FORMAT).isoformat() for p in parts[-4:-2])
+        except ValueError:
+            continue
+        files.append((path, started, ended))
+    return sorted(files, key=lambda f: (f[1], f[0]))
+
+
+def configure(log_dir=LOG_DIR, level=logging.INFO, max_bytes=DEFAULT_MAX_BYTES,
+              interval=DEFAULT_INTERVAL, backup_count=DEFAULT_BACKUP_COUNT,
+              queue_size=DEFAULT_QUEUE_SIZE, stream=sys.stdout):
+    """
+    ルートロガーをキュー経由の JSON ファイル＋標準出力に設定し、書き込みスレッドを開始
+
+    2回目以降の呼び出しでは何もしない。終了時にキューに残ったレコードを書き出す。
+    fork した子プロセス（設定後に fork するサーバーのワーカー）では、自分の pid の
+    ファイルと書き込みスレッドで設定し直す。
+
+    Returns:
+        NonBlockingQueueHandler: ルートロガーに追加したハンドラー（dropped で破棄数を確認）
+    """
+    global _listener, _queue_handler, _config
+    if _listener is not None:
+        return _queue_handler
+    _config = dict(log_dir=log_dir, level=level, max_bytes=max_bytes, interval=interval,
+                   backup_count=backup_count, queue_size=queue_size, stream=stream)
+
+    os.makedirs(log_dir, exist_ok=True)
+    file_handler = RotatingJsonFileHandler(log_dir, max_bytes=max_bytes, interval=interval,
+                                           backup_count=backup_count)
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if stream is not None:
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(TextFormatter())
+        handlers.append(stream_handler)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+    return _queue_handler
+
+
+def _after_fork():
+    """fork した子プロセス: 親の書き込みスレッドは引き継がれないので設定し直す"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
+    configure(**_config)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def shutdown():
+    """キューに残ったレコードを書き出して書き込みスレッドを止める"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def status():
+    """/api/system_status 用の状態"""
+    if _queue_handler is None:
+        return {'running': False}
+    return {'running': _listener is not None, 'queued': _queue_handler.queue.qsize(),
+            'dropped': _queue_handler.dropped}
+
+
+# ============================================================================
+# 検索
+# ============================================================================
+
+def _open_log(path):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8')
+
+
+def query(log_dir=LOG_DIR, session_id=None, action=None, since=None, until=None, base_name=BASE_NAME):
+    """
+    条件に合うレコードを古い順に返す（全プロセスのファイルを時刻順に合わせる）
+
+    ファイル名の期間が [since, until) と重ならないファイルは開かない。各行は
+    文字列の部分一致で絞り込んでから JSON として解析する。
+
+    Args:
+        session_id (str): 受験セッション
+        action (str): 操作の種類
+        since, until (str): 時刻の範囲（ISO 形式の前方一致、例 '2026-10-01'、'2026-10-01T09:00'）
+
+    Yields:
+        dict: レコード
+    """
+    paths = [path for path, started, ended in rotated_files(log_dir, base_name)
+             if (not since or ended >= since) and (not until or started < until)]
+    paths += [path for path, _ in current_files(log_dir, base_name)]
+
+    needles = [json.dumps(value, ensure_ascii=False) for value in (session_id, action) if value]
+    # 各ファイルの中は時刻順なので、ファイルをまたいで時刻順に合わせる
+    yield from heapq.merge(*(_matching(path, needles, session_id, action, since, until) for path in paths),
+                           key=lambda record: record.get('ts', ''))
+
+
+def _matching(path, needles, session_id, action, since, until):
+    """1ファイルのうち条件に合うレコード"""
+    try:
+        f = _open_log(path)
+    except FileNotFoundError:
+        return  # 検索中にローテーション・削除された
+    with f:
+        for line in f:
+            if not all(needle in line for needle in needles):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 書き込み途中の行
+            ts = record.get('ts', '')
+            if since and ts < since:
+                continue
+            if until and ts >= until:
+                continue
+            if session_id and record.get('session_id') != session_id:
+                continue
+            if action and record.get('action') != action:
+                continue
+            yield record
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='JACET CAT イベントログの検索（NDJSON を標準出力へ）')
+    parser.add_argument('--dir', default=LOG_DIR, help='ログのディレクトリ')
+    parser.add_argument('--session', help='session_id')
+    parser.add_argument('--action', help="操作の種類（例 'answer_submitted'）")
+    parser.add_argument('--since', help='この時刻以降（例 2026-10-01）')
+    parser.add_argument('--until', help='この時刻より前')
+    parser.add_argument('--count', action='store_true', help='件数のみ表示')
+    args = parser.parse_args()
+
+    matched = 0
+    try:
+        for record in query(args.dir, args.session, args.action, args.since, args.until):
+            matched += 1
+            if not args.count:
+                print(json.dumps(record, ensure_ascii=False))
+    except BrokenPipeError:
+        sys.exit(0)
+    if args.count:
+        print(matched)
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# item_bank.py - JACET CAT 項目バンク（Python スコアリング用）
+
+"""
+項目バンクは不変のスナップショットとして扱い、CSVの内容ハッシュをバージョンIDとする。
+ItemBankManager が現在のスナップショットを管理し、再読み込み時は検証後に
+参照を差し替えるだけなので、実行中のセッションは開始時のバージョンを使い続ける。
+
+各バージョンは snapshot_dir に次のファイルとして保存される。
+    <version>.csv         元のCSV（R スクリプト用）
+    <version>.items.npy   項目の構造化配列（レベル・パラメータ・選択肢）
+    <version>.tables.npy  θ グリッド上の log P / log Q 表（float32, 2 × 項目数 × グリッド点数）
+    <version>.grid.npy    表の θ グリッド
+.npy は読み取り専用でメモリマップするため、gunicorn の各ワーカーは
+CSV を解析せず、ページは OS のページキャッシュで共有される。
+"""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from cat_engine import THETA_GRID, prob_3pl
+from item_index import ItemIndex
+
+logger = logging.getLogger(__name__)
+
+PARAMETER_CSV = 'jacet_parameters.csv'
+SNAPSHOT_DIR = 'item_banks'
+
+OPTION_COLUMNS = ['CorrectAnswer', 'Distractor_1', 'Distractor_2', 'Distractor_3']
+
+
+def build_records(df):
+    """
+    パラメータCSVの DataFrame を項目の構造化配列に変換
+
+    文字列列の幅はデータの最大長に合わせる（.npy のヘッダに保存される）。
+
+    Raises:
+        ValueError: 選択肢に欠損値がある場合
+    """
+    if df[OPTION_COLUMNS + ['Item']].isna().any().any():
+        raise ValueError('単語または選択肢に欠損値があります')
+
+    def width(columns):
+        return max(1, int(df[columns].astype(str).apply(lambda col: col.str.len()).max().max()))
+
+    dtype = np.dtype([
+        ('level', '<i4'),
+        ('a', '<f8'),
+        ('b', '<f8'),
+        ('c', '<f8'),
+        ('word', f'<U{width(["Item"])}'),
+        ('part_of_speech', f'<U{width(["PartOfSpeech"])}'),
+        ('correct_answer', f'<U{width(["CorrectAnswer"])}'),
+        ('distractors', f'<U{width(OPTION_COLUMNS[1:])}', (3,))
+    ])
+    records = np.zeros(len(df), dtype=dtype)
+    records['level'] = df['Level'].to_numpy()
+    records['a'] = df['Dscrimination'].to_numpy(dtype=float)
+    records['b'] = df['Difficulty'].to_numpy(dtype=float)
+    records['c'] = df['Guessing'].to_numpy(dtype=float)
+    records['word'] = df['Item'].astype(str).to_numpy()
+    records['part_of_speech'] = df['PartOfSpeech'].fillna('').astype(str).to_numpy()
+    records['correct_answer'] = df['CorrectAnswer'].astype(str).to_numpy()
+    records['distractors'] = df[OPTION_COLUMNS[1:]].astype(str).to_numpy()
+    return records
+
+
+def build_tables(records, grid=THETA_GRID):
+    """θ グリッド上の log P / log Q 表（2 × 項目数 × グリッド点数, float32）"""
+    p = prob_3pl(grid[None, :], records['a'][:, None], records['b'][:, None], records['c'][:, None])
+    with np.errstate(divide='ignore'):
+        return np.stack([np.log(p), np.log(1 - p)]).astype(np.float32)
+
+
+class ItemBank:
+    """
+    項目バンク（構築後は不変）
+
+    項目番号は R 版と同じく CSV の行番号 + 1（1始まり）。内部配列は0始まり。
+    records はメモリ上の配列またはメモリマップされた .npy のどちらでもよい。
+    """
+
+    def __init__(self, records, version=None, csv_path=None, tables=None):
+        self.version = version
+        self.csv_path = csv_path
+        self.records = records
+        self.levels = records['level']
+        self.a = records['a']
+        self.b = records['b']
+        self.c = records['c']
+        # log P / log Q 表（なければ cat_engine が毎回計算する）
+        self.log_p = tables[0] if tables is not None else None
+        self.log_q = tables[1] if tables is not None else None
+        self.index = ItemIndex(self.a, self.b, self.c, self.levels)
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_csv(cls, csv_path=PARAMETER_CSV, version=None):
+        """パラメータCSV（jacet_parameters.csv 形式）から項目バンクを作成"""
+        df = pd.read_csv(csv_path)
+        return cls.from_dataframe(df, version=version, csv_path=csv_path)
+
+    @classmethod
+    def from_dataframe(cls, df, version=None, csv_path=None):
+        """パラメータCSVを読み込んだ DataFrame から項目バンクを作成"""
+        return cls(build_records(df), version=version, csv_path=csv_path)
+
+    def item(self, item_id):
+        """出題用の項目情報（R 版 next_item と同じ形式）"""
+        row = self.records[item_id - 1]
+        return {
+            'id': item_id,
+            'word': str(row['word']),
+            'level': int(row['level']),
+            'correct_answer': str(row['correct_answer']),
+            'distractors': [str(d) for d in row['distractors']]
+        }
+
+    def validate(self):
+        """
+        パラメータの妥当性を検証
+
+        Raises:
+            ValueError: 出題できない・推定が破綻する項目バンクの場合
+        """
+        if len(self) == 0:
+            raise ValueError('項目バンクが空です')
+        if not np.all(np.isfinite(self.a)) or np.any(self.a <= 0):
+            raise ValueError('識別力は正の有限値である必要があります')
+        if not np.all(np.isfinite(self.b)):
+            raise ValueError('困難度に欠損値があります')
+        if not np.all(np.isfinite(self.c)) or np.any(self.c < 0) or np.any(self.c >= 1):
+            raise ValueError('推測パラメータは 0 以上 1 未満である必要があります')
+        if not np.any(np.isin(self.levels, (3, 4, 5))):
+            raise ValueError('初期項目（Level 3-5）がありません')
+
+
+def _atomic_save(path, array):
+    """一時ファイルに書き込んでから置き換え（他ワーカーが書きかけを読まない）"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        if isinstance(array, bytes):
+            f.write(array)
+        else:
+            np.save(f, array)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def open_snapshot(version, snapshot_dir=SNAPSHOT_DIR):
+    """
+    保存済みスナップショットを読み取り専用でメモリマップ
+
+    Returns:
+        ItemBank or None: .items.npy がなければ None
+    """
+    base = os.path.join(snapshot_dir, version)
+    if not os.path.exists(f'{base}.items.npy'):
+        return None
+
+    records = np.load(f'{base}.items.npy', mmap_mode='r')
+    tables = None
+    if os.path.exists(f'{base}.tables.npy') and os.path.exists(f'{base}.grid.npy'):
+        if np.array_equal(np.load(f'{base}.grid.npy'), THETA_GRID):
+            tables = np.load(f'{base}.tables.npy', mmap_mode='r')
+    return ItemBank(records, version=version, csv_path=f'{base}.csv', tables=tables)
+
+
+def write_snapshot(bank, snapshot_dir=SNAPSHOT_DIR):
+    """項目の構造化配列と log P / log Q 表を保存"""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    base = os.path.join(snapshot_dir, bank.version)
+    _atomic_save(f'{base}.grid.npy', THETA_GRID)
+    _atomic_save(f'{base}.tables.npy', build_tables(bank.records))
+    # items.npy を最後に書く（存在すればスナップショット完成とみなす）
+    _atomic_save(f'{base}.items.npy', np.asarray(bank.records))
+
+
+def load_snapshot(csv_path, snapshot_dir=SNAPSHOT_DIR):
+    """
+    パラメータCSVのスナップショットを取得
+
+    同じ内容の版が保存済みならメモリマップするだけで、CSV は解析しない。
+    未保存なら CSV を検証してから、CSV のコピー・構造化配列・確率表を保存する。
+
+    Returns:
+        ItemBank: version と csv_path が設定された項目バンク
+
+    Raises:
+        ValueError: 検証に失敗した場合
+    """
+    with open(csv_path, 'rb') as f:
+        content = f.read()
+    version = hashlib.sha256(content).hexdigest()[:12]
+
+    bank = open_snapshot(version, snapshot_dir)
+    if bank is not None:
+        return bank
+
+    bank = ItemBank.from_dataframe(pd.read_csv(io.BytesIO(content)), version=version)
+    bank.validate()
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_csv = os.path.join(snapshot_dir, f'{version}.csv')
+    if not os.path.exists(snapshot_csv):
+        _atomic_save(snapshot_csv, content)
+    write_snapshot(bank, snapshot_dir)
+    return open_snapshot(version, snapshot_dir)
+
+
+def check_same_items(current, new):
+    """
+    新しい版で既存の項目番号が同じ単語を指しているか確認
+
+    項目番号は CSV の行位置なので、行の並べ替えや途中の行の削除で番号がずれると
+    回答・項目統計が別の単語のものとして扱われる。項目の追加は末尾に限る。
+
+    Raises:
+        ValueError: 単語が変わった項目番号がある場合
+    """
+    common = min(len(current), len(new))
+    changed = np.flatnonzero(current.records['word'][:common] != new.records['word'][:common]) + 1
+    if len(changed):
+        shown = ', '.join(str(item_id) for item_id in changed[:10])
+        raise ValueError(f'項目番号と単語の対応が変わっています（{len(changed)} 件: 項目番号 {shown}）')
+
+
+class SnapshotMissing(LookupError):
+    """セッションが使用中の版のスナップショットがない（別の版では採点を続けられない）"""
+
+    def __init__(self, version):
+        super().__init__(f'項目バンクの版 {version} のスナップショットがありません')
+        self.version = version
+
+
+class ItemBankManager:
+    """
+    バージョン付き項目バンクの管理
+
+    - current(): 現在のスナップショット。パラメータファイルの変更を検出すると
+      バックグラウンドで再読み込みし、完了までは旧スナップショットを返す
+    - get(version, session_id): セッション開始時のバージョンのスナップショット
+    - pin()/release(): セッションが使うバージョンを保持し、不要になった旧版を解放
+    """
+
+    def __init__(self, csv_path=PARAMETER_CSV, snapshot_dir=SNAPSHOT_DIR, check_interval=5.0):
+        self.csv_path = csv_path
+        self.snapshot_dir = snapshot_dir
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._current = None
+        self._snapshots = {}
+        self._pins = {}
+        self._file_stamp = None
+        self._next_check = 0.0
+        self._reloading = False
+
+    def _stamp(self):
+        stat = os.stat(self.csv_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """スナップショットを読み込み現在の版に設定（_reload_lock 保持中に呼ぶ）"""
+        stamp = self._stamp()
+        bank = load_snapshot(self.csv_path, self.snapshot_dir)
+        if self._current is not None:
+            check_same_items(self._current, bank)
+        with self._lock:
+            previous = self._current
+            self._snapshots.setdefault(bank.version, bank)
+            self._current = self._snapshots[bank.version]
+            self._file_stamp = stamp
+            self._discard_unused()
+        if previous is None or previous.version != bank.version:
+            logger.info(f"Item bank snapshot {bank.version} activated: {len(bank)} items")
+        return self._current
+
+    def reload(self):
+        """
+        パラメータファイルを読み込み、検証に成功したら現在のスナップショットを差し替え
+
+        Returns:
+            ItemBank: 新しい現在のスナップショット
+
+        Raises:
+            ValueError: 検証に失敗した・既存の項目番号の単語が変わった場合（現在のスナップショットは変更しない）
+        """
+        with self._reload_lock:
+            return self._load()
+
+    def _reload_in_background(self):
+        """ファイル変更時の再読み込みを1スレッドだけで実行（リクエストは待たせない）"""
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+
+        def worker():
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Item bank reload failed: {e}")
+                with self._lock:
+                    # 同じ壊れたファイルで再試行し続けない
+                    try:
+                        self._file_stamp = self._stamp()
+                    except OSError:
+                        pass
+            finally:
+                with self._lock:
+                    self._reloading = False
+
+        threading.Thread(target=worker, name='item-bank-reload', daemon=True).start()
+
+    def current(self):
+        """現在のスナップショット（必要に応じてファイル変更を検出）"""
+        if self._current is None:
+            with self._reload_lock:
+                if self._current is None:
+                    return self._load()
+
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            try:
+                if self._stamp() != self._file_stamp:
+                    self._reload_in_background()
+            except OSError as e:
+                logger.error(f"Item bank stat failed: {e}")
+        return self._current
+
+    def get(self, version=None, session_id=None):
+        """
+        指定バージョンのスナップショット（未指定の場合は現在の版）
+
+        session_id を渡すとそのセッションの使用版として登録する。
+        指定した版が見つからない場合に現在の版へ切り替えると、受験の途中で
+        採点パラメータが変わってしまうため例外にする。
+
+        Raises:
+            SnapshotMissing: 指定した版がメモリにも snapshot_dir にもない場合
+        """
+        bank = self._snapshots.get(version) if version is not None else None
+        if bank is None and version is not None:
+            # 他のワーカーや再起動前に作られた版は保存済みのCSVから復元
+            snapshot_path = os.path.join(self.snapshot_dir, f'{version}.csv')
+            if os.path.exists(snapshot_path):
+                with self._reload_lock:
+                    bank = self._snapshots.get(version)
+                    if bank is None:
+                        bank = open_snapshot(version, self.snapshot_dir)
+                    if bank is None:
+                        bank = ItemBank.from_csv(snapshot_path, version=version)
+                    with self._lock:
+                        self._snapshots[version] = bank
+            else:
+                logger.error(f"Item bank snapshot {version} not found")
+                raise SnapshotMissing(version)
+        if bank is None:
+            bank = self.current()
+
+        if session_id is not None:
+            self.pin(session_id, bank.version)
+        return bank
+
+    def pin(self, session_id, version):
+        """セッションが使うバージョンを登録"""
+        with self._lock:
+            self._pins[session_id] = version
+
+    def release(self, session_id):
+        """セッション終了時にバージョンの保持を解除"""
+        with self._lock:
+            self._pins.pop(session_id, None)
+            self._discard_unused()
+
+    def pinned_sessions(self):
+        """バージョンを保持しているセッションID（放棄セッションの回収用）"""
+        with self._lock:
+            return list(self._pins)
+
+    def release_many(self, session_ids):
+        """複数セッションの保持をまとめて解除"""
+        with self._lock:
+            for session_id in session_ids:
+                self._pins.pop(session_id, None)
+            self._discard_unused()
+
+    def _discard_unused(self):
+        """現在の版とセッションが使用中の版以外をメモリから解放（_lock 保持中に呼ぶ）"""
+        keep = set(self._pins.values())
+        if self._current is not None:
+            keep.add(self._current.version)
+        for version in list(self._snapshots):
+            if version not in keep:
+                del self._snapshots[version]
+
+    def status(self):
+        """管理画面用の状態"""
+        with self._lock:
+            return {
+                'current_version': self._current.version if self._current else None,
+                'loaded_versions': sorted(self._snapshots),
+                'pinned_sessions': len(self._pins)
+            }
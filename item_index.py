@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# item_index.py - 困難度ソート済み項目インデックス（最大情報量選択用）
+
+"""
+項目を識別力で層に分け、各層の中で困難度順に並べてバケットに分割する。
+各バケットが現在の θ で取り得る情報量の上限を使い、探索範囲を θ の近傍に絞り込む。
+
+3PL の項目情報量は L = 1 / (1 + exp(-a(θ - b))) とおくと
+    I(θ) = a² (1 - c) (1 - L) L² / (c + (1 - c) L) ≤ a² (1 - c) L (1 - L)
+           ≤ a² (1 - c) min(1/4, exp(-a |θ - b|))
+となるため、バケット内の a の範囲・最小の c・θ からの距離だけで上限が求まる。
+識別力の高い層から探索すると暫定最大値がすぐ大きくなり、低い層はほぼ丸ごと打ち切れる。
+出題済み項目とレベル制約はビットマスクで除外する。
+"""
+
+import bisect
+
+import numpy as np
+
+DEFAULT_BUCKET_SIZE = 32
+DEFAULT_STRATA = 4
+
+
+def level_mask(levels):
+    """レベルの集合をビットマスクに変換（bit n が Level n に対応）"""
+    mask = 0
+    for level in levels:
+        mask |= 1 << int(level)
+    return mask
+
+
+ALL_LEVELS = level_mask(range(1, 63))
+
+
+def _bound(distance, a_min, a_max):
+    """a ∈ [a_min, a_max]・困難度との距離 distance 以上の項目の情報量上限"""
+    bound = a_max * a_max / 4
+    if distance > 0:
+        # a² exp(-a d) は a = 2/d で最大
+        a_star = min(max(2.0 / distance, a_min), a_max)
+        bound = min(bound, a_star * a_star * np.exp(-a_star * distance))
+    return bound
+
+
+class _Stratum:
+    """識別力層の1つ（困難度順のバケット列）"""
+
+    def __init__(self, positions, a, b, c, level_bits, bucket_size):
+        order = positions[np.argsort(b[positions], kind='stable')]
+        self.order = order
+        self.a = a[order]
+        self.b = b[order]
+        self.c = c[order]
+        self.level_bits = level_bits[order]
+
+        size = len(order)
+        self.starts = list(range(0, size, bucket_size))
+        self.ends = [min(s + bucket_size, size) for s in self.starts]
+
+        # バケットごとの上限計算用の要約値
+        spans = list(zip(self.starts, self.ends))
+        self.b_min = [float(self.b[s]) for s in self.starts]
+        self.b_max = [float(self.b[e - 1]) for e in self.ends]
+        self.a_min = [float(self.a[s:e].min()) for s, e in spans]
+        self.a_max = [float(self.a[s:e].max()) for s, e in spans]
+        self.c_min = [float(self.c[s:e].min()) for s, e in spans]
+        self.bucket_levels = [int(np.bitwise_or.reduce(self.level_bits[s:e])) for s, e in spans]
+
+        # 左右の探索打ち切り用：端までのバケットに含まれる a の最大値
+        self.a_max_prefix = [float(v) for v in np.maximum.accumulate(self.a_max)]
+        self.a_max_suffix = [float(v) for v in np.maximum.accumulate(self.a_max[::-1])[::-1]]
+        self.peak = max(self.a_max) ** 2 / 4 * (1 - min(self.c_min))
+
+    def bucket_bound(self, bucket, theta):
+        """バケット内の項目が θ で取り得る情報量の上限"""
+        distance = max(self.b_min[bucket] - theta, theta - self.b_max[bucket], 0.0)
+        return _bound(distance, self.a_min[bucket], self.a_max[bucket]) * (1 - self.c_min[bucket])
+
+    def tail_bound(self, bucket, theta, upward):
+        """bucket から片側の端までの全バケットに共通する情報量上限（距離に対して単調）"""
+        if upward:
+            distance, a_cap = self.b_min[bucket] - theta, self.a_max_suffix[bucket]
+        else:
+            distance, a_cap = theta - self.b_max[bucket], self.a_max_prefix[bucket]
+        return _bound(max(distance, 0.0), 0.0, a_cap)
+
+    def bucket_info(self, bucket, theta, excluded, levels):
+        """バケット内の有効項目の情報量（無効項目は -1）"""
+        start, end = self.starts[bucket], self.ends[bucket]
+        width = end - start
+
+        local = (excluded >> start) & ((1 << width) - 1)
+        taken = np.unpackbits(
+            np.frombuffer(local.to_bytes((width + 7) // 8, 'little'), dtype=np.uint8),
+            bitorder='little'
+        )[:width].astype(bool)
+        eligible = ~taken & ((self.level_bits[start:end] & levels) != 0)
+
+        a, b, c = self.a[start:end], self.b[start:end], self.c[start:end]
+        p = c + (1 - c) / (1 + np.exp(-a * (theta - b)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            info = (a ** 2 * (1 - p) * (p - c) ** 2) / (p * (1 - c) ** 2)
+        info = np.where((p > c) & (p < 1), info, 0.0)
+        return np.where(eligible, info, -1.0)
+
+    def search(self, theta, excluded, levels, best_info, best_pos):
+        """θ を含むバケットから外側へ探索し、(最大情報量, 項目位置) を更新して返す"""
+        n_buckets = len(self.starts)
+        hi = max(bisect.bisect_right(self.b_min, theta) - 1, 0)
+        lo = hi - 1
+
+        while lo >= 0 or hi < n_buckets:
+            lo_bound = self.tail_bound(lo, theta, upward=False) if lo >= 0 else -1.0
+            hi_bound = self.tail_bound(hi, theta, upward=True) if hi < n_buckets else -1.0
+            if best_pos is not None and max(lo_bound, hi_bound) < best_info:
+                break
+
+            if hi_bound >= lo_bound:
+                bucket = hi
+                hi += 1
+            else:
+                bucket = lo
+                lo -= 1
+
+            if not self.bucket_levels[bucket] & levels:
+                continue
+            if best_pos is not None and self.bucket_bound(bucket, theta) < best_info:
+                continue
+
+            info = self.bucket_info(bucket, theta, excluded, levels)
+            value = float(info.max())
+            if value < 0:
+                continue
+
+            offsets = np.flatnonzero(info == value) + self.starts[bucket]
+            pos = int(self.order[offsets].min())
+            # 同値の場合は項目番号の小さい方（R の which.max と同じ）
+            if value > best_info or (value == best_info and pos < best_pos):
+                best_info, best_pos = value, pos
+
+        return best_info, best_pos
+
+
+class ItemIndex:
+    """識別力層 × 困難度順バケットによる項目インデックス（構築後は不変）"""
+
+    def __init__(self, a, b, c, levels, bucket_size=DEFAULT_BUCKET_SIZE, strata=DEFAULT_STRATA):
+        """
+        Args:
+            a, b, c (array): 項目パラメータ（項目バンクの行順）
+            levels (array): 項目レベル
+            bucket_size (int): 1バケットあたりの項目数
+            strata (int): 識別力層の数
+        """
+        a = np.asarray(a, dtype=float)
+        b = np.asarray(b, dtype=float)
+        c = np.asarray(c, dtype=float)
+        level_bits = np.left_shift(1, np.asarray(levels, dtype=np.int64))
+
+        self.size = len(a)
+        self.bucket_size = bucket_size
+
+        # 識別力の分位で層に分割（各層に少なくとも1バケット分の項目）
+        n_strata = max(1, min(strata, self.size // bucket_size))
+        by_a = np.argsort(a, kind='stable')
+        self.strata = [
+            _Stratum(positions, a, b, c, level_bits, bucket_size)
+            for positions in np.array_split(by_a, n_strata) if len(positions)
+        ]
+        self.strata.sort(key=lambda stratum: stratum.peak, reverse=True)
+
+        # 項目位置 → (層, 層内の順位)
+        self.stratum_of = np.empty(self.size, dtype=np.int64)
+        self.rank_of = np.empty(self.size, dtype=np.int64)
+        for s, stratum in enumerate(self.strata):
+            self.stratum_of[stratum.order] = s
+            self.rank_of[stratum.order] = np.arange(len(stratum.order))
+
+    def __len__(self):
+        return self.size
+
+    def excluded_bits(self, positions):
+        """除外する項目位置（0始まり）を層ごとの困難度順ビットマスクに変換"""
+        bits = [0] * len(self.strata)
+        for pos in positions:
+            bits[self.stratum_of[pos]] |= 1 << int(self.rank_of[pos])
+        return bits
+
+    def select(self, theta, exclude=(), levels=ALL_LEVELS):
+        """
+        θ で情報量最大の項目を選択
+
+        識別力の高い層から順に、θ を含むバケットから外側へ上限の大きい側を
+        優先して探索し、残りのバケット全体の上限が暫定最大値を下回った時点で
+        打ち切る。層全体の上限が暫定最大値に届かない層は探索しない。
+
+        Args:
+            theta (float): 現在の能力推定値
+            exclude (iterable): 除外する項目位置（0始まり、出題済み項目）
+            levels (int): 出題を許可するレベルのビットマスク
+
+        Returns:
+            int or None: 選択された項目位置（0始まり）。候補がなければ None
+        """
+        excluded = self.excluded_bits(exclude)
+
+        best_info, best_pos = -1.0, None
+        for s, stratum in enumerate(self.strata):
+            if best_pos is not None and stratum.peak < best_info:
+                break
+            best_info, best_pos = stratum.search(theta, excluded[s], levels, best_info, best_pos)
+
+        return best_pos
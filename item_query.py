@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# item_query.py - 項目統計 API のページング・絞り込み・列の選択
+
+"""
+/admin/item_statistics の問い合わせを組み立て、JSON をストリーミングで返す。
+項目バンクが数千項目になっても、応答の大きさと待ち時間は1ページ分に収まる。
+
+- ページングはキーセット方式（並び順の列の値と item_id をカーソルに入れ、
+  その続きから読む）。OFFSET と違い、後ろのページでも読み飛ばしが発生しない。
+- 並べ替えはインデックスのある列のみ。item_id は INTEGER PRIMARY KEY（rowid）なので、
+  単一列のインデックスがそのまま (列, item_id) の順になり、ソートが発生しない。
+- 絞り込み: レベル・露出回数・正答率（p_value）・最終使用日時の範囲
+- fields で返す列を選べる（item_id は常に含む）
+
+クエリパラメータ:
+    limit, cursor, sort（item_id / level / exposure_count / p_value / last_used）,
+    order（asc / desc）, level（例 '1,2'）, min_exposure, max_exposure,
+    min_p, max_p, used_since, used_until, fields（例 'word,p_value'）
+"""
+
+import base64
+import json
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+FETCH_SIZE = 200
+
+# API の項目名 → item_statistics の列
+FIELDS = {
+    'item_id': 'item_id',
+    'word': 'item_word',
+    'level': 'item_level',
+    'exposure_count': 'exposure_count',
+    'correct_count': 'correct_count',
+    'total_responses': 'total_responses',
+    'p_value': 'p_value',
+    'discrimination': 'discrimination',
+    'difficulty': 'difficulty',
+    'guessing': 'guessing',
+    'last_used': 'last_used'
+}
+
+# 並べ替えに使える列（いずれもインデックスあり、create_database.INDEXES）
+SORTS = {
+    'item_id': 'item_id',
+    'level': 'item_level',
+    'exposure_count': 'exposure_count',
+    'p_value': 'p_value',
+    'last_used': 'last_used'
+}
+
+
+def encode_cursor(sort, order, value, item_id):
+    """最後の行の位置 → 不透明なカーソル文字列"""
+    payload = json.dumps([sort, order, value, item_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort, order):
+    """
+    カーソル文字列 → (並び順の列の値, item_id)
+
+    Raises:
+        ValueError: 不正なカーソル、または並び順が変わった場合
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, cursor_order, value, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        item_id = int(item_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'不正なカーソルです: {e}')
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError('カーソルと並び順（sort / order）が一致しません')
+    return value, item_id
+
+
+def _number(args, name, cast):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        raise ValueError(f'{name} が不正です: {value}')
+
+
+def parse_params(args):
+    """
+    クエリパラメータを検証して問い合わせ条件にする
+
+    Args:
+        args (dict): request.args
+
+    Returns:
+        dict: build_query() に渡す条件
+
+    Raises:
+        ValueError: 不正なパラメータ
+    """
+    sort = args.get('sort') or 'item_id'
+    if sort not in SORTS:
+        raise ValueError(f"sort は {', '.join(SORTS)} のいずれかです")
+    order = (args.get('order') or 'asc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError('order は asc / desc のいずれかです')
+
+    fields = [f.strip() for f in (args.get('fields') or '').split(',') if f.strip()] or list(FIELDS)
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise ValueError(f"不明な項目です: {', '.join(unknown)}")
+    if 'item_id' not in fields:
+        fields.insert(0, 'item_id')
+
+    levels = args.get('level')
+    try:
+        levels = [int(level) for level in levels.split(',') if level.strip()] if levels else []
+    except ValueError:
+        raise ValueError(f'level が不正です: {levels}')
+
+    limit = _number(args, 'limit', int) or DEFAULT_LIMIT
+    params = {
+        'sort': sort,
+        'order': order,
+        'fields': fields,
+        'limit': max(1, min(limit, MAX_LIMIT)),
+        'levels': levels,
+        'min_exposure': _number(args, 'min_exposure', int),
+        'max_exposure': _number(args, 'max_exposure', int),
+        'min_p': _number(args, 'min_p', float),
+        'max_p': _number(args, 'max_p', float),
+        'used_since': args.get('used_since') or None,
+        'used_until': args.get('used_until') or None,
+        'after': None
+    }
+    if args.get('cursor'):
+        params['after'] = decode_cursor(args['cursor'], sort, order)
+    return params
+
+
+def _after_condition(column, value, item_id, descending):
+    """
+    カーソルより後ろの行の条件（NULL は昇順で先頭、降順で末尾、SQLite の並び順と同じ）
+    """
+    if column == 'item_id':
+        return ('item_id < ?' if descending else 'item_id > ?'), [item_id]
+    if descending:
+        if value is None:
+            return f'({column} IS NULL AND item_id < ?)', [item_id]
+        return (f'({column} < ? OR ({column} = ? AND item_id < ?) OR {column} IS NULL)',
+                [value, value, item_id])
+    if value is None:
+        return f'(({column} IS NULL AND item_id > ?) OR {column} IS NOT NULL)', [item_id]
+    return f'({column} > ? OR ({column} = ? AND item_id > ?))', [value, value, item_id]
+
+
+def build_query(params):
+    """
+    条件 → (SQL, パラメータ)
+
+    limit + 1 行を読み、最後の1行の有無で次のページがあるかを判定する。
+    """
+    column = SORTS[params['sort']]
+    descending = params['order'] == 'desc'
+    conditions, values = [], []
+
+    if params['levels']:
+        conditions.append(f"item_level IN ({','.join('?' * len(params['levels']))})")
+        values += params['levels']
+    for name, sql in (('min_exposure', 'exposure_count >= ?'), ('max_exposure', 'exposure_count <= ?'),
+                      ('min_p', 'p_value >= ?'), ('max_p', 'p_value <= ?'),
+                      ('used_since', 'last_used >= ?'), ('used_until', 'last_used < ?')):
+        if params[name] is not None:
+            conditions.append(sql)
+            values.append(params[name])
+    if params['after'] is not None:
+        condition, after_values = _after_condition(column, *params['after'], descending)
+        conditions.append(condition)
+        values += after_values
+
+    direction = 'DESC' if descending else 'ASC'
+    selected = {FIELDS[f] for f in params['fields']} | {'item_id', column}
+    order_by = 'item_id' if column == 'item_id' else f'{column} {direction}, item_id'
+    sql = (f"SELECT {', '.join(sorted(selected))} FROM item_statistics"
+           + (f" WHERE {' AND '.join(conditions)}" if conditions else '')
+           + f" ORDER BY {order_by} {direction} LIMIT ?")
+    return sql, values + [params['limit'] + 1]
+
+
+def stream_page(conn, params):
+    """
+    1ページ分の JSON を少しずつ生成（最後に conn を閉じる）
+
+    出力: {"items": [...], "next_cursor": "...", "has_more": true/false}
+    """
+    try:
+        sql, values = build_query(params)
+        cursor = conn.execute(sql, values)
+        columns = [d[0] for d in cursor.description]
+        fields = [(name, columns.index(FIELDS[name])) for name in params['fields']]
+        sort_index = columns.index(SORTS[params['sort']])
+        id_index = columns.index('item_id')
+
+        yield '{"items":['
+        emitted, last, has_more = 0, None, False
+        while not has_more:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            chunk = []
+            for row in rows:
+                if emitted == params['limit']:
+                    # limit + 1 行目があれば次のページがある
+                    has_more = True
+                    break
+                chunk.append(json.dumps({name: row[i] for name, i in fields}, ensure_ascii=False))
+                last = row
+                emitted += 1
+            if chunk:
+                yield (',' if emitted > len(chunk) else '') + ','.join(chunk)
+
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(params['sort'], params['order'],
+                                        last[sort_index], last[id_index])
+        yield f'],"next_cursor":{json.dumps(next_cursor)},"has_more":{json.dumps(has_more)}}}'
+    finally:
+        conn.close()
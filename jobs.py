@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# jobs.py - 管理画面の一括メンテナンス処理（バックグラウンドジョブ）
+
+"""
+統計のリセット・古いセッションの削除・工場出荷時設定への復帰を
+バックグラウンドスレッドで実行する。
+
+- 削除・更新は chunk_size 行ずつの短いトランザクションに分け、間に pause 秒
+  待つことで、受験中のセッションの書き込みが SQLite の書き込みロックを長時間
+  待たされないようにする。
+- ジョブの状態は maintenance_jobs テーブルに保存するため、複数ワーカーでも
+  どのプロセスからでも進捗の確認・中止ができる（中止はチャンクの境界で反映）。
+- 同時に実行できるジョブは1つ。削除の後は ANALYZE を行い、データベースが
+  auto_vacuum = INCREMENTAL なら空きページを少しずつ解放する。
+  全体を書き直す VACUUM は書き込みを止めるため、vacuum=True の指定時のみ行う。
+- ANALYZE・VACUUM は1つの文で、実行中は進捗を書き込めない（書き込みロックを
+  持つため）。その前に JobContext.expect で所要時間の上限を宣言すると、
+  updated_at をその分だけ先の時刻にして、途中で異常終了扱いにならないようにする。
+
+ジョブ関数は (JobContext, **params) を受け取るジェネレータで、チャンクを
+1つ処理するごとに yield する。戻り値は結果として保存される。
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import archive
+import norms
+import provisioning
+import results_store
+from create_database import DEFAULT_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_PAUSE = 0.05
+# この秒数以上進捗の更新がない実行中ジョブは異常終了したとみなす
+STALE_AFTER = 300
+VACUUM_PAGES = 256
+# ANALYZE・VACUUM（1つの文で進捗を更新できない）に見込む最大の秒数
+LONG_STEP_SECONDS = 3600
+
+JOBS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS maintenance_jobs (
+        job_id TEXT PRIMARY KEY,
+        kind TEXT,
+        params TEXT,
+        status TEXT,
+        done INTEGER DEFAULT 0,
+        total INTEGER,
+        message TEXT,
+        result TEXT,
+        error TEXT,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+'''
+
+ACTIVE_STATUSES = ('queued', 'running', 'cancelling')
+
+
+class JobCancelled(Exception):
+    """ジョブが中止された"""
+
+
+def ensure_jobs_table(conn):
+    """maintenance_jobs がなければ作成"""
+    conn.execute(JOBS_TABLE_SQL)
+
+
+class JobContext:
+    """ジョブ関数に渡す実行環境（接続・進捗の記録・中止の確認）"""
+
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+        self.chunk_size = manager.chunk_size
+        self.done = 0
+        self.total = None
+        self.message = ''
+        self.lease = None
+
+    def connect(self):
+        return sqlite3.connect(self.manager.db_path, timeout=30.0)
+
+    def progress(self, done=None, total=None, message=None):
+        """進捗を更新（データベースへの反映はチャンクの境界で行う）"""
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+
+    def expect(self, seconds):
+        """
+        次の yield の後の処理に最大 seconds 秒かかることを宣言する
+
+        次の yield で updated_at を seconds 秒先の時刻として記録するため、
+        その間は進捗が途絶えても異常終了とみなされない。
+        """
+        self.lease = seconds
+
+
+class JobManager:
+    """メンテナンスジョブの登録・実行・状態管理"""
+
+    def __init__(self, db_path, chunk_size=DEFAULT_CHUNK_SIZE, pause=DEFAULT_PAUSE):
+        """
+        Args:
+            db_path (str): データベースファイル
+            chunk_size (int): 1トランザクションで処理する行数
+            pause (float): チャンク間の待ち時間（秒）
+        """
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.kinds = dict(JOBS)
+        self._lock = threading.Lock()
+
+    def register(self, kind, func):
+        """ジョブ関数を登録（JOBS 以外の種別を追加する場合）"""
+        self.kinds[kind] = func
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10.0)
+        ensure_jobs_table(conn)
+        return conn
+
+    def _update(self, job_id, **fields):
+        fields.setdefault('updated_at', datetime.now())
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    f"UPDATE maintenance_jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE job_id = ?",
+                    (*fields.values(), job_id)
+                )
+        finally:
+            conn.close()
+
+    def active_job(self):
+        """実行中（または待機中）のジョブ（なければ None）"""
+        conn = self._connect()
+        try:
+            # 進捗が途絶えたジョブ（プロセスの異常終了など）は失敗扱いにする
+            with conn:
+                conn.execute(f'''
+                    UPDATE maintenance_jobs SET status = 'failed', error = ?, finished_at = ?
+                    WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))}) AND updated_at < ?
+                ''', ('進捗の更新が途絶えました', datetime.now(), *ACTIVE_STATUSES,
+                      datetime.now() - timedelta(seconds=STALE_AFTER)))
+            row = conn.execute(f'''
+                SELECT job_id FROM maintenance_jobs
+                WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))})
+                ORDER BY created_at LIMIT 1
+            ''', ACTIVE_STATUSES).fetchone()
+        finally:
+            conn.close()
+        return self.get(row[0]) if row else None
+
+    def submit(self, kind, **params):
+        """
+        ジョブを登録してバックグラウンドで開始
+
+        Returns:
+            dict: ジョブの状態
+
+        Raises:
+            ValueError: 未登録のジョブ種別
+            RuntimeError: 他のジョブを実行中
+        """
+        if kind not in self.kinds:
+            raise ValueError(f'不明なジョブ: {kind}')
+
+        with self._lock:
+            active = self.active_job()
+            if active:
+                raise RuntimeError(f"他のメンテナンス処理（{active['kind']}）を実行中です")
+
+            job_id = uuid.uuid4().hex[:12]
+            now = datetime.now()
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('''
+                        INSERT INTO maintenance_jobs (job_id, kind, params, status, created_at, updated_at)
+                        VALUES (?, ?, ?, 'queued', ?, ?)
+                    ''', (job_id, kind, json.dumps(params), now, now))
+            finally:
+                conn.close()
+
+        threading.Thread(target=self._run, args=(job_id, kind, params),
+                         name=f'job-{kind}', daemon=True).start()
+        return self.get(job_id)
+
+    def _cancel_requested(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT status FROM maintenance_jobs WHERE job_id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return row is not None and row[0] == 'cancelling'
+
+    def _run(self, job_id, kind, params):
+        ctx = JobContext(self, job_id)
+        self._update(job_id, status='running')
+        try:
+            steps = self.kinds[kind](ctx, **params)
+            while True:
+                try:
+                    next(steps)
+                except StopIteration as stop:
+                    result = stop.value
+                    break
+                lease, ctx.lease = ctx.lease, None
+                self._update(job_id, done=ctx.done, total=ctx.total, message=ctx.message,
+                             updated_at=datetime.now() + timedelta(seconds=lease or 0))
+                if self._cancel_requested(job_id):
+                    steps.close()
+                    raise JobCancelled()
+                time.sleep(self.pause)
+
+            self._update(job_id, status='completed', done=ctx.done, total=ctx.total,
+                         message=ctx.message, result=json.dumps(result), finished_at=datetime.now())
+            logger.info(f"Maintenance job {kind} ({job_id}) completed: {result}")
+
+        except JobCancelled:
+            self._update(job_id, status='cancelled', done=ctx.done, total=ctx.total,
+                         message=ctx.message, finished_at=datetime.now())
+            logger.info(f"Maintenance job {kind} ({job_id}) cancelled at {ctx.done}/{ctx.total}")
+
+        except Exception as e:
+            logger.error(f"Maintenance job {kind} ({job_id}) error: {e}")
+            self._update(job_id, status='failed', error=str(e), finished_at=datetime.now())
+
+    def cancel(self, job_id):
+        """
+        ジョブの中止を要求（次のチャンクの境界で停止）
+
+        Returns:
+            bool: 中止を要求した場合 True（既に終了していれば False）
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute('''
+                    UPDATE maintenance_jobs SET status = 'cancelling', updated_at = ?
+                    WHERE job_id = ? AND status IN ('queued', 'running')
+                ''', (datetime.now(), job_id)).rowcount == 1
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        """ジョブの状態（なければ None）"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute('SELECT * FROM maintenance_jobs WHERE job_id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'] or '{}')
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['percent'] = round(100 * job['done'] / job['total'], 1) if job['total'] else None
+        return job
+
+    def recent(self, limit=10):
+        """最近のジョブ（新しい順）"""
+        conn = self._connect()
+        try:
+            ids = [row[0] for row in conn.execute(
+                'SELECT job_id FROM maintenance_jobs ORDER BY created_at DESC LIMIT ?', (limit,)
+            )]
+        finally:
+            conn.close()
+        return [self.get(job_id) for job_id in ids]
+
+
+# ============================================================================
+# ジョブ関数
+# ============================================================================
+
+def _chunks(ctx, conn, select_sql, params, apply):
+    """
+    select_sql で選んだキーを chunk_size 件ずつ apply(conn, keys) で処理する
+
+    削除・更新によって select_sql の結果から外れていくことを前提にしている。
+    """
+    while True:
+        keys = [row[0] for row in conn.execute(select_sql, (*params, ctx.chunk_size))]
+        if not keys:
+            return
+        with conn:
+            apply(conn, keys)
+        ctx.progress(done=ctx.done + len(keys))
+        yield
+
+
+def _finish(ctx, conn, vacuum=False):
+    """削除後の統計情報の更新と空きページの解放"""
+    ctx.progress(message='統計情報を更新中')
+    ctx.expect(LONG_STEP_SECONDS)
+    yield
+    conn.execute('ANALYZE')
+    yield
+
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        ctx.progress(message='空き領域を解放中')
+        while conn.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+            conn.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES})').fetchall()
+            yield
+    elif vacuum:
+        # データベース全体を書き直すため、その間は書き込みが止まる
+        ctx.progress(message='VACUUM を実行中')
+        ctx.expect(LONG_STEP_SECONDS)
+        yield
+        conn.execute('VACUUM')
+        yield
+
+
+def reset_statistics(ctx, vacuum=False):
+    """項目統計（item_statistics の集計値とアーカイブ済みの集計）を初期化"""
+    conn = ctx.connect()
+    try:
+        archive.ensure_totals_table(conn)
+        total = conn.execute('''
+            SELECT COUNT(*) FROM item_statistics
+            WHERE total_responses != 0 OR exposure_count != 0 OR last_used IS NOT NULL
+        ''').fetchone()[0]
+        total += conn.execute('SELECT COUNT(*) FROM archived_item_totals').fetchone()[0]
+        ctx.progress(done=0, total=total, message='項目統計を初期化中')
+
+        def reset(conn, keys):
+            conn.execute(f'''
+                UPDATE item_statistics
+                SET exposure_count = 0, correct_count = 0, total_responses = 0,
+                    p_value = 0.0, last_used = NULL
+                WHERE item_id IN ({','.join('?' * len(keys))})
+            ''', keys)
+
+        yield from _chunks(ctx, conn, '''
+            SELECT item_id FROM item_statistics
+            WHERE total_responses != 0 OR exposure_count != 0 OR last_used IS NOT NULL
+            LIMIT ?
+        ''', (), reset)
+
+        def drop_totals(conn, keys):
+            conn.execute(f"DELETE FROM archived_item_totals WHERE item_id IN ({','.join('?' * len(keys))})", keys)
+
+        yield from _chunks(ctx, conn, 'SELECT item_id FROM archived_item_totals LIMIT ?', (), drop_totals)
+        yield from _finish(ctx, conn, vacuum)
+        return {'reset': ctx.done}
+    finally:
+        conn.close()
+
+
+def clear_sessions(ctx, days=30, sessions_per_chunk=None, vacuum=False):
+    """
+    開始から days 日を過ぎたセッション・回答・結果を削除（受験中のセッションは除く）
+
+    完了セッションの θ は同じトランザクションで集団基準（norm_sketches）から引く。
+
+    1チャンクの回答数がおおよそ chunk_size になるよう、セッションは
+    chunk_size / 30（最大出題数）件ずつ削除する。
+    """
+    cutoff = datetime.now() - timedelta(days=int(days))
+    sessions_per_chunk = sessions_per_chunk or max(1, ctx.chunk_size // 30)
+
+    conn = ctx.connect()
+    try:
+        provisioning.ensure_provisioning_table(conn)
+        results_store.ensure_results_table(conn)
+        norms.ensure_sketch_table(conn)
+        total = conn.execute('''
+            SELECT COUNT(*) FROM test_sessions WHERE status != 'active' AND start_time < ?
+        ''', (cutoff,)).fetchone()[0]
+        ctx.progress(done=0, total=total, message='セッションを削除中')
+        ctx.chunk_size = sessions_per_chunk
+
+        def delete(conn, keys):
+            placeholders = ','.join('?' * len(keys))
+            conn.execute(f'DELETE FROM responses WHERE session_id IN ({placeholders})', keys)
+            norms.subtract(conn, conn.execute(f'''
+                SELECT final_theta, start_time FROM test_sessions
+                WHERE session_id IN ({placeholders}) AND status = 'completed' AND final_theta IS NOT NULL
+            ''', keys).fetchall())
+            conn.execute(f'DELETE FROM provisioned_sessions WHERE session_id IN ({placeholders})', keys)
+            conn.execute(f'DELETE FROM session_results WHERE session_id IN ({placeholders})', keys)
+            conn.execute(f'DELETE FROM test_sessions WHERE session_id IN ({placeholders})', keys)
+
+        for _ in _chunks(ctx, conn, '''
+            SELECT session_id FROM test_sessions WHERE status != 'active' AND start_time < ? LIMIT ?
+        ''', (cutoff,), delete):
+            # 削除をコミットした後に、各プロセスの結果のキャッシュを破棄させる
+            results_store.mark_deleted(ctx.manager.db_path)
+            yield
+        deleted = ctx.done
+        yield from _finish(ctx, conn, vacuum)
+        return {'deleted': deleted, 'days': int(days)}
+    finally:
+        conn.close()
+
+
+def factory_reset(ctx):
+    """システム設定を初期値に戻す（受験データ・統計は変更しない）"""
+    conn = ctx.connect()
+    try:
+        ctx.progress(done=0, total=len(DEFAULT_SETTINGS), message='設定を初期化中')
+        with conn:
+            conn.execute('DELETE FROM system_settings')
+            conn.executemany('''
+                INSERT INTO system_settings (setting_key, setting_value, description, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', DEFAULT_SETTINGS)
+        ctx.progress(done=len(DEFAULT_SETTINGS))
+        yield
+        return {'settings': len(DEFAULT_SETTINGS)}
+    finally:
+        conn.close()
+
+
+JOBS = {
+    'reset_statistics': reset_statistics,
+    'clear_sessions': clear_sessions,
+    'factory_reset': factory_reset
+}
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# norms.py - 語彙サイズの集団基準（パーセンタイル順位・分布）
+
+"""
+完了したセッションの final_theta を EAP の評価点（seq(-4, 4, by = 0.01)）と
+同じ 801 区間のヒストグラムに逐次加算し、パーセンタイル順位と分布を
+test_sessions を走査せずに求める。
+
+- 語彙サイズ V(θ) は θ について単調増加なので、θ の分布から語彙サイズの
+  分位点・分布もそのまま求まる（vocabulary.VOCABULARY_TABLE を通すだけ）。
+- ヒストグラムは加算で合併できるため、月別（'YYYY-MM'）と全期間（'all'）を持ち、
+  期間を指定した分布は月別のものを足し合わせて作る。
+- 分解能は評価点の間隔（0.01）で固定され、件数によらずメモリは一定。
+  パーセンタイル順位の誤差は1区間分の件数以内。
+- 完了時の加算はプロセス内の差分に貯め、flush_interval ごとに norm_sketches
+  テーブルへ加算する（複数ワーカーの差分は BEGIN IMMEDIATE で順に合算）。
+  テーブルが空なら、運用中とアーカイブ済みの完了セッションから作り直す。
+- セッションを削除するときは、同じトランザクションで subtract を呼んで
+  その θ を引く（jobs.clear_sessions）。各ワーカーには次の flush で反映される。
+
+使い方:
+    python norms.py --rebuild     # 完了セッションから作り直す
+    python norms.py               # 分位点を表示
+"""
+
+import argparse
+import atexit
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+
+import archive
+from estimators import GRID
+from vocabulary import VOCABULARY_TABLE, vocabulary_size
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'jacet_cat.db'
+WINDOW_ALL = 'all'
+DEFAULT_FLUSH_INTERVAL = 60
+# これより少ない件数ではパーセンタイル順位を表示しない
+MIN_NORM_SIZE = 30
+QUANTILES = (0.05, 0.10, 0.25, 0.50, 0.75, 0.90, 0.95)
+VOCABULARY_BANDS = [(lower, lower + 999) for lower in range(0, 7000, 1000)] + [(7000, None)]
+
+SKETCH_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS norm_sketches (
+        period TEXT PRIMARY KEY,
+        counts BLOB,
+        total INTEGER DEFAULT 0,
+        updated_at TIMESTAMP
+    )
+'''
+
+
+def ensure_sketch_table(conn):
+    """norm_sketches がなければ作成"""
+    conn.execute(SKETCH_TABLE_SQL)
+
+
+def bin_index(theta):
+    """θ（配列可）→ ヒストグラムの区間番号（評価点の範囲外は端の区間）"""
+    index = np.rint((np.asarray(theta, dtype=float) - GRID[0]) / (GRID[1] - GRID[0]))
+    return np.clip(index, 0, len(GRID) - 1).astype(int)
+
+
+def histogram(thetas):
+    """θ の列からヒストグラム（長さ len(GRID) の int64 配列）"""
+    thetas = np.asarray(thetas, dtype=float)
+    thetas = thetas[np.isfinite(thetas)]
+    return np.bincount(bin_index(thetas), minlength=len(GRID)).astype(np.int64)
+
+
+def month_of(when):
+    """日時（datetime または ISO 文字列）→ 月の区分 'YYYY-MM'"""
+    if isinstance(when, datetime):
+        return when.strftime('%Y-%m')
+    return str(when)[:7]
+
+
+def read_counts(conn, window=WINDOW_ALL):
+    """
+    データベース（またはスナップショット）に書き込まれたヒストグラム
+
+    Returns:
+        ndarray: 長さ len(GRID) の件数（なければすべて 0）
+    """
+    try:
+        row = conn.execute('SELECT counts FROM norm_sketches WHERE period = ?', (window,)).fetchone()
+    except sqlite3.OperationalError:
+        row = None  # テーブルがまだない
+    if row is None:
+        return np.zeros(len(GRID), dtype=np.int64)
+    return np.frombuffer(row[0], dtype=np.int64).copy()
+
+
+def subtract(conn, rows):
+    """
+    削除するセッションの θ をヒストグラムから引く（呼び出し側のトランザクション内）
+
+    Args:
+        rows (list): 完了セッションの (final_theta, start_time) のリスト
+    """
+    ensure_sketch_table(conn)
+    by_window = {WINDOW_ALL: []}
+    for theta, start_time in rows:
+        by_window[WINDOW_ALL].append(theta)
+        by_window.setdefault(month_of(start_time), []).append(theta)
+
+    now = datetime.now()
+    for window, thetas in by_window.items():
+        row = conn.execute('SELECT counts FROM norm_sketches WHERE period = ?', (window,)).fetchone()
+        if row is None or not thetas:
+            continue
+        counts = np.maximum(np.frombuffer(row[0], dtype=np.int64) - histogram(thetas), 0)
+        conn.execute('UPDATE norm_sketches SET counts = ?, total = ?, updated_at = ? WHERE period = ?',
+                     (counts.tobytes(), int(counts.sum()), now, window))
+
+
+class NormSketch:
+    """完了セッションの θ のヒストグラム（月別・全期間）"""
+
+    def __init__(self, db_path=DB_PATH, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        Args:
+            db_path (str): データベースファイル
+            flush_interval (float): 差分をデータベースへ書き込む間隔（秒）
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._base = {}
+        self._delta = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_flush = None
+
+    def _connect(self):
+        # BEGIN IMMEDIATE を明示するため自動トランザクションは使わない
+        return sqlite3.connect(self.db_path, timeout=10.0, isolation_level=None)
+
+    def load(self):
+        """
+        データベースからヒストグラムを読み込む（空なら完了セッションから作成）
+        """
+        conn = self._connect()
+        try:
+            ensure_sketch_table(conn)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT COUNT(*) FROM norm_sketches').fetchone()[0] == 0:
+                    self._write_rebuild(conn)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            base = self._read(conn)
+        finally:
+            conn.close()
+        with self._lock:
+            self._base = base
+
+    def _read(self, conn):
+        return {
+            window: np.frombuffer(counts, dtype=np.int64).copy()
+            for window, counts in conn.execute('SELECT period, counts FROM norm_sketches')
+        }
+
+    def _write_rebuild(self, conn):
+        """運用中とアーカイブ済みの完了セッションからヒストグラムを作り直す（トランザクション内）"""
+        frames = [conn.execute('''
+            SELECT final_theta, start_time FROM test_sessions
+            WHERE status = 'completed' AND final_theta IS NOT NULL
+        ''').fetchall()]
+        for month, path in archive.list_archives():
+            arch = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            try:
+                frames.append(arch.execute('''
+                    SELECT final_theta, start_time FROM test_sessions
+                    WHERE status = 'completed' AND final_theta IS NOT NULL
+                ''').fetchall())
+            finally:
+                arch.close()
+
+        by_window = {WINDOW_ALL: []}
+        for rows in frames:
+            for theta, start_time in rows:
+                by_window[WINDOW_ALL].append(theta)
+                by_window.setdefault(month_of(start_time), []).append(theta)
+
+        now = datetime.now()
+        conn.execute('DELETE FROM norm_sketches')
+        conn.executemany('''
+            INSERT INTO norm_sketches (period, counts, total, updated_at) VALUES (?, ?, ?, ?)
+        ''', [(window, histogram(thetas).tobytes(), len(thetas), now) for window, thetas in by_window.items()])
+
+    def rebuild(self):
+        """完了セッションからヒストグラムを作り直す（未書き込みの差分は破棄）"""
+        conn = self._connect()
+        try:
+            ensure_sketch_table(conn)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._write_rebuild(conn)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            base = self._read(conn)
+        finally:
+            conn.close()
+        with self._lock:
+            self._base = base
+            self._delta = {}
+
+    def add(self, theta, started_at=None):
+        """
+        完了したセッションの θ を加算（O(1)、データベースへは flush で反映）
+
+        Args:
+            theta (float): final_theta
+            started_at (datetime or str): セッション開始日時（月別の区分に使用）
+        """
+        if theta is None or not np.isfinite(theta):
+            return
+        index = int(bin_index(theta))
+        with self._lock:
+            for window in (WINDOW_ALL, month_of(started_at or datetime.now())):
+                delta = self._delta.setdefault(window, np.zeros(len(GRID), dtype=np.int64))
+                delta[index] += 1
+
+    def flush(self):
+        """差分をデータベースに加算し、他のワーカーの分も含めて読み直す"""
+        with self._lock:
+            delta, self._delta = self._delta, {}
+
+        conn = self._connect()
+        try:
+            ensure_sketch_table(conn)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = datetime.now()
+                for window, counts in delta.items():
+                    row = conn.execute('SELECT counts FROM norm_sketches WHERE period = ?', (window,)).fetchone()
+                    if row is not None:
+                        counts = counts + np.frombuffer(row[0], dtype=np.int64)
+                    conn.execute('''
+                        INSERT OR REPLACE INTO norm_sketches (period, counts, total, updated_at)
+                        VALUES (?, ?, ?, ?)
+                    ''', (window, counts.tobytes(), int(counts.sum()), now))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                # 書き込めなかった差分は次回に持ち越す
+                with self._lock:
+                    for window, counts in delta.items():
+                        self._delta[window] = self._delta.get(window, 0) + counts
+                raise
+            base = self._read(conn)
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._base = base
+        self.last_flush = datetime.now()
+
+    def counts(self, since=None, until=None):
+        """
+        期間のヒストグラム
+
+        Args:
+            since, until (str): 'YYYY-MM'（両端を含む、どちらも None なら全期間）
+
+        Returns:
+            ndarray: 長さ len(GRID) の件数
+        """
+        with self._lock:
+            if since is None and until is None:
+                windows = [WINDOW_ALL]
+            else:
+                windows = [w for w in set(self._base) | set(self._delta)
+                           if w != WINDOW_ALL and (since is None or w >= since) and (until is None or w <= until)]
+            total = np.zeros(len(GRID), dtype=np.int64)
+            for window in windows:
+                if window in self._base:
+                    total += self._base[window]
+                if window in self._delta:
+                    total += self._delta[window]
+        return total
+
+    def percentile_rank(self, theta, counts=None):
+        """
+        θ のパーセンタイル順位（θ より低い人の割合、同じ区間は半数とみなす）
+
+        Returns:
+            float: 0〜100（件数が MIN_NORM_SIZE 未満なら None）
+        """
+        counts = self.counts() if counts is None else counts
+        total = counts.sum()
+        if total < MIN_NORM_SIZE or theta is None:
+            return None
+        index = int(bin_index(theta))
+        below = counts[:index].sum() + counts[index] / 2
+        return round(float(100 * below / total), 1)
+
+    def quantiles(self, probs=QUANTILES, counts=None):
+        """
+        θ と語彙サイズの分位点
+
+        Returns:
+            list: {'p', 'theta', 'vocabulary_size'} のリスト（件数 0 なら空）
+        """
+        counts = self.counts() if counts is None else counts
+        total = counts.sum()
+        if total == 0:
+            return []
+        cdf = np.cumsum(counts) / total
+        result = []
+        for p in probs:
+            theta = float(GRID[min(int(np.searchsorted(cdf, p)), len(GRID) - 1)])
+            result.append({'p': p, 'theta': theta, 'vocabulary_size': vocabulary_size(theta)})
+        return result
+
+    def distribution(self, counts=None):
+        """
+        語彙サイズの分布（件数のある区間のみ）
+
+        Returns:
+            list: {'vocabulary_size', 'count'} のリスト（語彙サイズ順）
+        """
+        counts = self.counts() if counts is None else counts
+        sizes = np.rint(VOCABULARY_TABLE).astype(int)
+        merged = {}
+        for index in np.flatnonzero(counts):
+            size = int(sizes[index])
+            merged[size] = merged.get(size, 0) + int(counts[index])
+        return [{'vocabulary_size': size, 'count': count} for size, count in sorted(merged.items())]
+
+    def vocabulary_bands(self, counts=None):
+        """
+        1000語ごとの区間の人数（管理画面用）
+
+        Returns:
+            list: ('0-999', 件数) のようなタプルのリスト
+        """
+        counts = self.counts() if counts is None else counts
+        sizes = VOCABULARY_TABLE
+        bands = []
+        for lower, upper in VOCABULARY_BANDS:
+            mask = sizes >= lower - 0.5
+            if upper is not None:
+                mask &= sizes < upper + 0.5
+            label = f'{lower}-{upper}' if upper is not None else f'{lower}+'
+            bands.append((label, int(counts[mask].sum())))
+        return bands
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Norm sketch flush error: {e}")
+
+    def start(self):
+        """定期書き込みのスレッドを開始（終了時にも書き込む）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='norm-sketch', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        """管理画面・API 用の状態"""
+        with self._lock:
+            pending = int(sum(delta.sum() for window, delta in self._delta.items() if window == WINDOW_ALL))
+        return {
+            'total': int(self.counts().sum()),
+            'pending': pending,
+            'windows': sorted(w for w in self._base if w != WINDOW_ALL),
+            'flush_interval': self.flush_interval,
+            'last_flush': self.last_flush.isoformat() if self.last_flush else None
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='JACET CAT 語彙サイズの集団基準')
+    parser.add_argument('--db', default=DB_PATH, help='データベースファイル')
+    parser.add_argument('--rebuild', action='store_true', help='完了セッションから作り直す')
+    parser.add_argument('--since', help='集計開始月（YYYY-MM）')
+    parser.add_argument('--until', help='集計終了月（YYYY-MM）')
+    args = parser.parse_args()
+
+    sketch = NormSketch(args.db)
+    if args.rebuild:
+        sketch.rebuild()
+        print("✓ 完了セッションから集団基準を作り直しました")
+    else:
+        sketch.load()
+
+    counts = sketch.counts(args.since, args.until)
+    print(f"受験者数: {int(counts.sum())}")
+    for q in sketch.quantiles(counts=counts):
+        print(f"  {int(q['p'] * 100):>2}%: θ = {q['theta']:+.2f}  語彙サイズ {q['vocabulary_size']}")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# provisioning.py - クラス単位のテストセッション一括作成
+
+"""
+教員がクラス全員分（数十〜数百人）のセッションを事前に一括作成し、受験者には
+アクセスコードを配布する。各セッションの最初の項目と CAT 初期状態は作成時に
+決めておくため、授業開始時に全員が同時に開始しても、開始処理は
+アクセスコードの照合と1行の更新だけで済み、スコアリング（Rscript）は起動しない。
+
+- 作成は1トランザクションで test_sessions（status = 'provisioned'）と
+  provisioned_sessions（アクセスコード・初期状態）に書き込む。
+- 最初の項目は Level 3-5 から、これまでの露出数（item_statistics.exposure_count）と
+  同じクラス内での割り当て数の合計が最小のものを選ぶ（同数ならランダム）。
+  同じクラスの受験者に同じ最初の項目が偏らない。
+- アクセスコードは1回だけ使える。claim() は未使用の行を条件付きで更新するため、
+  同じコードで同時に開始しても1人だけが成功する。
+"""
+
+import heapq
+import json
+import random
+import secrets
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+import cat_engine
+import results_store
+
+MAX_BATCH_SIZE = 500
+CODE_LENGTH = 8
+# 読み間違えやすい文字（0/O, 1/I/L）を除く
+CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+
+PROVISIONED_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS provisioned_sessions (
+        access_code TEXT PRIMARY KEY,
+        session_id TEXT UNIQUE,
+        batch_id TEXT,
+        label TEXT,
+        user_id TEXT,
+        cat_state TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        claimed_at TIMESTAMP
+    )
+'''
+PROVISIONED_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_provisioned_batch ON provisioned_sessions(batch_id)'
+
+
+def ensure_provisioning_table(conn):
+    """provisioned_sessions がなければ作成"""
+    conn.execute(PROVISIONED_TABLE_SQL)
+    conn.execute(PROVISIONED_INDEX_SQL)
+
+
+def new_access_code():
+    """アクセスコード（CODE_LENGTH 文字）"""
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+
+
+def normalize_code(code):
+    """入力されたアクセスコードを照合用に正規化（空白・ハイフン除去、大文字化）"""
+    return ''.join(ch for ch in (code or '').upper() if ch.isalnum())
+
+
+def balanced_first_items(bank, n, exposure=None, rng=random):
+    """
+    n 人分の最初の項目を露出数が均等になるよう選ぶ
+
+    Args:
+        bank (ItemBank): 項目バンク
+        n (int): 受験者数
+        exposure (dict): 項目番号 → これまでの露出数（None なら全て 0）
+        rng (random.Random): 同数の場合の順序付けに使う乱数
+
+    Returns:
+        list: 項目番号のリスト（長さ n）
+    """
+    exposure = exposure or {}
+    candidates = [int(pos) + 1 for pos in np.flatnonzero(np.isin(bank.levels, cat_engine.INITIAL_LEVELS))]
+    heap = [(exposure.get(item_id, 0), rng.random(), item_id) for item_id in candidates]
+    heapq.heapify(heap)
+
+    items = []
+    for _ in range(n):
+        count, _, item_id = heapq.heappop(heap)
+        items.append(item_id)
+        heapq.heappush(heap, (count + 1, rng.random(), item_id))
+    return items
+
+
+def provision_sessions(conn, bank, n, label='', user_prefix=None, rng=random):
+    """
+    n 人分のセッションを1トランザクションで作成
+
+    Args:
+        conn (sqlite3.Connection): 運用中のデータベースへの接続
+        bank (ItemBank): セッションに固定する項目バンク
+        n (int): 作成数（1〜MAX_BATCH_SIZE）
+        label (str): クラス名など（一覧・CSV 表示用）
+        user_prefix (str): 受験者IDの接頭辞（'<prefix>-001' の形式、None なら label）
+
+    Returns:
+        dict: batch_id と sessions（access_code, session_id, user_id のリスト）
+    """
+    if not 1 <= n <= MAX_BATCH_SIZE:
+        raise ValueError(f'作成数は 1〜{MAX_BATCH_SIZE} で指定してください（{n} 件指定）')
+
+    batch_id = datetime.now().strftime('%Y%m%d%H%M%S-') + uuid.uuid4().hex[:6]
+    prefix = user_prefix or label or 'class'
+    now = datetime.now()
+
+    with conn:
+        ensure_provisioning_table(conn)
+        exposure = dict(conn.execute('SELECT item_id, exposure_count FROM item_statistics').fetchall())
+        first_items = balanced_first_items(bank, n, exposure, rng)
+
+        used = {row[0] for row in conn.execute('SELECT access_code FROM provisioned_sessions')}
+        sessions, session_rows, provision_rows = [], [], []
+        for number, item_id in enumerate(first_items, start=1):
+            code = new_access_code()
+            while code in used:
+                code = new_access_code()
+            used.add(code)
+
+            session_id = str(uuid.uuid4())
+            user_id = f'{prefix}-{number:03d}'
+            state = cat_engine.initial_state(bank, item_id)
+            state['bank_version'] = bank.version
+
+            sessions.append({'access_code': code, 'session_id': session_id, 'user_id': user_id})
+            session_rows.append((session_id, user_id, now))
+            provision_rows.append((code, session_id, batch_id, label, user_id, json.dumps(state), now))
+
+        conn.executemany('''
+            INSERT INTO test_sessions (session_id, user_id, start_time, status)
+            VALUES (?, ?, ?, 'provisioned')
+        ''', session_rows)
+        conn.executemany('''
+            INSERT INTO provisioned_sessions
+            (access_code, session_id, batch_id, label, user_id, cat_state, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', provision_rows)
+
+    return {'batch_id': batch_id, 'label': label, 'sessions': sessions}
+
+
+def claim(conn, access_code, user_id=None, ip_address=None, user_agent=None):
+    """
+    アクセスコードでセッションを開始する（1回のみ）
+
+    Args:
+        conn (sqlite3.Connection): 運用中のデータベースへの接続
+        access_code (str): 配布されたアクセスコード
+        user_id (str): 受験者が入力したID（None なら作成時のID）
+
+    Returns:
+        tuple: (session_id, user_id, CAT 初期状態)。無効・使用済みなら None
+    """
+    code = normalize_code(access_code)
+    now = datetime.now()
+
+    with conn:
+        claimed = conn.execute('''
+            UPDATE provisioned_sessions SET claimed_at = ?
+            WHERE access_code = ? AND claimed_at IS NULL
+        ''', (now, code)).rowcount
+        if claimed != 1:
+            return None
+
+        row = conn.execute('''
+            SELECT session_id, user_id, cat_state FROM provisioned_sessions WHERE access_code = ?
+        ''', (code,)).fetchone()
+        session_id, provisioned_user, state = row[0], row[1], row[2]
+        user_id = user_id or provisioned_user
+
+        conn.execute('''
+            UPDATE test_sessions
+            SET status = 'active', start_time = ?, user_id = ?, ip_address = ?, user_agent = ?
+            WHERE session_id = ? AND status = 'provisioned'
+        ''', (now, user_id, ip_address, user_agent, session_id))
+
+    return session_id, user_id, json.loads(state)
+
+
+def list_batches(conn, limit=20):
+    """
+    最近作成したバッチの一覧
+
+    Returns:
+        list: batch_id, label, created_at, total, claimed を持つ dict のリスト
+    """
+    ensure_provisioning_table(conn)
+    rows = conn.execute('''
+        SELECT batch_id, label, MIN(created_at), COUNT(*), COUNT(claimed_at)
+        FROM provisioned_sessions
+        GROUP BY batch_id
+        ORDER BY MIN(created_at) DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+    return [
+        {'batch_id': r[0], 'label': r[1], 'created_at': r[2], 'total': r[3], 'claimed': r[4]}
+        for r in rows
+    ]
+
+
+def batch_sessions(conn, batch_id):
+    """
+    バッチのセッション一覧（配布用・クラス別の結果一覧）
+
+    結果は完了時に保存した session_results の行を読む（回答履歴は集計しない）。
+
+    Returns:
+        list: access_code, user_id, session_id, claimed_at, status, completed_at,
+              vocabulary_size, vocabulary_lower, vocabulary_upper, items_administered を持つ dict のリスト
+    """
+    ensure_provisioning_table(conn)
+    results_store.ensure_results_table(conn)
+    rows = conn.execute('''
+        SELECT p.access_code, p.user_id, p.session_id, p.claimed_at, s.status,
+               r.completed_at, r.vocabulary_size, r.vocabulary_lower, r.vocabulary_upper,
+               r.items_administered
+        FROM provisioned_sessions p
+        LEFT JOIN test_sessions s ON s.session_id = p.session_id
+        LEFT JOIN session_results r ON r.session_id = p.session_id
+        WHERE p.batch_id = ?
+        ORDER BY p.user_id
+    ''', (batch_id,)).fetchall()
+    columns = ('access_code', 'user_id', 'session_id', 'claimed_at', 'status', 'completed_at',
+               'vocabulary_size', 'vocabulary_lower', 'vocabulary_upper', 'items_administered')
+    return [dict(zip(columns, r)) for r in rows]
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# reaper.py - 放棄されたテストセッションの回収
+
+"""
+開始から一定時間（PERMANENT_SESSION_LIFETIME）が過ぎ、その間に回答のない
+'active' セッションを 'abandoned' に更新し、サーバー側の状態（項目バンクの
+版の保持など）を解放する。
+
+更新は batch_size 件ずつの短いトランザクションで行い、受験中のセッションの
+書き込みを長時間ブロックしない。候補の検索は部分インデックス
+idx_sessions_active（status = 'active' の行だけを start_time 順に持つ）を使うため、
+回収済み・完了済みのセッションがいくら増えても走査量は受験中の件数に比例する。
+"""
+
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 300
+DEFAULT_BATCH_SIZE = 500
+
+STALE_SESSIONS_SQL = '''
+    SELECT s.session_id
+    FROM test_sessions s
+    WHERE s.status = 'active'
+      AND s.start_time < ?
+      AND COALESCE((SELECT MAX(r.timestamp) FROM responses r
+                    WHERE r.session_id = s.session_id), s.start_time) < ?
+    LIMIT ?
+'''
+
+# 受験中のセッション数（/api/system_status、部分インデックスの件数だけを数える）
+ACTIVE_SESSIONS_SQL = "SELECT COUNT(*) FROM test_sessions WHERE status = 'active'"
+
+
+class SessionReaper:
+    """放棄セッションを定期的に回収するバックグラウンドスレッド"""
+
+    def __init__(self, db_path, max_age, on_expire=None, local_sessions=None,
+                 interval=DEFAULT_INTERVAL, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Args:
+            db_path (str): データベースファイル
+            max_age (float): 最後の操作からこの秒数を過ぎたセッションを回収する
+            on_expire (callable): 回収したセッションIDのリストを受け取る（状態の解放）
+            local_sessions (callable): このプロセスが状態を保持しているセッションIDを返す。
+                他のワーカーが回収したセッションの状態もここで解放する
+            interval (float): 実行間隔（秒）
+            batch_size (int): 1トランザクションで更新する件数
+        """
+        self.db_path = db_path
+        self.max_age = timedelta(seconds=max_age)
+        self.on_expire = on_expire
+        self.local_sessions = local_sessions
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.last_run = None
+        self.last_reaped = 0
+        self.total_reaped = 0
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10.0)
+
+    def _expire(self, session_ids):
+        if self.on_expire and session_ids:
+            try:
+                self.on_expire(session_ids)
+            except Exception as e:
+                logger.error(f"Session state eviction error: {e}")
+
+    def reap_once(self, now=None):
+        """
+        期限切れセッションを 'abandoned' に更新する
+
+        Returns:
+            int: 更新したセッション数
+        """
+        now = now or datetime.now()
+        cutoff = now - self.max_age
+        reaped = 0
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                while True:
+                    rows = conn.execute(STALE_SESSIONS_SQL, (cutoff, cutoff, self.batch_size)).fetchall()
+                    session_ids = [row[0] for row in rows]
+                    if not session_ids:
+                        break
+
+                    placeholders = ','.join('?' * len(session_ids))
+                    with conn:
+                        conn.execute(f'''
+                            UPDATE test_sessions SET status = 'abandoned', end_time = ?
+                            WHERE status = 'active' AND session_id IN ({placeholders})
+                        ''', (now, *session_ids))
+                    reaped += len(session_ids)
+                    self._expire(session_ids)
+
+                    if len(session_ids) < self.batch_size:
+                        break
+
+                self._expire(self._finished_local_sessions(conn))
+            finally:
+                conn.close()
+
+            self.last_run = now
+            self.last_reaped = reaped
+            self.total_reaped += reaped
+
+        if reaped:
+            logger.info(f"Session reaper: {reaped} sessions marked abandoned")
+        return reaped
+
+    def _finished_local_sessions(self, conn):
+        """このプロセスが保持している状態のうち、既に active でないセッション"""
+        if self.local_sessions is None:
+            return []
+        session_ids = list(self.local_sessions())
+        finished = []
+        for start in range(0, len(session_ids), self.batch_size):
+            chunk = session_ids[start:start + self.batch_size]
+            placeholders = ','.join('?' * len(chunk))
+            active = {row[0] for row in conn.execute(f'''
+                SELECT session_id FROM test_sessions
+                WHERE status = 'active' AND session_id IN ({placeholders})
+            ''', chunk)}
+            finished.extend(sid for sid in chunk if sid not in active)
+        return finished
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reap_once()
+            except Exception as e:
+                logger.error(f"Session reaper error: {e}")
+
+    def start(self):
+        """バックグラウンドスレッドを開始（二重起動しない）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='session-reaper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        """管理画面・API 用の状態"""
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'interval': self.interval,
+            'max_age_seconds': int(self.max_age.total_seconds()),
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_reaped': self.last_reaped,
+            'total_reaped': self.total_reaped
+        }
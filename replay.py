@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+# replay.py - 過去のセッションの再採点（結果の一致と処理速度の確認）
+
+"""
+responses に保存された回答をセッション順に読み、選んだ方式で採点し直して、
+保存されている値と比べる。スコアリング方式・推定法・設定を変える前に、
+結果が変わらないこと（または変わる範囲）と処理速度を運用データで確認する。
+
+比較する値（回答ごと）:
+    theta      : theta_after
+    se         : se_after
+    next_item  : 次に出題された項目（最初の項目は無作為なので比較しない）
+    stop       : 終了判定（採点し直すと途中で終わる、または完了時に続く）
+    vocabulary_size : 完了したセッションの語彙サイズ（test_sessions）
+
+方式:
+    python : cat_engine.process_answer を回答ごとに呼ぶ（運用の Python スコアリングと
+             同じ処理）。--workers でセッションを複数プロセスに分ける。
+    batch  : batch_size セッションを同時に1問ずつ進めるベクトル化版（同じ規則、
+             次項目は全項目の情報量を直接比較）。
+
+採点し直すのは保存されている出題順のとおりで、次項目が食い違っても以降は
+保存された項目で続ける。R スクリプトの結果（jsonlite は既定で有効数字 4 桁）と
+比べるため、theta / se の許容差の既定値は 1e-4。
+
+項目バンクは --csv のスナップショット（運用と同じ log P / log Q 表）を使う。
+以前の版で採点したセッションは --bank-version で item_banks/ の版を指定する。
+
+使い方:
+    python replay.py --backend batch --since 2026-04-01
+    python replay.py --backend python --workers 8 --estimator eap_gh --json
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+import cat_engine
+import estimators
+import item_bank
+import vocabulary
+
+DB_PATH = 'jacet_cat.db'
+BACKENDS = ('python', 'batch')
+DEFAULT_TOLERANCE = 1e-4
+DEFAULT_BATCH_SIZE = 2000
+CHUNK_SIZE = 200
+FETCH_SIZE = 50000
+MAX_EXAMPLES = 20
+KINDS = ('theta', 'se', 'next_item', 'stop', 'vocabulary_size')
+
+
+def stream_sessions(conn, since=None, until=None, completed_only=False, limit=None):
+    """
+    保存されたセッションをセッション順に1件ずつ読む（回答は出題順）
+
+    responses は (session_id, timestamp) のインデックス順に1回だけ走査し、
+    test_sessions とは session_id の順で突き合わせる。回答のないセッションは飛ばす。
+
+    Yields:
+        dict: session_id, status, vocabulary_size, items（項目番号）, responses,
+              theta（theta_after）, se（se_after）
+    """
+    conditions, params = [], []
+    if since:
+        conditions.append('start_time >= ?')
+        params.append(since)
+    if until:
+        conditions.append('start_time < ?')
+        params.append(until)
+    if completed_only:
+        conditions.append("status = 'completed'")
+    selection = ((f" WHERE {' AND '.join(conditions)}" if conditions else '')
+                 + ' ORDER BY session_id' + (' LIMIT ?' if limit else ''))
+    if limit:
+        params.append(int(limit))
+
+    # 両方のカーソルを同じ時点で読む（WAL では書き込みを止めない）
+    conn.execute('BEGIN')
+    try:
+        sessions = conn.execute(f'SELECT session_id, status, vocabulary_size FROM test_sessions{selection}',
+                                params)
+        responses = conn.execute(f'''
+            SELECT session_id, item_id, response, theta_after, se_after
+            FROM responses
+            WHERE session_id IN (SELECT session_id FROM test_sessions{selection})
+            ORDER BY session_id, timestamp
+        ''', params)
+        rows = itertools.chain.from_iterable(iter(lambda: responses.fetchmany(FETCH_SIZE), []))
+
+        session = sessions.fetchone()
+        for session_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+            while session is not None and session[0] < session_id:
+                session = sessions.fetchone()
+            if session is None or session[0] != session_id:
+                continue
+            group = list(group)
+            yield {
+                'session_id': session_id,
+                'status': session[1],
+                'vocabulary_size': session[2],
+                'items': [row[1] for row in group],
+                'responses': [row[2] for row in group],
+                'theta': [row[3] for row in group],
+                'se': [row[4] for row in group]
+            }
+    finally:
+        conn.rollback()
+
+
+class Report:
+    """再採点の集計（プロセスごとに作って merge でまとめる）"""
+
+    def __init__(self, max_examples=MAX_EXAMPLES):
+        self.sessions = 0
+        self.answers = 0
+        self.discrepancies = dict.fromkeys(KINDS, 0)
+        self.sessions_with_discrepancies = 0
+        self.max_theta_diff = 0.0
+        self.max_se_diff = 0.0
+        self.examples = []
+        self.max_examples = max_examples
+        self.seconds = 0.0
+
+    def add(self, session_id, step, kind, stored, replayed):
+        """食い違いを1件記録"""
+        self.discrepancies[kind] += 1
+        if len(self.examples) < self.max_examples:
+            self.examples.append({'session_id': session_id, 'step': step, 'kind': kind,
+                                  'stored': stored, 'replayed': replayed})
+
+    def merge(self, other):
+        self.sessions += other.sessions
+        self.answers += other.answers
+        for kind in KINDS:
+            self.discrepancies[kind] += other.discrepancies[kind]
+        self.sessions_with_discrepancies += other.sessions_with_discrepancies
+        self.max_theta_diff = max(self.max_theta_diff, other.max_theta_diff)
+        self.max_se_diff = max(self.max_se_diff, other.max_se_diff)
+        self.examples += other.examples[:self.max_examples - len(self.examples)]
+        return self
+
+    def as_dict(self):
+        return {
+            'sessions': self.sessions,
+            'answers': self.answers,
+            'discrepancies': self.discrepancies,
+            'sessions_with_discrepancies': self.sessions_with_discrepancies,
+            'max_theta_diff': self.max_theta_diff,
+            'max_se_diff': self.max_se_diff,
+            'seconds': round(self.seconds, 3),
+            'sessions_per_second': round(self.sessions / self.seconds, 1) if self.seconds else None,
+            'answers_per_second': round(self.answers / self.seconds, 1) if self.seconds else None,
+            'examples': self.examples
+        }
+
+
+def _diff(stored, replayed):
+    """保存値との差（保存値がなければ 0、片方だけ無限大・NaN なら無限大）"""
+    if stored is None:
+        return 0.0
+    if not np.isfinite(stored) or not np.isfinite(replayed):
+        return 0.0 if stored == replayed else float('inf')
+    return abs(stored - replayed)
+
+
+# ============================================================================
+# python: cat_engine を回答ごとに呼ぶ
+# ============================================================================
+
+def replay_session(bank, session, report, estimator=cat_engine.DEFAULT_ESTIMATOR,
+                   tolerance=DEFAULT_TOLERANCE):
+    """1セッションを cat_engine.process_answer で採点し直して report に加える"""
+    items, answers = session['items'], session['responses']
+    session_id, completed = session['session_id'], session['status'] == 'completed'
+    before = sum(report.discrepancies.values())
+
+    previous = None
+    for k, (item_id, answer) in enumerate(zip(items, answers)):
+        result = cat_engine.process_answer(bank, items[:k], answers[:k], item_id, answer, estimator,
+                                           previous)
+        previous = cat_engine.previous_estimate(result)
+        for kind, stored, replayed in (('theta', session['theta'][k], result['current_theta']),
+                                       ('se', session['se'][k], result['current_se'])):
+            diff = _diff(stored, replayed)
+            if kind == 'theta':
+                report.max_theta_diff = max(report.max_theta_diff, diff)
+            else:
+                report.max_se_diff = max(report.max_se_diff, diff)
+            if diff > tolerance:
+                report.add(session_id, k + 1, kind, stored, replayed)
+
+        last = k + 1 == len(items)
+        if not last:
+            if not result['should_continue']:
+                report.add(session_id, k + 1, 'stop', 'continue', 'stop')
+            elif result['next_item']['id'] != items[k + 1]:
+                report.add(session_id, k + 1, 'next_item', items[k + 1], result['next_item']['id'])
+        elif completed:
+            if result['should_continue']:
+                report.add(session_id, k + 1, 'stop', 'stop', 'continue')
+            else:
+                replayed = int(result['final_result']['vocabulary_size'])
+                if session['vocabulary_size'] is not None and replayed != session['vocabulary_size']:
+                    report.add(session_id, k + 1, 'vocabulary_size', session['vocabulary_size'], replayed)
+
+    report.sessions += 1
+    report.answers += len(items)
+    report.sessions_with_discrepancies += sum(report.discrepancies.values()) > before
+
+
+_worker_bank = None
+
+
+def _init_worker(csv_path, bank_version):
+    global _worker_bank
+    _worker_bank = load_bank(csv_path, bank_version)
+
+
+def _replay_chunk(args):
+    sessions, estimator, tolerance, max_examples = args
+    report = Report(max_examples)
+    for session in sessions:
+        replay_session(_worker_bank, session, report, estimator, tolerance)
+    return report
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ============================================================================
+# batch: 多数のセッションを同時に1問ずつ進める
+# ============================================================================
+
+def replay_batch(bank, sessions, report, estimator=cat_engine.DEFAULT_ESTIMATOR,
+                 tolerance=DEFAULT_TOLERANCE):
+    """
+    セッションのリストをまとめて採点し直して report に加える
+
+    eap_grid は評価点上の対数事後分布を1問ずつ加算する（cat_engine.posterior と
+    同じ log P / log Q 表）。他の推定法は出題済みの全項目を estimators に一括で渡し、
+    運用と同じく1問前の推定値から始める。
+    """
+    n = len(sessions)
+    if n == 0:
+        return
+    lengths = np.array([len(s['items']) for s in sessions])
+    width = lengths.max()
+    pos = np.full((n, width), -1, dtype=np.int64)
+    answers = np.zeros((n, width), dtype=np.int64)
+    stored_theta = np.full((n, width), np.nan)
+    stored_se = np.full((n, width), np.nan)
+    for i, s in enumerate(sessions):
+        pos[i, :lengths[i]] = np.asarray(s['items']) - 1
+        answers[i, :lengths[i]] = s['responses']
+        stored_theta[i, :lengths[i]] = [np.nan if v is None else v for v in s['theta']]
+        stored_se[i, :lengths[i]] = [np.nan if v is None else v for v in s['se']]
+    completed = np.array([s['status'] == 'completed' for s in sessions])
+    stored_vocabulary = np.array([-1 if s['vocabulary_size'] is None else s['vocabulary_size']
+                                  for s in sessions])
+
+    a, b, c = (np.asarray(x, dtype=float) for x in (bank.a, bank.b, bank.c))
+    high = np.asarray(bank.levels) >= cat_engine.HIGH_LEVEL
+    grid = cat_engine.THETA_GRID
+    use_grid = estimator == 'eap_grid' and bank.log_p is not None
+    if use_grid:
+        # tables[正誤, 項目] = log Q / log P（cat_engine.posterior と同じ値を float64 で加算）
+        tables = np.stack([np.asarray(bank.log_q), np.asarray(bank.log_p)]).astype(float)
+        log_post = np.zeros((n, len(grid)))
+    administered = np.zeros((n, len(bank)), dtype=bool)
+    high_count = np.zeros(n, dtype=np.int64)
+    flagged = np.zeros(n, dtype=bool)
+    previous_theta = np.zeros(n)
+    previous_se = np.zeros(n)
+
+    def record(rows, step, kind, stored, replayed):
+        for i, s, r in zip(rows, stored, replayed):
+            report.add(sessions[i]['session_id'], step, kind,
+                       s.item() if hasattr(s, 'item') else s, r.item() if hasattr(r, 'item') else r)
+        flagged[rows] = True
+
+    for k in range(width):
+        rows = np.flatnonzero(lengths > k)
+        item = pos[rows, k]
+        administered[rows, item] = True
+        high_count[rows] += high[item]
+
+        if use_grid:
+            log_post[rows] += tables[answers[rows, k], item]
+            post = log_post[rows]
+            weights = np.exp(post - post.max(axis=1, keepdims=True)) * cat_engine.PRIOR
+            weights /= weights.sum(axis=1, keepdims=True)
+            theta = weights @ grid
+            se = np.sqrt(np.einsum('ij,ij->i', (grid[None, :] - theta[:, None]) ** 2, weights))
+        else:
+            taken = pos[rows, :k + 1]
+            previous = (previous_theta[rows], previous_se[rows]) if k > 0 else None
+            theta, se = estimators.estimate(estimator, a[taken], b[taken], c[taken],
+                                            answers[rows, :k + 1].astype(float), previous)
+            theta, se = np.atleast_1d(theta), np.atleast_1d(se)
+            previous_theta[rows], previous_se[rows] = theta, se
+
+        for kind, stored, replayed in (('theta', stored_theta[rows, k], theta),
+                                       ('se', stored_se[rows, k], se)):
+            known = ~np.isnan(stored)
+            diff = np.where(known, np.abs(np.nan_to_num(stored) - replayed), 0.0)
+            diff = np.where(known & (np.isinf(stored) | np.isinf(replayed)),
+                            np.where(stored == replayed, 0.0, np.inf), diff)
+            if kind == 'theta':
+                report.max_theta_diff = max(report.max_theta_diff, float(diff.max()))
+            else:
+                report.max_se_diff = max(report.max_se_diff, float(diff.max()))
+            bad = diff > tolerance
+            record(rows[bad], k + 1, kind, stored[bad], replayed[bad])
+
+        # cat_engine.should_continue と同じ終了条件
+        count = k + 1
+        keep = (((se > cat_engine.SE_THRESHOLD) | (count < cat_engine.MIN_ITEMS)
+                 | (high_count[rows] < cat_engine.REQUIRED_HIGH)) & (count < cat_engine.MAX_ITEMS))
+
+        # cat_engine.select_next_item と同じ選択（Level 7+ の必須数を満たすまでは優先）
+        info = cat_engine.item_info_3pl(theta[:, None], a[None, :], b[None, :], c[None, :])
+        score = np.where(administered[rows], -np.inf, info)
+        need_high = high_count[rows] < cat_engine.REQUIRED_HIGH
+        high_score = np.where(high[None, :], score, -np.inf)
+        score = np.where((need_high & np.isfinite(high_score).any(axis=1))[:, None], high_score, score)
+        keep &= np.isfinite(score).any(axis=1)
+        choice = score.argmax(axis=1)
+
+        last = lengths[rows] == k + 1
+        stopped = ~last & ~keep
+        record(rows[stopped], k + 1, 'stop', ['continue'] * stopped.sum(), ['stop'] * stopped.sum())
+        following = pos[rows, min(k + 1, width - 1)]
+        moved = ~last & keep & (choice != following)
+        record(rows[moved], k + 1, 'next_item', following[moved] + 1, choice[moved] + 1)
+
+        ended = last & completed[rows]
+        continued = ended & keep
+        record(rows[continued], k + 1, 'stop', ['stop'] * continued.sum(), ['continue'] * continued.sum())
+        finished = ended & ~keep & (stored_vocabulary[rows] >= 0)
+        replayed_vocabulary = vocabulary.vocabulary_size(theta[finished])
+        wrong = replayed_vocabulary != stored_vocabulary[rows[finished]]
+        record(rows[finished][wrong], k + 1, 'vocabulary_size',
+               stored_vocabulary[rows[finished]][wrong], replayed_vocabulary[wrong])
+
+    report.sessions += n
+    report.answers += int(lengths.sum())
+    report.sessions_with_discrepancies += int(flagged.sum())
+
+
+# ============================================================================
+# 実行
+# ============================================================================
+
+def load_bank(csv_path=item_bank.PARAMETER_CSV, bank_version=None):
+    """
+    運用と同じ項目バンクのスナップショット（log P / log Q 表つき）
+
+    Raises:
+        ValueError: bank_version のスナップショットがない場合
+    """
+    if bank_version:
+        bank = item_bank.open_snapshot(bank_version)
+        if bank is None:
+            raise ValueError(f'項目バンクの版 {bank_version} のスナップショットがありません')
+        return bank
+    return item_bank.load_snapshot(csv_path)
+
+
+def replay(sessions, backend='batch', estimator=cat_engine.DEFAULT_ESTIMATOR, tolerance=DEFAULT_TOLERANCE,
+           workers=1, batch_size=DEFAULT_BATCH_SIZE, csv_path=item_bank.PARAMETER_CSV, bank_version=None,
+           max_examples=MAX_EXAMPLES, progress=None):
+    """
+    セッションを採点し直して保存値と比べる
+
+    Args:
+        sessions (iterable): stream_sessions の出力
+        backend (str): 'python' または 'batch'
+        estimator (str): 能力値推定法（estimators.ESTIMATORS のキー）
+        workers (int): python 方式のプロセス数
+        progress (callable): チャンクごとに Report を受け取る関数
+
+    Returns:
+        Report: 集計（seconds は読み込みを含む経過時間）
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend は {', '.join(BACKENDS)} のいずれかです")
+    estimators.get_estimator(estimator)
+
+    started = time.perf_counter()
+    report = Report(max_examples)
+    if backend == 'batch':
+        bank = load_bank(csv_path, bank_version)
+        for chunk in _chunks(sessions, batch_size):
+            replay_batch(bank, chunk, report, estimator, tolerance)
+            if progress:
+                progress(report)
+    elif workers > 1:
+        # 読み込みはこのスレッドで行い（sqlite3 の接続はスレッドをまたげない）、
+        # 未完了のチャンクを workers の2倍までに抑える
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(csv_path, bank_version)) as pool:
+            pending = collections.deque()
+            for chunk in _chunks(sessions, CHUNK_SIZE):
+                pending.append(pool.apply_async(_replay_chunk, ((chunk, estimator, tolerance, max_examples),)))
+                while len(pending) > 2 * workers:
+                    report.merge(pending.popleft().get())
+                    if progress:
+                        progress(report)
+            while pending:
+                report.merge(pending.popleft().get())
+                if progress:
+                    progress(report)
+    else:
+        bank = load_bank(csv_path, bank_version)
+        for chunk in _chunks(sessions, CHUNK_SIZE):
+            for session in chunk:
+                replay_session(bank, session, report, estimator, tolerance)
+            if progress:
+                progress(report)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='JACET CAT 過去のセッションの再採点')
+    parser.add_argument('--db', default=DB_PATH, help='データベースファイル')
+    parser.add_argument('--backend', choices=BACKENDS, default='batch', help='採点方式')
+    parser.add_argument('--estimator', default=cat_engine.DEFAULT_ESTIMATOR,
+                        help=f"能力値推定法（{', '.join(estimators.ESTIMATORS)}）")
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='python 方式のプロセス数')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='batch 方式の同時セッション数')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='theta / se の許容差')
+    parser.add_argument('--csv', default=item_bank.PARAMETER_CSV, help='項目パラメータCSV')
+    parser.add_argument('--bank-version', help='item_banks/ に保存された項目バンクの版')
+    parser.add_argument('--since', help='この日時以降に開始したセッション')
+    parser.add_argument('--until', help='この日時より前に開始したセッション')
+    parser.add_argument('--completed', action='store_true', help='完了したセッションのみ')
+    parser.add_argument('--limit', type=int, help='最大セッション数')
+    parser.add_argument('--json', action='store_true', help='結果を JSON で出力')
+    args = parser.parse_args()
+
+    def show_progress(report):
+        print(f"\r{report.sessions} セッション / {report.answers} 回答", end='', file=sys.stderr)
+
+    conn = sqlite3.connect(f'file:{args.db}?mode=ro', uri=True)
+    try:
+        sessions = stream_sessions(conn, args.since, args.until, args.completed, args.limit)
+        report = replay(sessions, args.backend, args.estimator, args.tolerance, args.workers,
+                        args.batch_size, args.csv, args.bank_version,
+                        progress=None if args.json else show_progress)
+    finally:
+        conn.close()
+
+    result = report.as_dict()
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(file=sys.stderr)
+        print(f"✓ {result['sessions']} セッション / {result['answers']} 回答を {result['seconds']} 秒で再採点"
+              f"（{result['sessions_per_second']} セッション/秒、{result['answers_per_second']} 回答/秒）")
+        print(f"  θ の最大差 {result['max_theta_diff']:.2e}、SE の最大差 {result['max_se_diff']:.2e}")
+        for kind, count in result['discrepancies'].items():
+            print(f"  {'✓' if count == 0 else '✗'} {kind}: {count}")
+        for example in result['examples']:
+            print(f"    {example['session_id']} {example['step']}問目 {example['kind']}: "
+                  f"保存値 {example['stored']} → 再採点 {example['replayed']}")
+    sys.exit(1 if any(report.discrepancies.values()) else 0)
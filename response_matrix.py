@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# response_matrix.py - 受験者 × 項目の反応行列を NPZ（CSR 形式）で出力
+
+"""
+responses をデータベースから1回の走査で受験者 × 項目の疎行列にまとめ、
+NumPy の NPZ（CSR 形式の配列と ID 対応表）として保存する。
+CSV を pandas でピボットする場合と違い、回答1件あたり数バイトしか使わない。
+
+保存される配列:
+    indptr        (int64,  セッション数 + 1)  行 i の回答は indptr[i]:indptr[i+1]
+    indices       (int32,  回答数)  列番号（item_ids の位置）
+    data          (int8,   回答数)  1 = 正答, 0 = 誤答（出題されていない項目は格納しない）
+    response_time (float32, 回答数)  回答時間（秒、include_times のときのみ、不明は NaN）
+    session_ids   (str,    セッション数)  行 → session_id
+    item_ids      (int32,  項目数)  列 → item_id（item_bank の全項目を昇順）
+    shape         (int64,  2)
+
+誤答の 0 も明示的に格納しているため、未出題（格納なし）と区別できる。
+scipy.sparse.csr_matrix((data, indices, indptr), shape) でそのまま読めるが、
+eliminate_zeros() を呼ぶと誤答が失われる点に注意。
+
+行はセッション、列内の回答は出題順。回答は (session_id, timestamp) の
+インデックス順に読むので並べ替えは発生しない。
+
+使い方:
+    python response_matrix.py --out matrix.npz --since 2025-04-01 --times
+"""
+
+import argparse
+import io
+import sqlite3
+
+import numpy as np
+
+import archive
+
+DB_PATH = 'jacet_cat.db'
+FORMAT_VERSION = 1
+FETCH_SIZE = 50000
+
+
+def _query(since=None, until=None, completed_only=False):
+    """抽出条件に応じた SQL（開始日時はセッションで判定）"""
+    conditions, params = [], []
+    if since:
+        conditions.append('s.start_time >= ?')
+        params.append(since)
+    if until:
+        conditions.append('s.start_time < ?')
+        params.append(until)
+    if completed_only:
+        conditions.append("s.status = 'completed'")
+
+    if conditions:
+        sql = f'''
+            SELECT r.session_id, r.item_id, r.response, r.response_time
+            FROM responses r
+            WHERE r.session_id IN (SELECT s.session_id FROM test_sessions s WHERE {' AND '.join(conditions)})
+            ORDER BY r.session_id, r.timestamp
+        '''
+    else:
+        sql = '''
+            SELECT session_id, item_id, response, response_time
+            FROM responses ORDER BY session_id, timestamp
+        '''
+    return sql, params
+
+
+def build_matrix(conn, since=None, until=None, completed_only=False,
+                 include_times=False, include_archive=False, archive_dir=archive.ARCHIVE_DIR):
+    """
+    反応行列（CSR 形式の配列）を作成
+
+    Args:
+        conn (sqlite3.Connection): 運用中のデータベースへの接続
+        since (str): この日時以降に開始したセッション（'YYYY-MM-DD' など）
+        until (str): この日時より前に開始したセッション
+        completed_only (bool): 完了したセッションのみ
+        include_times (bool): 回答時間の配列も作成する
+        include_archive (bool): 月別アーカイブのセッションも含める
+
+    Returns:
+        dict: 保存される配列（モジュールの説明を参照）
+    """
+    item_ids = np.array([row[0] for row in conn.execute('SELECT item_id FROM item_bank ORDER BY item_id')],
+                        dtype=np.int32)
+    sql, params = _query(since, until, completed_only)
+
+    sources = [conn]
+    if include_archive:
+        sources += [sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+                    for _, path in archive.list_archives(archive_dir)]
+
+    session_ids, row_lengths = [], []
+    items, answers, times = [], [], []
+    try:
+        for source in sources:
+            cursor = source.execute(sql, params)
+            current = None
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                # セッションは連続して並んでいるので、境界だけを数える
+                for session_id, item_id, response, response_time in rows:
+                    if session_id != current:
+                        current = session_id
+                        session_ids.append(session_id)
+                        row_lengths.append(0)
+                    row_lengths[-1] += 1
+                chunk = np.array([(row[1], row[2]) for row in rows], dtype=np.int64)
+                items.append(chunk[:, 0])
+                answers.append(chunk[:, 1].astype(np.int8))
+                if include_times:
+                    times.append(np.array([np.nan if row[3] is None else row[3] for row in rows],
+                                          dtype=np.float32))
+    finally:
+        for source in sources[1:]:
+            source.close()
+
+    observed = np.concatenate(items) if items else np.empty(0, dtype=np.int64)
+    # item_bank から削除された項目の回答も列として残す
+    missing = np.setdiff1d(observed, item_ids)
+    if len(missing):
+        item_ids = np.union1d(item_ids, missing).astype(np.int32)
+
+    matrix = {
+        'indptr': np.concatenate([[0], np.cumsum(row_lengths, dtype=np.int64)]).astype(np.int64),
+        'indices': np.searchsorted(item_ids, observed).astype(np.int32),
+        'data': np.concatenate(answers) if answers else np.empty(0, dtype=np.int8),
+        'session_ids': np.array(session_ids, dtype=str),
+        'item_ids': item_ids,
+        'shape': np.array([len(session_ids), len(item_ids)], dtype=np.int64),
+        'format_version': np.array(FORMAT_VERSION)
+    }
+    if include_times:
+        matrix['response_time'] = np.concatenate(times) if times else np.empty(0, dtype=np.float32)
+    return matrix
+
+
+def save_matrix(matrix, file):
+    """NPZ（圧縮）で保存。file はパスまたはファイルオブジェクト"""
+    np.savez_compressed(file, **matrix)
+
+
+def to_bytes(matrix):
+    """NPZ のバイト列（ダウンロード応答用）"""
+    buffer = io.BytesIO()
+    save_matrix(matrix, buffer)
+    return buffer.getvalue()
+
+
+def load_matrix(file):
+    """
+    save_matrix で保存した NPZ を読み込む
+
+    Returns:
+        dict: 配列の辞書
+    """
+    with np.load(file, allow_pickle=False) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+def session_pattern(matrix, row):
+    """
+    1セッションの反応パターン（cat_engine.estimate_ability にそのまま渡せる形）
+
+    Returns:
+        tuple: (item_id のリスト, 0/1 のリスト)
+    """
+    start, end = matrix['indptr'][row], matrix['indptr'][row + 1]
+    return (matrix['item_ids'][matrix['indices'][start:end]].tolist(),
+            matrix['data'][start:end].tolist())
+
+
+def to_scipy(matrix):
+    """scipy.sparse.csr_matrix に変換（scipy が必要）"""
+    from scipy.sparse import csr_matrix
+    return csr_matrix((matrix['data'], matrix['indices'], matrix['indptr']),
+                      shape=tuple(matrix['shape']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='JACET CAT 反応行列の出力（NPZ / CSR 形式）')
+    parser.add_argument('--db', default=DB_PATH, help='データベースファイル')
+    parser.add_argument('--out', default='response_matrix.npz', help='出力ファイル')
+    parser.add_argument('--since', help='この日時以降に開始したセッション')
+    parser.add_argument('--until', help='この日時より前に開始したセッション')
+    parser.add_argument('--completed', action='store_true', help='完了したセッションのみ')
+    parser.add_argument('--times', action='store_true', help='回答時間も出力する')
+    parser.add_argument('--archive', action='store_true', help='アーカイブ済みのセッションも含める')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f'file:{args.db}?mode=ro', uri=True)
+    try:
+        matrix = build_matrix(conn, args.since, args.until, args.completed, args.times, args.archive)
+    finally:
+        conn.close()
+    save_matrix(matrix, args.out)
+    n_sessions, n_items = matrix['shape']
+    print(f"✓ {args.out}: セッション {n_sessions} × 項目 {n_items}、回答 {len(matrix['data'])} 件")
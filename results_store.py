@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# results_store.py - 完了したセッションの結果（1セッション1行、変更しない）
+
+"""
+テスト完了時に、結果ページ・共有リンク・クラス別の結果一覧が必要とする値を
+session_results の1行にまとめて保存する。表示のたびに test_sessions を更新したり
+responses の回答履歴を読み直したりせず、主キーで1行を読むだけで済む。
+
+- 最終の θ と SE、語彙サイズと信用区間、レベル別の習得確率、項目バンクの版
+- 回答履歴と θ の推移（history 列、1回答 9 バイトの固定長で符号化）
+- 行は完了時に一度だけ書き込み（INSERT OR IGNORE）、以降は変更しない。
+  そのためプロセス内のキャッシュ（ResultCache）は削除の時だけ無効化すればよい。
+- 共有リンクは session_id に署名したトークン（share_token / session_from_token）。
+  トークンを知っていれば、ログインや受験中の Cookie なしで結果を表示できる。
+  署名鍵は呼び出し側（app.py の SECRET_KEY）が渡す。
+
+月別アーカイブへの移動では削除しない（共有リンクはアーカイブ後も有効）。
+古いセッションの削除（jobs.clear_sessions）では一緒に削除し、削除の目印の
+ファイル（deletion_marker）の更新時刻を進める。各プロセスの ResultCache は
+読み出しのたびにその時刻を確認し、変わっていれば全件を破棄する。
+
+使い方（この表ができる前に完了したセッションの結果を作成）:
+    python results_store.py --backfill
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+import vocabulary
+
+DB_PATH = 'jacet_cat.db'
+DEFAULT_CACHE_SIZE = 4096
+HISTORY_VERSION = 1
+BACKFILL_BATCH_SIZE = 500
+
+RESULTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS session_results (
+        session_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        start_time TIMESTAMP,
+        completed_at TIMESTAMP,
+        final_theta REAL,
+        final_se REAL,
+        vocabulary_size INTEGER,
+        vocabulary_lower INTEGER,
+        vocabulary_upper INTEGER,
+        items_administered INTEGER,
+        level_mastery TEXT,
+        bank_version TEXT,
+        history BLOB
+    )
+'''
+
+# 回答履歴（出題順、idx_responses_session_time を使用）
+HISTORY_SQL = '''
+    SELECT item_id, response, theta_after, response_time
+    FROM responses WHERE session_id = ? ORDER BY timestamp
+'''
+
+# 期間内に完了したセッション数（/api/system_status の本日の完了数、
+# end_time はローカル時刻なので日付の範囲で比較し、部分インデックスを使う）
+COMPLETED_BETWEEN_SQL = '''
+    SELECT COUNT(*) FROM test_sessions
+    WHERE status = 'completed' AND end_time >= ? AND end_time < ?
+'''
+
+# 1回答: item_id, 正誤, θ × 1000, 回答時間（0.1 秒単位）
+_ROW = struct.Struct('<IBhH')
+_NO_RESPONSE = 0xFF
+_NO_THETA = -0x8000
+_NO_TIME = 0xFFFF
+
+_COLUMNS = ('session_id', 'user_id', 'start_time', 'completed_at', 'final_theta', 'final_se',
+            'vocabulary_size', 'vocabulary_lower', 'vocabulary_upper', 'items_administered',
+            'level_mastery', 'bank_version', 'history')
+
+
+def ensure_results_table(conn):
+    """session_results がなければ作成"""
+    conn.execute(RESULTS_TABLE_SQL)
+
+
+def encode_history(rows):
+    """
+    回答履歴 → バイト列（先頭1バイトは形式の版）
+
+    Args:
+        rows (list): (item_id, response, theta_after, response_time) のリスト
+
+    Returns:
+        bytes: 1 + 9 × 回答数 バイト
+    """
+    parts = [bytes([HISTORY_VERSION])]
+    for item_id, response, theta_after, response_time in rows:
+        theta = _NO_THETA if theta_after is None else max(-0x7FFF, min(0x7FFF, round(theta_after * 1000)))
+        seconds = _NO_TIME if response_time is None else max(0, min(_NO_TIME - 1, round(response_time * 10)))
+        parts.append(_ROW.pack(int(item_id), _NO_RESPONSE if response is None else int(response),
+                               theta, seconds))
+    return b''.join(parts)
+
+
+def decode_history(data):
+    """
+    encode_history のバイト列 → 回答履歴
+
+    Returns:
+        list: item_id, response, theta_after, response_time を持つ dict のリスト
+
+    Raises:
+        ValueError: 未対応の形式
+    """
+    if not data:
+        return []
+    if data[0] != HISTORY_VERSION:
+        raise ValueError(f'未対応の回答履歴の形式です: {data[0]}')
+    history = []
+    for item_id, response, theta, seconds in _ROW.iter_unpack(data[1:]):
+        history.append({
+            'item_id': item_id,
+            'response': None if response == _NO_RESPONSE else response,
+            'theta_after': None if theta == _NO_THETA else theta / 1000,
+            'response_time': None if seconds == _NO_TIME else seconds / 10
+        })
+    return history
+
+
+def save_result(conn, session_id, final_result, history_rows, bank_version=None,
+                user_id=None, start_time=None, completed_at=None):
+    """
+    結果を1行保存（既にあれば何もしない）
+
+    Args:
+        final_result (dict): vocabulary.describe 済みの final_result
+        history_rows (list): encode_history に渡す回答履歴
+
+    Returns:
+        bool: 保存した場合 True
+    """
+    return conn.execute(f'''
+        INSERT OR IGNORE INTO session_results ({', '.join(_COLUMNS)})
+        VALUES ({', '.join('?' * len(_COLUMNS))})
+    ''', (
+        session_id,
+        user_id,
+        start_time,
+        completed_at or datetime.now(),
+        final_result.get('final_theta'),
+        final_result.get('final_se'),
+        final_result.get('vocabulary_size'),
+        final_result.get('vocabulary_lower'),
+        final_result.get('vocabulary_upper'),
+        final_result.get('items_administered'),
+        json.dumps(final_result.get('level_mastery')),
+        bank_version,
+        encode_history(history_rows)
+    )).rowcount > 0
+
+
+def complete_session(conn, session_id, final_result, bank_version=None, now=None):
+    """
+    セッションを完了にし、結果の行を保存（コミットは呼び出し側）
+
+    回答の記録と同じトランザクションで呼ぶと、最後の回答・完了状態・結果が
+    まとめて書き込まれる。既に完了しているセッションでは何もしない。
+
+    Returns:
+        dict: 保存した結果（load_result と同じ形）。完了済みなら None
+    """
+    now = now or datetime.now()
+    completed = conn.execute('''
+        UPDATE test_sessions
+        SET end_time = ?, final_theta = ?, final_se = ?,
+            vocabulary_size = ?, items_administered = ?, status = 'completed'
+        WHERE session_id = ? AND status != 'completed'
+    ''', (
+        now,
+        final_result.get('final_theta'),
+        final_result.get('final_se'),
+        final_result.get('vocabulary_size'),
+        final_result.get('items_administered'),
+        session_id
+    )).rowcount
+    if not completed:
+        return None
+
+    user_id, start_time = conn.execute('''
+        SELECT user_id, start_time FROM test_sessions WHERE session_id = ?
+    ''', (session_id,)).fetchone()
+    history = conn.execute(HISTORY_SQL, (session_id,)).fetchall()
+    save_result(conn, session_id, final_result, history, bank_version, user_id, start_time, now)
+    return load_result(conn, session_id)
+
+
+def load_result(conn, session_id):
+    """
+    保存済みの結果を読む
+
+    Returns:
+        dict: session_results の列（level_mastery はリスト、history は
+              decode_history の形）。なければ None
+    """
+    row = conn.execute(f'''
+        SELECT {', '.join(_COLUMNS)} FROM session_results WHERE session_id = ?
+    ''', (session_id,)).fetchone()
+    if row is None:
+        return None
+    result = dict(zip(_COLUMNS, row))
+    if result['level_mastery']:
+        result['level_mastery'] = json.loads(result['level_mastery'])
+    if result['level_mastery'] is None:
+        # 結果テンプレートは「未定義」で近似表示に切り替える
+        del result['level_mastery']
+    result['history'] = decode_history(result['history'])
+    return result
+
+
+def backfill(conn, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    結果の行がない完了済みセッションの結果を作成
+
+    信用区間・習得確率は保存済みの final_theta / final_se から求める
+    （vocabulary.describe の正規近似）。
+
+    Returns:
+        int: 作成した件数
+    """
+    ensure_results_table(conn)
+    created = 0
+    while True:
+        sessions = conn.execute('''
+            SELECT s.session_id, s.user_id, s.start_time, s.end_time, s.final_theta, s.final_se,
+                   s.vocabulary_size, s.items_administered
+            FROM test_sessions s
+            LEFT JOIN session_results r ON r.session_id = s.session_id
+            WHERE s.status = 'completed' AND s.final_theta IS NOT NULL AND r.session_id IS NULL
+            LIMIT ?
+        ''', (batch_size,)).fetchall()
+        if not sessions:
+            return created
+        with conn:
+            for session_id, user_id, start_time, end_time, theta, se, size, items in sessions:
+                final_result = {'final_theta': theta, 'final_se': se, 'items_administered': items}
+                if size is not None:
+                    final_result['vocabulary_size'] = size
+                vocabulary.describe(final_result)
+                history = conn.execute(HISTORY_SQL, (session_id,)).fetchall()
+                created += save_result(conn, session_id, final_result, history,
+                                       user_id=user_id, start_time=start_time, completed_at=end_time)
+
+
+def deletion_marker(db_path):
+    """結果の行を削除したことを知らせるファイル（更新時刻だけを使う）"""
+    return f'{db_path}.results-deleted'
+
+
+def mark_deleted(db_path):
+    """結果の行を削除した（コミットの後に呼ぶ）。全プロセスの ResultCache が破棄される"""
+    path = deletion_marker(db_path)
+    with open(path, 'a'):
+        pass
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+
+def _marker_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ResultCache:
+    """
+    保存済みの結果の LRU キャッシュ（スレッドセーフ）
+
+    結果の行は変更されないため、有効期限は不要。削除（mark_deleted）の後は
+    目印のファイルの更新時刻が変わるので、次の読み出しで全件を破棄する。
+    結果がない（まだ完了していない）セッションはキャッシュしない。
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, marker_path=None):
+        """
+        Args:
+            max_size (int): 保持する件数（0 でキャッシュしない）
+            marker_path (str): deletion_marker のパス（None なら確認しない）
+        """
+        self.max_size = max_size
+        self.marker_path = marker_path
+        self._marker = _marker_mtime(marker_path) if marker_path else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def _check_marker(self):
+        """削除があれば全件を破棄（ロックを取ってから呼ぶ）"""
+        if self.marker_path is None:
+            return
+        marker = _marker_mtime(self.marker_path)
+        if marker != self._marker:
+            self._marker = marker
+            self._entries.clear()
+            self._invalidations += 1
+
+    def get(self, session_id, load):
+        """
+        結果を返す（キャッシュになければ load(session_id) で読む）
+
+        Args:
+            load (callable): session_id → 結果 dict または None
+        """
+        with self._lock:
+            self._check_marker()
+            marker = self._marker
+            result = self._entries.get(session_id)
+            if result is not None:
+                self._entries.move_to_end(session_id)
+                self._hits += 1
+                return result
+            self._misses += 1
+
+        result = load(session_id)
+        if result is not None and self.max_size > 0:
+            with self._lock:
+                # 読んでいる間に削除があった場合は、消えた行かもしれないので保持しない
+                self._check_marker()
+                if self._marker != marker:
+                    return result
+                self._entries[session_id] = result
+                self._entries.move_to_end(session_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        """全件を破棄"""
+        with self._lock:
+            self._entries.clear()
+
+    def status(self):
+        """/api/system_status 用の状態"""
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size,
+                    'hits': self._hits, 'misses': self._misses,
+                    'invalidations': self._invalidations}
+
+
+def _serializer(secret):
+    return URLSafeSerializer(secret, salt='session-results')
+
+
+def share_token(session_id, secret):
+    """共有リンク用のトークン（session_id に署名したもの）"""
+    return _serializer(secret).dumps(session_id)
+
+
+def session_from_token(token, secret):
+    """
+    共有リンクのトークン → session_id
+
+    Returns:
+        str: session_id（署名が不正なら None）
+    """
+    try:
+        session_id = _serializer(secret).loads(token)
+    except BadSignature:
+        return None
+    return session_id if isinstance(session_id, str) else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='JACET CAT 完了したセッションの結果')
+    parser.add_argument('--db', default=DB_PATH, help='データベースファイル')
+    parser.add_argument('--backfill', action='store_true', help='結果の行がない完了済みセッションの結果を作成')
+    args = parser.parse_args()
+
+    if not args.backfill:
+        parser.print_help()
+    else:
+        conn = sqlite3.connect(args.db, timeout=10.0)
+        try:
+            print(f"✓ {backfill(conn)} 件の結果を作成しました")
+        finally:
+            conn.close()
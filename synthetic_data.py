@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# synthetic_data.py - 運用規模の合成データベースの作成（性能検証用）
+
+"""
+create_database.py と同じスキーマに、実際の項目バンクと 3PL モデルから生成した
+受験データを大量に投入する（例: 100万セッション・約2,500万回答）。
+ベンチマークや実行計画のチェック（db_trace.py --check-plans）を運用規模で行うためのもの。
+
+- 受験者の θ は標準正規分布から引き、各セッションは cat_engine と同じ規則
+  （801 点の EAP、SE 0.4 / 20〜30 問、Level 7+ を最低 2 問、最大情報量による選択、
+  最初の項目は Level 3-5 から無作為）で出題・採点する。多数のセッションを
+  同時に1問ずつ進めるベクトル化版で、θ・SE・次項目は cat_engine と同じ値になる
+  （replay.py で採点し直すと食い違いはない）。
+- 正誤は真の θ での 3PL の正答確率、回答時間は正答確率が低いほど長くなる対数正規分布。
+- 開始時刻は days 日間に平日・日中が多くなるよう分布させる。状態は完了が大半で、
+  abandon_rate の割合が途中で放棄、直近 1 時間に開始したセッションは受験中。
+- セッションは開始時刻順に workers 個のプロセスへ連続区間で割り当てる。各プロセスは
+  一時ファイルの SQLite（インデックスなし）へ一括挿入し、最後に親プロセスが
+  順に INSERT ... SELECT で取り込む。回答の id は開始時刻順になる（運用と同じ）。
+- 取り込み中はインデックスを外し、最後に migrate で作り直してから
+  項目統計の再集計・ANALYZE・WAL への切り替えを行う。
+
+使い方:
+    python synthetic_data.py --out synthetic.db --sessions 1000000 --workers 8
+"""
+
+import argparse
+import contextlib
+import multiprocessing
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import archive
+import cat_engine
+import cdc
+import provisioning
+import results_store
+from create_database import INDEXES, PARAMETER_CSV, create_database, enable_wal, migrate
+from item_bank import ItemBank, build_records, build_tables
+
+DEFAULT_SESSIONS = 10000
+DEFAULT_DAYS = 365
+DEFAULT_ABANDON_RATE = 0.08
+BATCH_SIZE = 2000
+
+SESSION_COLUMNS = ('session_id', 'user_id', 'start_time', 'end_time', 'final_theta', 'final_se',
+                   'vocabulary_size', 'items_administered', 'status', 'ip_address', 'user_agent',
+                   'created_at')
+RESPONSE_COLUMNS = ('session_id', 'item_id', 'item_word', 'item_level', 'response', 'correct_answer',
+                    'user_answer', 'timestamp', 'theta_before', 'theta_after', 'se_after',
+                    'response_time')
+
+
+def start_times(n, days=DEFAULT_DAYS, seed=0, now=None):
+    """
+    開始時刻（昇順、datetime64[us]）
+
+    平日を週末の 4 倍、9〜17 時を中心にした時刻で生成する。
+    """
+    rng = np.random.default_rng(seed)
+    now = np.datetime64(now or 'now', 'us')
+    first_day = (now - np.timedelta64(days, 'D')).astype('datetime64[D]')
+    day_offsets = np.arange(days)
+    weekday = (first_day + day_offsets).astype('datetime64[D]').view('int64')
+    weights = np.where((weekday + 3) % 7 < 5, 4.0, 1.0)  # 1970-01-01 は木曜日
+    day = rng.choice(day_offsets, size=n, p=weights / weights.sum())
+    seconds = np.clip(rng.normal(13 * 3600, 3 * 3600, size=n), 0, 86399)
+    times = (first_day.astype('datetime64[us]') + day.astype('timedelta64[D]')
+             + (seconds * 1e6).astype('int64').astype('timedelta64[us]'))
+    return np.sort(np.minimum(times, now - np.timedelta64(60, 's')))
+
+
+def format_times(times):
+    """datetime64 → sqlite3 の既定の変換と同じ 'YYYY-MM-DD HH:MM:SS.ffffff'"""
+    return np.char.replace(np.datetime_as_string(times, unit='us'), 'T', ' ')
+
+
+def simulate_batch(bank, rng, n):
+    """
+    n セッションを同時に1問ずつ進める
+
+    Returns:
+        dict: theta_true / items / responses / theta_after / se_after（セッション × 出題順、
+              未出題は -1 / NaN）と items_count
+    """
+    n_items = len(bank)
+    # tables[正誤, 項目] = log Q / log P（cat_engine.posterior と同じ値を float64 で加算）
+    tables = np.stack([bank.log_q, bank.log_p]).astype(float)
+    grid = cat_engine.THETA_GRID
+    a, b, c = (np.asarray(x, dtype=float) for x in (bank.a, bank.b, bank.c))
+    high = bank.levels >= cat_engine.HIGH_LEVEL
+    initial = np.flatnonzero(np.isin(bank.levels, cat_engine.INITIAL_LEVELS))
+
+    theta_true = rng.standard_normal(n)
+    p_true = cat_engine.prob_3pl(theta_true[:, None], bank.a[None, :], bank.b[None, :], bank.c[None, :])
+
+    max_items = cat_engine.MAX_ITEMS
+    items = np.full((n, max_items), -1, dtype=np.int64)
+    answers = np.zeros((n, max_items), dtype=np.int8)
+    theta_after = np.full((n, max_items), np.nan)
+    se_after = np.full((n, max_items), np.nan)
+    # 対数尤度（事前分布は cat_engine.posterior と同じく exp の後に掛ける）
+    log_post = np.zeros((n, len(grid)))
+    administered = np.zeros((n, n_items), dtype=bool)
+    high_count = np.zeros(n, dtype=np.int64)
+    active = np.ones(n, dtype=bool)
+    rows = np.arange(n)
+    current = rng.choice(initial, size=n)
+
+    for k in range(max_items):
+        idx = rows[active]
+        item = current[idx]
+        correct = rng.random(len(idx)) < p_true[idx, item]
+        items[idx, k] = item
+        answers[idx, k] = correct
+        administered[idx, item] = True
+        high_count[idx] += high[item]
+        post = log_post[idx] + tables[correct.astype(np.int64), item]
+        log_post[idx] = post
+
+        weights = np.exp(post - post.max(axis=1, keepdims=True)) * cat_engine.PRIOR
+        weights /= weights.sum(axis=1, keepdims=True)
+        theta = weights @ grid
+        se = np.sqrt(np.einsum('ij,ij->i', (grid[None, :] - theta[:, None]) ** 2, weights))
+        theta_after[idx, k] = theta
+        se_after[idx, k] = se
+
+        # cat_engine.should_continue と同じ終了条件
+        count = k + 1
+        keep = ((se > cat_engine.SE_THRESHOLD) | (count < cat_engine.MIN_ITEMS)
+                | (high_count[idx] < cat_engine.REQUIRED_HIGH)) & (count < max_items)
+        active[idx[~keep]] = False
+        idx, theta = idx[keep], theta[keep]
+        if len(idx) == 0:
+            break
+
+        # cat_engine.select_next_item と同じ最大情報量（推定した θ での情報量、
+        # Level 7+ の必須数を満たすまでは Level 7+ を優先）
+        info = cat_engine.item_info_3pl(theta[:, None], a[None, :], b[None, :], c[None, :])
+        score = np.where(administered[idx], -np.inf, info)
+        need_high = high_count[idx] < cat_engine.REQUIRED_HIGH
+        high_score = np.where(high[None, :], score, -np.inf)
+        has_high = np.isfinite(high_score).any(axis=1)
+        score = np.where((need_high & has_high)[:, None], high_score, score)
+        current[idx] = score.argmax(axis=1)
+
+    return {
+        'theta_true': theta_true,
+        'items': items,
+        'responses': answers,
+        'theta_after': theta_after,
+        'se_after': se_after,
+        'items_count': (items >= 0).sum(axis=1)
+    }
+
+
+def _worker(args):
+    """1区間のセッションを生成して一時ファイルの SQLite に書き込む"""
+    shard_path, first, times, csv_path, abandon_rate, seed, now = args
+    rng = np.random.default_rng(seed)
+    records = build_records(pd.read_csv(csv_path))
+    bank = ItemBank(records, tables=build_tables(records))
+    words = records['word'].astype(str)
+    correct_answers = records['correct_answer'].astype(str)
+    distractors = records['distractors'].astype(str)
+
+    conn = sqlite3.connect(shard_path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute(f"CREATE TABLE test_sessions ({', '.join(SESSION_COLUMNS)})")
+    conn.execute(f"CREATE TABLE responses ({', '.join(RESPONSE_COLUMNS)})")
+    recent = np.datetime64(now, 'us') - np.timedelta64(1, 'h')
+
+    for offset in range(0, len(times), BATCH_SIZE):
+        batch_times = times[offset:offset + BATCH_SIZE]
+        n = len(batch_times)
+        sim = simulate_batch(bank, rng, n)
+        count = sim['items_count']
+
+        # 状態: 直近 1 時間の開始は受験中、それ以外は一部を途中で放棄
+        status = np.where(rng.random(n) < abandon_rate, 'abandoned', 'completed').astype(object)
+        status[batch_times >= recent] = 'active'
+        truncated = status != 'completed'
+        count = np.where(truncated, np.minimum(count, rng.integers(1, cat_engine.MIN_ITEMS, size=n)), count)
+
+        # 回答時間: 正答確率が低い（難しい）ほど長い対数正規分布
+        positions = np.maximum(sim['items'], 0)
+        p = cat_engine.prob_3pl(sim['theta_true'][:, None], bank.a[positions], bank.b[positions],
+                                bank.c[positions])
+        rt = np.round(np.exp(rng.normal(np.log(4.0) + 0.8 * (1 - p), 0.4)), 3)
+        elapsed = np.cumsum(rt + 0.5, axis=1)
+        answered_at = batch_times[:, None] + (elapsed * 1e6).astype('int64').astype('timedelta64[us]')
+        answered_text = format_times(answered_at)
+        start_text = format_times(batch_times)
+
+        session_ids = np.array([str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(n)],
+                               dtype=object)
+        last = count - 1
+        final_theta = sim['theta_after'][np.arange(n), last]
+        final_se = sim['se_after'][np.arange(n), last]
+        completed = status == 'completed'
+        end_text = np.where(status != 'active', answered_text[np.arange(n), last], None)
+        sessions = list(zip(
+            session_ids.tolist(),
+            [f'synthetic-{first + offset + i:07d}' for i in range(n)],
+            start_text.tolist(),
+            end_text.tolist(),
+            np.where(completed, final_theta, None).tolist(),
+            np.where(completed, final_se, None).tolist(),
+            np.where(completed, cat_engine.estimate_vocabulary_size(final_theta), None).tolist(),
+            np.where(completed, count, None).tolist(),
+            status.tolist(),
+            ['127.0.0.1'] * n,
+            ['synthetic'] * n,
+            start_text.tolist()
+        ))
+
+        # 回答（セッション順・出題順）
+        ii, kk = np.nonzero(np.arange(cat_engine.MAX_ITEMS)[None, :] < count[:, None])
+        pos = sim['items'][ii, kk]
+        is_correct = sim['responses'][ii, kk].astype(np.int64)
+        theta_after = sim['theta_after'][ii, kk]
+        theta_before = np.where(kk == 0, 0.0, sim['theta_after'][ii, np.maximum(kk - 1, 0)])
+        user_answer = np.where(is_correct == 1, correct_answers[pos],
+                               distractors[pos, rng.integers(3, size=len(pos))])
+        responses = list(zip(
+            session_ids[ii].tolist(),
+            (pos + 1).tolist(),
+            words[pos].tolist(),
+            bank.levels[pos].astype(np.int64).tolist(),
+            is_correct.tolist(),
+            correct_answers[pos].tolist(),
+            user_answer.tolist(),
+            answered_text[ii, kk].tolist(),
+            theta_before.tolist(),
+            theta_after.tolist(),
+            sim['se_after'][ii, kk].tolist(),
+            rt[ii, kk].tolist()
+        ))
+
+        with conn:
+            conn.executemany(f"INSERT INTO test_sessions VALUES ({','.join('?' * len(SESSION_COLUMNS))})",
+                             sessions)
+            conn.executemany(f"INSERT INTO responses VALUES ({','.join('?' * len(RESPONSE_COLUMNS))})",
+                             responses)
+    conn.close()
+    return shard_path
+
+
+def _index_names():
+    return [re.search(r'INDEX IF NOT EXISTS (\w+)', sql).group(1) for sql in INDEXES]
+
+
+def generate(db_path, sessions=DEFAULT_SESSIONS, workers=None, days=DEFAULT_DAYS,
+             abandon_rate=DEFAULT_ABANDON_RATE, csv_path=PARAMETER_CSV, seed=1, progress=print):
+    """
+    合成データベースを作成
+
+    Args:
+        db_path (str): 作成するデータベース（既存のファイルは create_database がバックアップする）
+        sessions (int): セッション数
+        workers (int): 生成プロセス数（既定は CPU 数）
+        days (int): 開始時刻を分布させる日数
+        abandon_rate (float): 途中で放棄するセッションの割合
+
+    Returns:
+        dict: sessions / responses の件数と所要秒数
+    """
+    started = time.perf_counter()
+    workers = max(1, min(workers or os.cpu_count() or 1, sessions))
+    now = np.datetime64('now', 'us')
+    times = start_times(sessions, days, seed, now)
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        create_database(db_path, csv_path)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bounds = np.linspace(0, sessions, workers + 1).astype(int)
+        tasks = [(os.path.join(tmp, f'shard_{k}.db'), int(bounds[k]), times[bounds[k]:bounds[k + 1]],
+                  csv_path, abandon_rate, seed * 1000 + k, str(now))
+                 for k in range(workers)]
+        if workers == 1:
+            shards = [_worker(tasks[0])]
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                shards = pool.map(_worker, tasks)
+        progress(f"生成: {time.perf_counter() - started:.1f} 秒")
+
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode = OFF')
+            conn.execute('PRAGMA synchronous = OFF')
+            for name in _index_names():
+                conn.execute(f'DROP INDEX IF EXISTS {name}')
+            # 開始時刻順の区間を順に取り込む（回答の id が時刻順になる）
+            for shard in shards:
+                conn.execute('ATTACH DATABASE ? AS shard', (shard,))
+                conn.execute('BEGIN')
+                conn.execute(f"INSERT INTO test_sessions ({', '.join(SESSION_COLUMNS)}) "
+                             f"SELECT * FROM shard.test_sessions")
+                conn.execute(f"INSERT INTO responses ({', '.join(RESPONSE_COLUMNS)}) "
+                             f"SELECT * FROM shard.responses ORDER BY rowid")
+                conn.execute('COMMIT')
+                conn.execute('DETACH DATABASE shard')
+        finally:
+            conn.close()
+    progress(f"取り込み: {time.perf_counter() - started:.1f} 秒")
+
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            provisioning.ensure_provisioning_table(conn)
+            results_store.ensure_results_table(conn)
+            archive.ensure_totals_table(conn)
+            cdc.ensure_change_tracking(conn)
+            # 項目統計を回答から集計（admin_update_statistics と同じ値）
+            conn.execute('''
+                UPDATE item_statistics
+                SET exposure_count = t.n, total_responses = t.n, correct_count = t.correct,
+                    p_value = CAST(t.correct AS FLOAT) / t.n, last_used = t.last_used
+                FROM (SELECT item_id, COUNT(*) AS n, SUM(response) AS correct, MAX(timestamp) AS last_used
+                      FROM responses GROUP BY item_id) AS t
+                WHERE item_statistics.item_id = t.item_id
+            ''')
+        conn.execute('ANALYZE')
+        counts = {
+            'sessions': conn.execute('SELECT COUNT(*) FROM test_sessions').fetchone()[0],
+            'responses': conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        }
+    finally:
+        conn.close()
+    enable_wal(db_path)
+    counts['seconds'] = round(time.perf_counter() - started, 1)
+    progress(f"インデックス・統計: {counts['seconds']} 秒")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='JACET CAT 運用規模の合成データベースを作成')
+    parser.add_argument('--out', default='synthetic.db', help='作成するデータベース')
+    parser.add_argument('--sessions', type=int, default=DEFAULT_SESSIONS, help='セッション数')
+    parser.add_argument('--workers', type=int, help='生成プロセス数（既定は CPU 数）')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='開始時刻を分布させる日数')
+    parser.add_argument('--abandon-rate', type=float, default=DEFAULT_ABANDON_RATE,
+                        help='途中で放棄するセッションの割合')
+    parser.add_argument('--csv', default=PARAMETER_CSV, help='項目パラメータCSV')
+    parser.add_argument('--seed', type=int, default=1, help='乱数の種')
+    args = parser.parse_args()
+
+    counts = generate(args.out, args.sessions, args.workers, args.days, args.abandon_rate,
+                      args.csv, args.seed)
+    print(f"✓ {args.out}: セッション {counts['sessions']} / 回答 {counts['responses']}"
+          f"（{counts['seconds']} 秒）")
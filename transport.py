@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# transport.py - HTTP 応答の圧縮と条件付き GET
+
+"""
+通信量を減らすための応答処理（Flask・ASGI 共通）
+
+- compress_body     : Accept-Encoding に応じて br（brotli がある場合）/ gzip で圧縮
+- compress_response : Flask の after_request 用。一定サイズ以上のテキスト系応答を圧縮
+- conditional       : 弱い ETag と Last-Modified を付け、If-None-Match /
+                      If-Modified-Since が一致すれば 304 にする
+- compress_stream   : ストリーミング応答を少しずつ圧縮（本文全体を溜めない）
+
+ETag は弱い検証子（W/"..."）にしているため、圧縮の有無にかかわらず同じ値で比較できる。
+"""
+
+import gzip
+import hashlib
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:  # brotli は任意（なければ gzip のみ）
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = (
+    'application/json', 'text/html', 'text/csv', 'text/plain',
+    'text/css', 'text/javascript', 'application/javascript'
+)
+
+
+def choose_encoding(accept_encoding):
+    """
+    Accept-Encoding ヘッダーから使用する圧縮方式を選ぶ
+
+    Returns:
+        str: 'br' / 'gzip'（圧縮しない場合は None）
+    """
+    if not accept_encoding:
+        return None
+    offers = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return parse_accept_header(accept_encoding).best_match(offers)
+
+
+def compress_body(body, accept_encoding, min_size=COMPRESS_MIN_SIZE):
+    """
+    応答本文を圧縮する
+
+    Args:
+        body (bytes): 応答本文
+        accept_encoding (str): リクエストの Accept-Encoding ヘッダー
+        min_size (int): これより小さい本文は圧縮しない
+
+    Returns:
+        tuple: (本文, Content-Encoding または None)
+    """
+    if len(body) < min_size:
+        return body, None
+    encoding = choose_encoding(accept_encoding)
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    return body, None
+
+
+def compress_response(response, accept_encoding, min_size=COMPRESS_MIN_SIZE):
+    """
+    Flask の応答を圧縮する（after_request から呼ぶ）
+
+    ファイル送信・ストリーミング・圧縮済み・304 などの応答はそのまま返す。
+    """
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body, encoding = compress_body(response.get_data(), accept_encoding, min_size)
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def compress_stream(chunks, accept_encoding):
+    """
+    ストリーミング応答の本文を少しずつ圧縮する
+
+    Args:
+        chunks (iterable): 本文の断片（str または bytes）
+        accept_encoding (str): リクエストの Accept-Encoding ヘッダー
+
+    Returns:
+        tuple: (圧縮した断片のジェネレーター, Content-Encoding または None)
+    """
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return chunks, None
+
+    def generate():
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            compress, finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 = gzip 形式
+            compress, finish = compressor.compress, compressor.flush
+        for chunk in chunks:
+            data = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield finish()
+
+    return generate(), encoding
+
+
+def conditional(response, request, last_modified=None, etag=None):
+    """
+    応答本文から弱い ETag を付け、条件付きリクエストなら 304 にする
+
+    Args:
+        response (flask.Response): JSON などの応答（本文確定済み）
+        request (flask.Request): 現在のリクエスト
+        last_modified (datetime): データの更新時刻（スナップショットの作成時刻など）
+        etag (str): ETag（ストリーミング応答など本文から作れない場合に指定）
+
+    Returns:
+        flask.Response: 一致すれば本文なしの 304
+    """
+    response.set_etag(etag or hashlib.sha1(response.get_data()).hexdigest()[:20], weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(microsecond=0)
+    # キャッシュは許可するが、使用前に毎回検証させる
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# vocabulary.py - 能力値（θ）から語彙サイズへの変換表と信用区間
+
+"""
+語彙サイズ V(θ) = Σ_level 1000 / (1 + exp(-(θ - d_level))) を EAP の評価点
+（seq(-4, 4, by = 0.01)）上で一度だけ計算しておき、以降は表の参照と線形補間で
+変換する。V は θ について単調増加なので、θ の分位点をそのまま表に通せば
+語彙サイズの分位点（信用区間）になる。
+
+- vocabulary_size      : θ（配列可）→ 語彙サイズ
+- level_mastery        : θ → レベル別の習得確率
+- posterior_summary    : 評価点上の事後分布 → 点推定と信用区間（複数受験者を一括処理）
+- interval_from_normal : 保存済みの final_theta / final_se → 信用区間（一括変換）
+"""
+
+import numpy as np
+
+from estimators import GRID
+
+# 各レベルの平均困難度（JACET 8000語、各レベル1000語）
+LEVEL_DIFFICULTIES = np.array([-2.206, -1.512, -0.701, -0.075, 0.748, 1.152, 1.504, 2.089])
+WORDS_PER_LEVEL = 1000
+CREDIBLE_LEVEL = 0.95
+
+MASTERY_TABLE = 1 / (1 + np.exp(-(GRID[:, None] - LEVEL_DIFFICULTIES)))
+VOCABULARY_TABLE = WORDS_PER_LEVEL * MASTERY_TABLE.sum(axis=1)
+
+
+def vocabulary_size(theta):
+    """
+    θ から語彙サイズ（整数に丸める）
+
+    Args:
+        theta (float or array): 能力値（評価点の範囲外は端の値）
+
+    Returns:
+        int or ndarray: 語彙サイズ
+    """
+    size = np.rint(np.interp(theta, GRID, VOCABULARY_TABLE)).astype(int)
+    return int(size) if np.ndim(size) == 0 else size
+
+
+def level_mastery(theta):
+    """
+    θ からレベル別の習得確率
+
+    Returns:
+        ndarray: 形状 (..., 8)
+    """
+    theta = np.asarray(theta, dtype=float)
+    return np.stack([np.interp(theta, GRID, MASTERY_TABLE[:, k])
+                     for k in range(len(LEVEL_DIFFICULTIES))], axis=-1)
+
+
+def _quantiles(cdf, probs):
+    """評価点上の累積分布（形状 (..., G)）から θ の分位点を線形補間で求める"""
+    cdf = np.atleast_2d(cdf)
+    out = np.empty((cdf.shape[0], len(probs)))
+    for k, p in enumerate(probs):
+        right = np.minimum(np.argmax(cdf >= p, axis=1), len(GRID) - 1)
+        left = np.maximum(right - 1, 0)
+        rows = np.arange(cdf.shape[0])
+        c0, c1 = cdf[rows, left], cdf[rows, right]
+        weight = np.where(c1 > c0, (p - c0) / np.where(c1 > c0, c1 - c0, 1), 1.0)
+        out[:, k] = GRID[left] + np.clip(weight, 0, 1) * (GRID[right] - GRID[left])
+    return out
+
+
+def posterior_summary(posterior, level=CREDIBLE_LEVEL):
+    """
+    評価点上の事後分布から語彙サイズの点推定と信用区間
+
+    Args:
+        posterior (array): 形状 (G,) または (受験者数, G)、各行の和は 1
+        level (float): 信用区間の水準
+
+    Returns:
+        dict: vocabulary_size（事後平均 θ の変換値）, vocabulary_lower, vocabulary_upper
+              （posterior が2次元なら各値は配列）
+    """
+    posterior = np.asarray(posterior, dtype=float)
+    single = posterior.ndim == 1
+    posterior = np.atleast_2d(posterior)
+
+    theta = posterior @ GRID
+    tail = (1 - level) / 2
+    bounds = _quantiles(np.cumsum(posterior, axis=1), (tail, 1 - tail))
+
+    summary = {
+        'vocabulary_size': vocabulary_size(theta),
+        'vocabulary_lower': vocabulary_size(bounds[:, 0]),
+        'vocabulary_upper': vocabulary_size(bounds[:, 1])
+    }
+    if single:
+        summary = {key: int(value[0]) for key, value in summary.items()}
+    return summary
+
+
+def interval_from_normal(theta, se, level=CREDIBLE_LEVEL):
+    """
+    事後分布を N(theta, se²) で近似した語彙サイズの信用区間
+
+    事後分布が保存されていない過去のセッション（final_theta / final_se のみ）や
+    R スコアリングの結果に使う。
+
+    Args:
+        theta, se (float or array): 能力値と標準誤差
+
+    Returns:
+        tuple: (下限, 上限)
+    """
+    from statistics import NormalDist
+
+    z = NormalDist().inv_cdf(1 - (1 - level) / 2)
+    theta = np.asarray(theta, dtype=float)
+    se = np.nan_to_num(np.asarray(se, dtype=float), nan=0.0, posinf=0.0)
+    return vocabulary_size(theta - z * se), vocabulary_size(theta + z * se)
+
+
+def describe(final_result):
+    """
+    final_result（R / Python スコアリング共通）に語彙サイズと信用区間を補う
+
+    信用区間がなければ final_theta / final_se の正規近似で求める。
+    """
+    theta = final_result.get('final_theta')
+    if theta is None:
+        return final_result
+    if 'vocabulary_lower' not in final_result:
+        lower, upper = interval_from_normal(theta, final_result.get('final_se') or 0.0)
+        final_result['vocabulary_lower'] = int(lower)
+        final_result['vocabulary_upper'] = int(upper)
+    final_result.setdefault('vocabulary_size', vocabulary_size(theta))
+    final_result.setdefault('level_mastery', [round(float(p), 4) for p in level_mastery(theta)])
+    return final_result